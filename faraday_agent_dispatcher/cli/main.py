@@ -23,10 +23,7 @@ import sys
 import click
 import asyncio
 
-from aiohttp import ClientSession
-
-from faraday_agent_dispatcher.cli.wizard import Wizard, DEFAULT_PAGE_SIZE
-from faraday_agent_dispatcher.dispatcher_io import Dispatcher, DispatcherNamespace
+from faraday_agent_dispatcher.cli.utils.general_inputs import DEFAULT_PAGE_SIZE
 from faraday_agent_dispatcher import config, __version__
 from faraday_agent_dispatcher.utils.text_utils import Bcolors
 import faraday_agent_dispatcher.logger as logging
@@ -53,16 +50,19 @@ def process_config_file(config_filepath: Path, logger):
 
 
 async def main(config_file, logger, token):
+    # The dispatcher pulls socketio and aiohttp, only load them to run it
+    from faraday_agent_dispatcher.dispatcher_io import Dispatcher, DispatcherNamespace
+
     config_file = process_config_file(config_file, logger)
 
-    async with ClientSession(raise_for_status=True, trust_env=True) as session:
-        try:
-            dispatcher = Dispatcher(session, config_file)
-        except ValueError as ex:
-            print(f"{Bcolors.FAIL}Error configuring dispatcher: " f"{Bcolors.BOLD}{str(ex)}{Bcolors.ENDC}")
-            print(f"Try checking your config file located at {Bcolors.BOLD}" f"{config.CONFIG_FILENAME}{Bcolors.ENDC}")
-            return 1
+    try:
+        dispatcher = Dispatcher(None, config_file)
+    except ValueError as ex:
+        print(f"{Bcolors.FAIL}Error configuring dispatcher: " f"{Bcolors.BOLD}{str(ex)}{Bcolors.ENDC}")
+        print(f"Try checking your config file located at {Bcolors.BOLD}" f"{config.CONFIG_FILENAME}{Bcolors.ENDC}")
+        return 1
 
+    try:
         loop = asyncio.get_event_loop()
         for signame in ("SIGINT", "SIGTERM"):
             loop.add_signal_handler(
@@ -71,6 +71,7 @@ async def main(config_file, logger, token):
             )
 
         await dispatcher.register(token)
+        dispatcher.start_spool_replay()
         namespace = DispatcherNamespace(namespace="/dispatcher")
         namespace.dispatcher = dispatcher
         dispatcher.sio.register_namespace(namespace)
@@ -80,8 +81,9 @@ async def main(config_file, logger, token):
         uri = f"{schema}://{namespace.dispatcher.host}:{namespace.dispatcher.websocket_port}"
         logger.info(f"Trying to connect to: {uri}")
 
-        await dispatcher.sio.connect(uri)
-        await dispatcher.sio.wait()
+        await dispatcher.stay_connected(uri)
+    finally:
+        await dispatcher.http_pool.close()
 
     return 0 if dispatcher.sigterm_received else 1
 
@@ -146,6 +148,8 @@ def setting_logger(debug, log_level, logdir):
     help="Size of paged options",
 )
 def config_wizard(config_filepath, logdir, log_level, debug, page_size):
+    from faraday_agent_dispatcher.cli.wizard import Wizard
+
     setting_logger(debug, log_level, logdir)
 
     config_filepath = config_filepath or config.CONFIG_FILENAME
@@ -9,6 +9,8 @@ from typing import List, Callable, Optional, Awaitable, TypeVar
 
 T = TypeVar("T")
 
+DEFAULT_PAGE_SIZE = 10
+
 
 def get_default_value_and_choices(default_value, choices):
     if "DEBUG_INPUT_MODE" in os.environ:
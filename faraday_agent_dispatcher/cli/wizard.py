@@ -28,13 +28,12 @@ from faraday_agent_dispatcher.cli.utils.general_inputs import (
     get_default_value_and_choices,
     process_choice_errors,
     choice_paged_option,
+    DEFAULT_PAGE_SIZE,
 )
 import faraday_agent_dispatcher.logger as logging
 
 logger = logging.get_logger()
 
-DEFAULT_PAGE_SIZE = 10
-
 
 class Wizard:
     MAX_BUFF_SIZE = 65536
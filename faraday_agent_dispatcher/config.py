@@ -26,9 +26,9 @@ from faraday_agent_dispatcher.utils.control_values_utils import (
     control_executors,
 )
 from faraday_agent_dispatcher.utils.text_utils import Bcolors
-from faraday_agent_parameters_types.utils import get_manifests
 from faraday_agent_dispatcher import __version__ as current_version
 import os
+import sys
 import logging
 from pathlib import Path
 from shutil import copy
@@ -42,15 +42,18 @@ except KeyError:
 
 LOGS_PATH = FARADAY_PATH / "logs"
 CONFIG_PATH = FARADAY_PATH / "config"
+SPOOL_PATH = FARADAY_PATH / "spool"
+DELTA_PATH = FARADAY_PATH / "delta.sqlite"
+QUARANTINE_PATH = FARADAY_PATH / "quarantine"
 
 
-if not FARADAY_PATH.exists():
-    print(f"{Bcolors.WARNING}The configuration folder" f" does not exist, creating" f" it{Bcolors.ENDC}")
-    FARADAY_PATH.mkdir()
-if not LOGS_PATH.exists():
-    LOGS_PATH.mkdir()
-if not CONFIG_PATH.exists():
-    CONFIG_PATH.mkdir()
+def create_folders():
+    if not FARADAY_PATH.exists():
+        print(f"{Bcolors.WARNING}The configuration folder" f" does not exist, creating" f" it{Bcolors.ENDC}")
+        FARADAY_PATH.mkdir()
+    if not CONFIG_PATH.exists():
+        CONFIG_PATH.mkdir()
+
 
 CONFIG_FILENAME = CONFIG_PATH / "dispatcher.yaml"
 
@@ -73,6 +76,8 @@ def reset_config(filepath: Path):
     else:
         filename = filepath
         filepath = filepath.parent
+    create_folders()
+    manifest_registry.invalidate()
     if not filename.is_file():
         if (filepath / "dispatcher.ini").is_file():
             filename = update_config_from_ini_to_yaml((filepath / "dispatcher.ini"))
@@ -278,6 +283,9 @@ def update_config(config: Dict):
             config[Sections.SERVER]["websocket_port"] = int(config[Sections.SERVER]["websocket_port"])
         if isinstance(config[Sections.SERVER]["ssl"], str):
             config[Sections.SERVER]["ssl"] = config[Sections.SERVER]["ssl"] == "True"
+        for option in ("compress_uploads", "spool"):
+            if isinstance(config[Sections.SERVER].get(option), str):
+                config[Sections.SERVER][option] = config[Sections.SERVER][option] == "True"
     if Sections.AGENT in config and Sections.EXECUTORS in config[Sections.AGENT]:
         for executor in config[Sections.AGENT]["executors"]:
             if (
@@ -353,6 +361,41 @@ def control_config():
             __control_dict[section][option](option, value)
 
 
+class ManifestRegistry:
+    """
+    The manifests of the official executors, loaded once for the whole
+    process and keyed by dispatcher version. Reloading the config
+    invalidates them, `generation` counts the invalidations so derived data
+    can be rebuilt.
+    """
+
+    def __init__(self):
+        self._manifests: Dict[str, dict] = {}
+        self.generation = 0
+
+    def manifests(self, version: str = current_version) -> dict:
+        if version not in self._manifests:
+            # Slow to import, only needed once the executors are loaded
+            from faraday_agent_parameters_types.utils import get_manifests
+
+            self._manifests[version] = get_manifests(version)
+        return self._manifests[version]
+
+    def get(self, executor_name: str, version: str = current_version) -> dict:
+        return self.manifests(version).get(executor_name)
+
+    def invalidate(self):
+        self._manifests.clear()
+        parameters_utils = sys.modules.get("faraday_agent_parameters_types.utils")
+        if parameters_utils is not None:
+            parameters_utils.get_manifests.cache_clear()
+        get_repo_exec.cache_clear()
+        self.generation += 1
+
+
+manifest_registry = ManifestRegistry()
+
+
 @lru_cache(maxsize=None)
 def get_repo_exec() -> dict:
     """
@@ -360,7 +403,7 @@ def get_repo_exec() -> dict:
     and values the name of the manifest
     """
     executer_names = {}
-    metadata = get_manifests(current_version)
+    metadata = manifest_registry.manifests()
     for key, value in metadata.items():
         executer_names[value.get("repo_executor")] = key
     return executer_names
@@ -0,0 +1,246 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.host_merge import record_digest
+
+logger = logging.get_logger()
+
+HOST_NESTED_KEYS = ("services", "vulnerabilities", "credentials")
+
+
+class FingerprintStore:
+    """
+    SQLite store with the fingerprints of the hosts, services, vulnerabilities
+    and credentials uploaded to each workspace by each executor, and when
+    their last full sync was.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                workspace TEXT NOT NULL,
+                executor TEXT NOT NULL,
+                digest BLOB NOT NULL,
+                PRIMARY KEY (workspace, executor, digest)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS full_syncs (
+                workspace TEXT NOT NULL,
+                executor TEXT NOT NULL,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (workspace, executor)
+            );
+            """
+        )
+
+    def load(self, workspace: str, executor: str) -> Set[bytes]:
+        rows = self.db.execute(
+            "SELECT digest FROM fingerprints WHERE workspace = ? AND executor = ?", (workspace, executor)
+        )
+        return {row[0] for row in rows}
+
+    def add(self, workspace: str, executor: str, digests: Iterable[bytes]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO fingerprints VALUES (?, ?, ?)",
+                ((workspace, executor, digest) for digest in digests),
+            )
+
+    def last_full_sync(self, workspace: str, executor: str) -> Optional[float]:
+        row = self.db.execute(
+            "SELECT synced_at FROM full_syncs WHERE workspace = ? AND executor = ?", (workspace, executor)
+        ).fetchone()
+        return row[0] if row else None
+
+    def replace(self, workspace: str, executor: str, digests: Iterable[bytes]):
+        """Replaces the fingerprints with the ones of a full sync, and records when it was"""
+        with self.db:
+            self.db.execute("DELETE FROM fingerprints WHERE workspace = ? AND executor = ?", (workspace, executor))
+            self.db.executemany(
+                "INSERT OR IGNORE INTO fingerprints VALUES (?, ?, ?)",
+                ((workspace, executor, digest) for digest in digests),
+            )
+            self.db.execute("INSERT OR REPLACE INTO full_syncs VALUES (?, ?, ?)", (workspace, executor, time.time()))
+
+    def close(self):
+        self.db.close()
+
+
+class HostFingerprints:
+    """The digests of a host and its nested records, computed once for every workspace"""
+
+    def __init__(self, host: dict):
+        self.host = host
+        context = str(host.get("ip", "")).encode("utf-8") + b"\0"
+        self.digest = record_digest(
+            {key: value for key, value in host.items() if key not in HOST_NESTED_KEYS}, context
+        )
+        self.vulnerabilities = self.digests(host.get("vulnerabilities"), context)
+        self.credentials = self.digests(host.get("credentials"), context)
+        self.services = []
+        for service in host.get("services") or []:
+            service_context = context + f"{service.get('port')}/{service.get('protocol')}".encode("utf-8") + b"\0"
+            self.services.append(
+                (
+                    service,
+                    record_digest(
+                        {key: value for key, value in service.items() if key != "vulnerabilities"}, service_context
+                    ),
+                    self.digests(service.get("vulnerabilities"), service_context),
+                )
+            )
+
+    @staticmethod
+    def digests(records: Optional[List[dict]], context: bytes) -> List[Tuple[dict, bytes]]:
+        return [(record, record_digest(record, context)) for record in records or []]
+
+
+class DeltaFilter:
+    """
+    Drops from the results of a run the records already uploaded by the
+    executor to each workspace, so only new or changed ones are sent. A
+    host is sent with its new records; when nothing of it changed, it is not
+    sent at all. Fingerprints are stored only once the server accepted them.
+
+    Every workspace is fully synced in its first run, when the run asks for
+    it (`full_resync`) or when its last full sync is older than
+    `resync_interval` seconds. A full sync replaces the stored fingerprints
+    in `finish`, only if every upload to the workspace succeeded, otherwise
+    the next run syncs it fully again.
+    """
+
+    SKIPPED_KINDS = ("hosts", "services", "vulnerabilities", "service_vulnerabilities", "credentials")
+
+    def __init__(
+        self,
+        store: FingerprintStore,
+        executor: str,
+        workspaces: List[str],
+        full_resync: bool = False,
+        resync_interval: float = 0,
+    ):
+        self.store = store
+        self.executor = executor
+        self.known: Dict[str, Set[bytes]] = {}
+        self.full_resync: Dict[str, bool] = {}
+        self.failed: Set[str] = set()
+        self.skipped = {workspace: dict.fromkeys(self.SKIPPED_KINDS, 0) for workspace in workspaces}
+        for workspace in workspaces:
+            last_sync = store.last_full_sync(workspace, executor)
+            resync = (
+                full_resync
+                or last_sync is None
+                or (resync_interval > 0 and time.time() - last_sync >= resync_interval)
+            )
+            if resync:
+                logger.info(f"Full sync of executor {executor} results to workspace {workspace}")
+                self.known[workspace] = set()
+            else:
+                self.known[workspace] = store.load(workspace, executor)
+            self.full_resync[workspace] = resync
+
+    @staticmethod
+    def fingerprints(payload: dict) -> List[HostFingerprints]:
+        return [HostFingerprints(host) for host in payload.get("hosts") or [] if isinstance(host, dict)]
+
+    def filter(
+        self, workspace: str, payload: dict, fingerprints: List[HostFingerprints]
+    ) -> Tuple[Optional[dict], Set[bytes]]:
+        """
+        The payload to send to the workspace and the fingerprints it adds,
+        or None if there is nothing new in it
+        """
+        known = self.known[workspace]
+        skipped = self.skipped[workspace]
+        new_digests = set()
+
+        def new_records(records: List[Tuple[dict, bytes]], kind: str) -> List[dict]:
+            result = []
+            for record, digest in records:
+                if digest in known:
+                    skipped[kind] += 1
+                else:
+                    new_digests.add(digest)
+                    result.append(record)
+            return result
+
+        hosts = []
+        for host in fingerprints:
+            vulnerabilities = new_records(host.vulnerabilities, "vulnerabilities")
+            credentials = new_records(host.credentials, "credentials")
+            services = []
+            for service, digest, service_vulnerabilities in host.services:
+                new_vulnerabilities = new_records(service_vulnerabilities, "service_vulnerabilities")
+                if digest in known and not new_vulnerabilities:
+                    skipped["services"] += 1
+                    continue
+                new_digests.add(digest)
+                service = {key: value for key, value in service.items() if key != "vulnerabilities"}
+                if new_vulnerabilities:
+                    service["vulnerabilities"] = new_vulnerabilities
+                services.append(service)
+            if host.digest in known and not (vulnerabilities or credentials or services):
+                skipped["hosts"] += 1
+                continue
+            new_digests.add(host.digest)
+            delta_host = {key: value for key, value in host.host.items() if key not in HOST_NESTED_KEYS}
+            for key, records in (("services", services), ("vulnerabilities", vulnerabilities)):
+                if records:
+                    delta_host[key] = records
+            if credentials:
+                delta_host["credentials"] = credentials
+            hosts.append(delta_host)
+
+        if fingerprints and not hosts and payload.keys() <= {"hosts"}:
+            return None, new_digests
+        delta_payload = dict(payload)
+        if "hosts" in payload:
+            delta_payload["hosts"] = hosts + [host for host in payload["hosts"] if not isinstance(host, dict)]
+        return delta_payload, new_digests
+
+    def commit(self, workspace: str, digests: Set[bytes]):
+        if not digests:
+            return
+        if not self.full_resync[workspace]:
+            self.store.add(workspace, self.executor, digests)
+        self.known[workspace].update(digests)
+
+    def fail(self, workspace: str):
+        self.failed.add(workspace)
+
+    def finish(self):
+
+        for workspace, resync in self.full_resync.items():
+            if not resync:
+                continue
+            if workspace in self.failed:
+                logger.warning(f"Full sync to workspace {workspace} incomplete, it will be retried in the next run")
+            else:
+                self.store.replace(workspace, self.executor, self.known[workspace])
+
+    def summary(self) -> dict:
+        return {
+            workspace: {"full_resync": self.full_resync[workspace], **skipped}
+            for workspace, skipped in self.skipped.items()
+        }
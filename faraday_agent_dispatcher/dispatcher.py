@@ -43,6 +43,7 @@ from faraday_agent_dispatcher.executor_helper import (
 from faraday_agent_dispatcher.utils.control_values_utils import (
     control_registration_token,
 )
+from faraday_agent_dispatcher.utils.retry_utils import RetryPolicy, RetryStats, request_with_retry
 from faraday_agent_dispatcher.utils.text_utils import Bcolors
 from faraday_agent_dispatcher.utils.url_utils import api_url, websocket_url
 import faraday_agent_dispatcher.logger as logging
@@ -121,20 +122,28 @@ class Dispatcher:
             Dispatcher.TaskLabels.EXECUTOR: [],
             Dispatcher.TaskLabels.CONNECTION_CHECK: [],
         }
+        self.retry_policy = RetryPolicy.from_config(config.instance[Sections.SERVER])
+        self.retry_stats = RetryStats()
         self.sigterm_received = False
 
+    async def request_with_retry(self, request_f, description: str):
+        return await request_with_retry(request_f, self.retry_policy, stats=self.retry_stats, description=description)
+
     async def reset_websocket_token(self):
         # I'm built so I ask for websocket token
         headers = {"Authorization": f"Agent {self.agent_token}"}
-        websocket_token_response = await self.session.post(
-            api_url(
-                self.host,
-                self.api_port,
-                postfix="/_api/v3/agent_websocket_token",
-                secure=self.api_ssl_enabled,
+        websocket_token_response = await self.request_with_retry(
+            lambda: self.session.post(
+                api_url(
+                    self.host,
+                    self.api_port,
+                    postfix="/_api/v3/agent_websocket_token",
+                    secure=self.api_ssl_enabled,
+                ),
+                headers=headers,
+                **self.api_kwargs,
             ),
-            headers=headers,
-            **self.api_kwargs,
+            "Websocket token request",
         )
 
         websocket_token_json = await websocket_token_response.json()
@@ -160,14 +169,17 @@ class Dispatcher:
             )
             logger.info(f"token_registration_url: {token_registration_url}")
             try:
-                token_response = await self.session.post(
-                    token_registration_url,
-                    json={
-                        "token": registration_token,
-                        "name": self.agent_name,
-                        "description": self.description,
-                    },
-                    **self.api_kwargs,
+                token_response = await self.request_with_retry(
+                    lambda: self.session.post(
+                        token_registration_url,
+                        json={
+                            "token": registration_token,
+                            "name": self.agent_name,
+                            "description": self.description,
+                        },
+                        **self.api_kwargs,
+                    ),
+                    "Agent registration",
                 )
                 token = await token_response.json()
                 self.agent_token = token["token"]
@@ -439,8 +451,9 @@ class Dispatcher:
                             self.api_kwargs,
                             command_json,
                             start_date,
+                            executor,
                         ).process_f(),
-                        StdErrLineProcessor(process).process_f(),
+                        StdErrLineProcessor(process, executor).process_f(),
                     ]
                     await self.websocket.send(
                         json.dumps(
@@ -583,7 +596,7 @@ class Dispatcher:
             # self.executor_tasks[Dispatcher.TaskLabels.CONNECTION_CHECK].\
             #    append(check_connection_task)
             # await check_connection_task
-            await self.session.get(server_url, **kwargs)
+            await self.request_with_retry(lambda: self.session.get(server_url, **kwargs), "Connection check")
 
         except (ClientConnectorCertificateError, ClientConnectorSSLError) as e:
             logger.debug("Invalid SSL Certificate", exc_info=e)
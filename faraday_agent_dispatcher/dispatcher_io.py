@@ -17,34 +17,54 @@
 
 import os
 import ssl
+from signal import SIGTERM
 import json
 
-import aiohttp
 import socketio
 import asyncio
 from datetime import datetime
 from pathlib import Path
 from asyncio import Task
-from typing import List, Dict
+from typing import List, Dict, Optional
 import sys
 import websockets
 from websockets.exceptions import ConnectionClosedError, ConnectionClosedOK
 from aiohttp import ClientTimeout
 from aiohttp.client_exceptions import (
+    ClientConnectionError,
+    ClientError,
     ClientResponseError,
     ClientConnectorError,
     ClientConnectorCertificateError,
     ClientConnectorSSLError,
 )
 import click
-from faraday_agent_dispatcher.config import reset_config
+from faraday_agent_dispatcher.config import manifest_registry, reset_config
+from faraday_agent_dispatcher.delta import DeltaFilter, FingerprintStore
 from faraday_agent_dispatcher.executor_helper import (
     StdErrLineProcessor,
     StdOutLineProcessor,
+    StdOutLogProcessor,
 )
+from faraday_agent_dispatcher.outbox import Outbox
+from faraday_agent_dispatcher.progress import ProgressReporter
+from faraday_agent_dispatcher.result_channel import ResultChannel
+from faraday_agent_dispatcher.run_context import RunContext
+from faraday_agent_dispatcher.scheduler import RunScheduler
+from faraday_agent_dispatcher.spool import Spool
+from faraday_agent_dispatcher.uploader import bulk_create_headers, bulk_create_url
+from faraday_agent_dispatcher.validation import ResultValidator
 from faraday_agent_dispatcher.utils.control_values_utils import (
     control_registration_token,
 )
+from faraday_agent_dispatcher.utils.process_utils import (
+    process_group_kwargs,
+    signal_process_group,
+    terminate_process_group,
+)
+from faraday_agent_dispatcher.utils import json_utils
+from faraday_agent_dispatcher.utils.http_utils import HttpPool
+from faraday_agent_dispatcher.utils.retry_utils import RetryPolicy, RetryStats, request_with_retry
 from faraday_agent_dispatcher.utils.text_utils import Bcolors
 from faraday_agent_dispatcher.utils.url_utils import api_url, websocket_url
 import faraday_agent_dispatcher.logger as logging
@@ -60,7 +80,7 @@ from faraday_agent_dispatcher.utils.metadata_utils import (
 )
 from faraday_agent_dispatcher.cli.utils.model_load import set_repo_params
 from faraday_agent_dispatcher.executor import Executor
-from faraday_agent_parameters_types.utils import type_validate, get_manifests
+from faraday_agent_parameters_types.utils import type_validate
 
 logger = logging.get_logger()
 logging.setup_logging()
@@ -70,6 +90,7 @@ class Dispatcher:
     class TaskLabels:
         CONNECTION_CHECK = "Connection check"
         EXECUTOR = "EXECUTOR"
+        SPOOL_REPLAY = "Spool replay"
 
     def __init__(self, session, config_path=None, *args, **kwargs):
         reset_config(filepath=config_path)
@@ -88,7 +109,6 @@ class Dispatcher:
         )
         self.agent_name = config.instance[Sections.AGENT]["agent_name"]
         self.description = config.instance[Sections.AGENT].get("description", "")
-        self.session = session
         self.websocket = None
         self.websocket_token = None
         self.executors = {
@@ -96,58 +116,86 @@ class Dispatcher:
             for executor_name, executor_data in config.instance[Sections.AGENT].get("executors", {}).items()
         }
         self.ws_ssl_enabled = self.api_ssl_enabled = config.instance[Sections.SERVER].get("ssl", False)
-        self.sio = socketio.AsyncClient()
         ssl_cert_path = config.instance[Sections.SERVER].get("ssl_cert", None)
         ssl_ignore = config.instance[Sections.SERVER].get("ssl_ignore", False)
         if not Path(ssl_cert_path).exists():
             raise ValueError(f"SSL cert does not exist in path {ssl_cert_path}")
+        ssl_context = None
         if self.api_ssl_enabled:
             logger.info("api_ssl is enabled")
             if ssl_cert_path:
-                ssl_cert_context = ssl.create_default_context(cafile=ssl_cert_path)
-                self.api_kwargs = {"ssl": ssl_cert_context}
-                self.ws_kwargs = {"ssl": ssl_cert_context}
-                connector = aiohttp.TCPConnector(ssl=ssl_cert_context)
-                http_session = aiohttp.ClientSession(connector=connector)
-                self.sio = socketio.AsyncClient(http_session=http_session)
-            else:
-                if ssl_ignore or "HTTPS_PROXY" in os.environ:
-                    logger.info(f"ssl_ignore config is {ssl_ignore}")
-                    if "HTTPS_PROXY" in os.environ:
-                        logger.info("HTTPS_PROXY variable found in environment")
-                    ignore_ssl_context = ssl.create_default_context()
-                    ignore_ssl_context.check_hostname = False
-                    ignore_ssl_context.verify_mode = ssl.CERT_NONE
-                    self.api_kwargs = {"ssl": ignore_ssl_context}
-                    self.ws_kwargs = {"ssl": ignore_ssl_context}
-                    connector = aiohttp.TCPConnector(ssl=ignore_ssl_context)
-                    http_session = aiohttp.ClientSession(connector=connector)
-                    self.sio = socketio.AsyncClient(http_session=http_session)
-                else:
-                    self.api_kwargs: Dict[str, object] = {}
-                    self.ws_kwargs: Dict[str, object] = {}
+                ssl_context = ssl.create_default_context(cafile=ssl_cert_path)
+            elif ssl_ignore or "HTTPS_PROXY" in os.environ:
+                logger.info(f"ssl_ignore config is {ssl_ignore}")
+                if "HTTPS_PROXY" in os.environ:
+                    logger.info("HTTPS_PROXY variable found in environment")
+                ssl_context = ssl.create_default_context()
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+        if ssl_context is not None:
+            self.api_kwargs: Dict[str, object] = {"ssl": ssl_context}
+            self.ws_kwargs: Dict[str, object] = {"ssl": ssl_context}
         else:
             self.api_kwargs: Dict[str, object] = {}
             self.ws_kwargs: Dict[str, object] = {}
+        # REST calls and socket.io share the connections of the pool
+        self.http_pool = HttpPool.from_config(config.instance[Sections.SERVER], ssl_context)
+        self.session = (
+            session
+            if session is not None
+            else self.http_pool.session(raise_for_status=True, json_serialize=json_utils.dumps)
+        )
+        # Reconnections are supervised by stay_connected, to refresh the token first
+        self.sio = socketio.AsyncClient(http_session=self.http_pool.session(), reconnection=False)
         self.execution_ids = None
+        # Runs of the socket.io namespace, by execution id
+        self.runs: Dict[int, RunContext] = {}
         self.executor_tasks: Dict[str, List[Task]] = {
             Dispatcher.TaskLabels.EXECUTOR: [],
             Dispatcher.TaskLabels.CONNECTION_CHECK: [],
+            Dispatcher.TaskLabels.SPOOL_REPLAY: [],
         }
+        server_config = config.instance[Sections.SERVER]
+        self.spool = (
+            Spool(
+                config.SPOOL_PATH,
+                max_size=int(server_config.get("spool_max_size", 512 * 1024 * 1024)),
+                replay_concurrency=int(server_config.get("spool_replay_concurrency", 2)),
+            )
+            if server_config.get("spool", True)
+            else None
+        )
+        self.fingerprint_store: Optional[FingerprintStore] = None
+        self.spool_replay_interval = float(server_config.get("spool_replay_interval", 30))
+        self.retry_policy = RetryPolicy.from_config(server_config)
+        self.reconnect_policy = RetryPolicy(
+            base_delay=float(server_config.get("reconnect_delay", 1)),
+            max_delay=float(server_config.get("reconnect_delay_max", 60)),
+        )
+        self.reconnections = 0
+        self.outbox = Outbox(int(server_config.get("outbox_size", 1000)))
+        self.retry_stats = RetryStats()
+        self.scheduler = RunScheduler(
+            int(config.instance[Sections.AGENT].get("max_concurrent_runs", 0)),
+            {name: executor.max_concurrent_runs for name, executor in self.executors.items()},
+        )
         self.sigterm_received = False
 
     async def reset_websocket_token(self):
         # I'm built so I ask for websocket token
         headers = {"Authorization": f"Agent {self.agent_token}"}
-        websocket_token_response = await self.session.post(
-            api_url(
-                self.host,
-                self.api_port,
-                postfix="/_api/v3/agent_websocket_token",
-                secure=self.api_ssl_enabled,
+        websocket_token_response = await self.request_with_retry(
+            lambda: self.session.post(
+                api_url(
+                    self.host,
+                    self.api_port,
+                    postfix="/_api/v3/agent_websocket_token",
+                    secure=self.api_ssl_enabled,
+                ),
+                headers=headers,
+                **self.api_kwargs,
             ),
-            headers=headers,
-            **self.api_kwargs,
+            "Websocket token request",
         )
 
         websocket_token_json = await websocket_token_response.json()
@@ -173,14 +221,17 @@ class Dispatcher:
             )
             logger.info(f"token_registration_url: {token_registration_url}")
             try:
-                token_response = await self.session.post(
-                    token_registration_url,
-                    json={
-                        "token": registration_token,
-                        "name": self.agent_name,
-                        "description": self.description,
-                    },
-                    **self.api_kwargs,
+                token_response = await self.request_with_retry(
+                    lambda: self.session.post(
+                        token_registration_url,
+                        json={
+                            "token": registration_token,
+                            "name": self.agent_name,
+                            "description": self.description,
+                        },
+                        **self.api_kwargs,
+                    ),
+                    "Agent registration",
                 )
                 token = await token_response.json()
                 self.agent_token = token["token"]
@@ -451,8 +502,9 @@ class Dispatcher:
                             self.api_kwargs,
                             command_json,
                             start_date,
+                            executor,
                         ).process_f(),
-                        StdErrLineProcessor(process).process_f(),
+                        StdErrLineProcessor(process, executor).process_f(),
                     ]
                     await self.websocket.send(
                         json.dumps(
@@ -527,7 +579,13 @@ class Dispatcher:
             )
 
     @staticmethod
-    async def create_process(executor: Executor, args: dict, plugin_args: dict):
+    async def create_process(
+        executor: Executor,
+        args: dict,
+        plugin_args: dict,
+        cgroup_path: Path = None,
+        result_channel: ResultChannel = None,
+    ):
         env = os.environ.copy()
         # Executor Variables
         if isinstance(args, dict):
@@ -549,6 +607,10 @@ class Dispatcher:
         # Executor Defaults
         for varenv, value in executor.varenvs.items():
             env[f"{varenv.upper()}"] = value
+        pass_fds = ()
+        if result_channel is not None:
+            env.update(result_channel.prepare())
+            pass_fds = result_channel.pass_fds
         command = executor.cmd
         if command.endswith(".py") and executor.repo_executor:
             command = f"{sys.executable} {command}"
@@ -559,9 +621,103 @@ class Dispatcher:
             env=env,
             limit=executor.max_size,
             # If the config is not set, use async.io default
+            preexec_fn=executor.limits.preexec_fn(cgroup_path),
+            pass_fds=pass_fds,
+            **process_group_kwargs(),
         )
+        if result_channel is not None:
+            result_channel.spawned()
         return process
 
+    def delta_filter(self, run: RunContext) -> Optional[DeltaFilter]:
+        if not run.executor.delta_uploads:
+            return None
+        if self.fingerprint_store is None:
+            self.fingerprint_store = FingerprintStore(config.DELTA_PATH)
+        return DeltaFilter(
+            self.fingerprint_store,
+            run.executor.name,
+            run.workspaces,
+            full_resync=bool(run.data.get("full_resync", False)),
+            resync_interval=run.executor.delta_resync_interval * 3600,
+        )
+
+    @staticmethod
+    def result_validator(executor: Executor) -> Optional[ResultValidator]:
+        # One for each run, so the counters in its status are only of that run
+        if not executor.validate_results:
+            return None
+        return ResultValidator(
+            executor.name,
+            config.QUARANTINE_PATH / f"{executor.name}.ndjson" if executor.quarantine_results else None,
+        )
+
+    async def stay_connected(self, uri: str):
+        """
+        Keeps the socket.io connection up until the dispatcher is closed. When
+        it drops, running executors keep running while it reconnects with
+        exponential backoff, with a new websocket token.
+        """
+        delay = 0
+        connected = False
+        while not self.sigterm_received:
+            try:
+                if connected:
+                    self.websocket_token = await self.reset_websocket_token()
+                await self.sio.connect(uri)
+            except (socketio.exceptions.ConnectionError, ClientError, asyncio.TimeoutError) as e:
+                delay = self.reconnect_policy.next_delay(delay)
+                logger.warning(f"Can not connect to {uri}: {e}. Retrying in {delay:.1f} seconds")
+                await asyncio.sleep(delay)
+                continue
+            if connected:
+                self.reconnections += 1
+                logger.info("Reconnected to the server")
+            connected = True
+            delay = 0
+            await self.sio.wait()
+            if not self.sigterm_received:
+                logger.warning("Disconnected from the server, reconnecting")
+
+    async def request_with_retry(self, request_f, description: str):
+        return await request_with_retry(request_f, self.retry_policy, stats=self.retry_stats, description=description)
+
+    async def post_spooled(self, workspace: str, body: bytes) -> Optional[int]:
+        try:
+            res = await self.session.post(
+                bulk_create_url(workspace, self.api_ssl_enabled),
+                data=body,
+                headers=bulk_create_headers() + [("Content-Type", "application/json")],
+                raise_for_status=False,
+                **self.api_kwargs,
+            )
+        except (ClientConnectionError, asyncio.TimeoutError) as e:
+            logger.debug("Spool replay could not reach the server", exc_info=e)
+            return None
+        if res.status == 201:
+            logger.info("Spooled data sent to bulk create")
+        return res.status
+
+    async def replay_spool(self):
+        if self.spool is None or not self.spool.pending():
+            return
+        logger.info("Replaying spooled payloads")
+        try:
+            await self.spool.replay(self.post_spooled)
+        except Exception as e:
+            logger.error(f"Error replaying spooled payloads: {e}")
+            logger.debug("Spool replay traceback", exc_info=e)
+
+    async def replay_spool_loop(self):
+        while True:
+            await self.replay_spool()
+            await asyncio.sleep(self.spool_replay_interval)
+
+    def start_spool_replay(self):
+        if self.spool is None or self.executor_tasks[Dispatcher.TaskLabels.SPOOL_REPLAY]:
+            return
+        self.executor_tasks[Dispatcher.TaskLabels.SPOOL_REPLAY].append(asyncio.create_task(self.replay_spool_loop()))
+
     async def close(self, signal):
         self.sigterm_received = True
         if self.websocket and self.websocket.open:
@@ -579,6 +735,24 @@ class Dispatcher:
             await self.websocket.close(code=1000, reason=f"{signal} received")
         for task in self.executor_tasks[Dispatcher.TaskLabels.CONNECTION_CHECK]:
             task.cancel()
+        for task in self.executor_tasks[Dispatcher.TaskLabels.SPOOL_REPLAY]:
+            task.cancel()
+        for run in set(self.runs.values()):
+            if run.process is not None and run.process.returncode is None:
+                signal_process_group(run.process, SIGTERM)
+        if self.spool is not None:
+            await self.spool.close_all()
+        if self.fingerprint_store is not None:
+            self.fingerprint_store.close()
+            self.fingerprint_store = None
+        if self.retry_stats.retries:
+            logger.info(f"API retries: {self.retry_stats.as_dict()}")
+        if self.scheduler.started_runs:
+            logger.info(f"Runs scheduling: {self.scheduler.stats()}")
+        if len(self.outbox):
+            logger.warning(f"{len(self.outbox)} events could not be sent to the server")
+        if self.sio.connected:
+            await self.sio.disconnect()
         await asyncio.sleep(0.25)
 
     async def check_connection(self):
@@ -601,7 +775,7 @@ class Dispatcher:
             # self.executor_tasks[Dispatcher.TaskLabels.CONNECTION_CHECK].\
             #    append(check_connection_task)
             # await check_connection_task
-            await self.session.get(server_url, **kwargs)
+            await self.request_with_retry(lambda: self.session.get(server_url, **kwargs), "Connection check")
 
         except (ClientConnectorCertificateError, ClientConnectorSSLError) as e:
             logger.debug("Invalid SSL Certificate", exc_info=e)
@@ -615,6 +789,10 @@ class Dispatcher:
             logger.error("Can not connect to Faraday server")
             logger.debug("Connect failed traceback", exc_info=e)
             return False
+        except ClientResponseError as e:
+            logger.error(f"Faraday server responded {e.status} {e.message}")
+            logger.debug("Connection check failed traceback", exc_info=e)
+            return False
         except asyncio.TimeoutError as e:
             logger.error("Faraday server timed-out. " "TIP: Check ssl configuration")
             logger.debug("Timeout error. Check ssl", exc_info=e)
@@ -651,74 +829,156 @@ class Dispatcher:
 class DispatcherNamespace(socketio.AsyncClientNamespace):
     def __init__(self, dispatcher=None, namespace=""):
         self.dispatcher = dispatcher
+        self._join_executors = None
         super().__init__(namespace=namespace)
 
+    def join_executors(self) -> list:
+        """The executors of the join_agent payload, built once per manifest generation"""
+        if self._join_executors is None or self._join_executors[0] != manifest_registry.generation:
+            executors = []
+            for executor in self.dispatcher.executors.values():
+                category = []
+                if executor.repo_name is not None:
+                    category = (executor_metadata(executor.repo_name) or {}).get("category", [])
+                    if not isinstance(category, list):
+                        category = [category]
+                executors.append(
+                    {
+                        "executor_name": executor.name,
+                        "args": executor.params,
+                        "category": category,
+                        "tool": executor.repo_name if executor.repo_name is not None else "",
+                    }
+                )
+            self._join_executors = (manifest_registry.generation, executors)
+        return self._join_executors[1]
+
     async def on_connect(self):
-        manifests = get_manifests()
         connected_data = {
             "action": "JOIN_AGENT",
             "token": self.dispatcher.websocket_token,
-            "executors": [
-                {
-                    "executor_name": executor.name,
-                    "args": executor.params,
-                    "category": (
-                        (
-                            [manifests.get(executor.repo_name, {}).get("category")]
-                            if not isinstance(manifests.get(executor.repo_name, {}).get("category", []), list)
-                            else manifests.get(executor.repo_name, {}).get("category", [])
-                        )
-                        if executor.repo_name is not None
-                        else []
-                    ),
-                    "tool": executor.repo_name if executor.repo_name is not None else "",
-                }
-                for executor in self.dispatcher.executors.values()
-            ],
+            "executors": self.join_executors(),
         }
         await self.emit("join_agent", connected_data)
+        if len(self.dispatcher.outbox):
+            try:
+                sent = await self.dispatcher.outbox.flush(self.emit)
+                logger.info(f"{sent} buffered events sent to the server")
+            except socketio.exceptions.SocketIOError as e:
+                logger.warning(f"Could not send the buffered events: {e}")
 
     async def on_disconnect(self, *args, **kwargs):
-        await self.disconnect()
+        # The dispatcher reconnects, running executors are left alone
+        logger.info("Disconnected from the server")
+
+    async def send(self, event: str, data, buffer: bool = True):
+        try:
+            await self.emit(event, data)
+        except socketio.exceptions.SocketIOError as e:
+            if not buffer:
+                logger.debug(f"{event} event not sent: {e}")
+                return
+            logger.warning(f"Not connected to the server, {event} event buffered until reconnection")
+            self.dispatcher.outbox.put(event, data)
+
+    async def emit_status(self, run: RunContext, running: bool, successful, message: str, **extra):
+        # Progress is soon outdated, it is not worth buffering
+        await self.send(
+            "run_status", run.status(running, successful, message, **extra), buffer="progress" not in extra
+        )
 
     async def on_run(self, data):
-        workspaces_selected = data["workspaces"]
-        self.dispatcher.execution_ids = data["execution_ids"]
-        if "executor" not in data:
+        run = RunContext(data, self.dispatcher.agent_name)
+        if run.executor_name is None:
             logger.error("No executor selected")
-            # await self.websocket.send(
-            #     json.dumps(
-            #         {
-            #             "action": "RUN_STATUS",
-            #             "execution_ids": self.execution_ids,
-            #             "running": False,
-            #             "message": "No executor selected to " f"{self.agent_name} agent",
-            #         }
-            #     )
-            # )
             return
-        if data["executor"] not in self.dispatcher.executors:
+        if run.executor_name not in self.dispatcher.executors:
             logger.error("The selected executor not exists")
-            await self.emit(
-                json.dumps(
-                    {
-                        "action": "RUN_STATUS",
-                        "execution_ids": self.dispatcher.execution_ids,
-                        "executor_name": data["executor"],
-                        "successful": False,
-                        "running": False,
-                        "message": "Error: The selected executor "
-                        f"{data['executor']} not exists in "
-                        f"{self.dispatcher.agent_name} agent",
-                    }
-                )
+            await self.emit_status(
+                run,
+                running=False,
+                successful=False,
+                message="Error: The selected executor "
+                f"{run.executor_name} not exists in "
+                f"{self.dispatcher.agent_name} agent",
             )
             return
 
-        executor = self.dispatcher.executors[data["executor"]]
+        run.executor = self.dispatcher.executors[run.executor_name]
+        if not await self.validate(run):
+            return
+        if not await run.executor.check_cmds():
+            # The function logs why cant run
+            return
+        run.task = asyncio.current_task()
+        for execution_id in run.execution_ids:
+            self.dispatcher.runs[execution_id] = run
+        try:
+            await self.dispatcher.scheduler.run(run, self.execute, on_queued=self.on_queued)
+        except asyncio.CancelledError:
+            if run.stop_reason is None or run.process is not None:
+                raise
+            # Cancelled while it was queued
+            await self.emit_status(
+                run,
+                running=False,
+                successful=False,
+                message=f"Executor {run.executor.name} from {self.dispatcher.agent_name} was cancelled",
+                stop_reason=run.stop_reason,
+            )
+        finally:
+            for execution_id in run.execution_ids:
+                if self.dispatcher.runs.get(execution_id) is run:
+                    del self.dispatcher.runs[execution_id]
+
+    async def on_cancel(self, data):
+        execution_ids = data.get("execution_ids") or [data.get("execution_id")]
+        runs = []
+        for execution_id in execution_ids:
+            run = self.dispatcher.runs.get(execution_id)
+            if run is None:
+                logger.warning(f"Cancel received for unknown execution {execution_id}")
+            elif run not in runs:
+                runs.append(run)
+        await asyncio.gather(*(self.stop(run, "cancelled") for run in runs))
+
+    async def stop(self, run: RunContext, reason: str):
+        if run.stop_reason is not None:
+            return
+        run.stop_reason = reason
+        if run.process is None:
+            if run.spawning:
+                # Cancelling the spawn could orphan the process group, execute terminates it once spawned
+                logger.warning(f"Executor {run.executor.name} will be stopped once started: {reason}")
+            elif run.task is not None:
+                run.task.cancel()
+            return
+        await self.terminate(run)
+
+    async def terminate(self, run: RunContext):
+        logger.warning(f"Stopping executor {run.executor.name} of executions {run.execution_ids}: {run.stop_reason}")
+        if await terminate_process_group(run.process):
+            logger.warning(f"Executor {run.executor.name} had to be killed")
+
+    async def watchdog(self, run: RunContext):
+        await asyncio.sleep(run.executor.timeout)
+        logger.warning(f"Executor {run.executor.name} timed out after {run.executor.timeout} seconds")
+        await self.stop(run, "timeout")
+
+    async def on_queued(self, run: RunContext, position: int):
+        await self.emit_status(
+            run,
+            running=False,
+            successful=None,  # Not determined yet
+            message=f"Executor {run.executor.name} from {self.dispatcher.agent_name} queued in position {position}",
+            queued=True,
+            position=position,
+        )
 
+    async def validate(self, run: RunContext) -> bool:
+        executor = run.executor
         params = list(executor.params.keys()).copy()
-        passed_params = data["args"] if "args" in data else {}
+        passed_params = run.passed_params
 
         all_accepted = all(
             [
@@ -729,20 +989,15 @@ class DispatcherNamespace(socketio.AsyncClientNamespace):
         )
         if not all_accepted:
             logger.error(f"Unexpected argument passed to {executor.name}" f" executor")
-            await self.dispatcher.websocket.send(
-                json.dumps(
-                    {
-                        "action": "RUN_STATUS",
-                        "execution_ids": self.dispatcher.execution_ids,
-                        "executor_name": executor.name,
-                        "running": False,
-                        "successful": False,
-                        "message": "Error: Unexpected argument(s) passed to "
-                        f"{executor.name} executor from "
-                        f"{self.dispatcher.agent_name} agent",
-                    }
-                )
+            await self.emit_status(
+                run,
+                running=False,
+                successful=False,
+                message="Error: Unexpected argument(s) passed to "
+                f"{executor.name} executor from "
+                f"{self.dispatcher.agent_name} agent",
             )
+            return False
         mandatory_full = all(
             [
                 not executor.params[param]["mandatory"]  # All params is not mandatory
@@ -752,23 +1007,17 @@ class DispatcherNamespace(socketio.AsyncClientNamespace):
         )
         if not mandatory_full:
             logger.error(f"Mandatory argument not passed " f"to {executor.name} executor")
-            await self.dispatcher.websocket.send(
-                json.dumps(
-                    {
-                        "action": "RUN_STATUS",
-                        "execution_ids": self.dispatcher.execution_ids,
-                        "executor_name": executor.name,
-                        "running": False,
-                        "successful": False,
-                        "message": f"Error: Mandatory argument(s) "
-                        f"not passed to "
-                        f"{executor.name} executor from "
-                        f"{self.dispatcher.agent_name} agent",
-                    }
-                )
+            await self.emit_status(
+                run,
+                running=False,
+                successful=False,
+                message=f"Error: Mandatory argument(s) "
+                f"not passed to "
+                f"{executor.name} executor from "
+                f"{self.dispatcher.agent_name} agent",
             )
+            return False
 
-        # VALIDATE
         errors = dict()
         for param in passed_params:
             param_errors = type_validate(executor.params[param]["type"], passed_params[param])
@@ -785,97 +1034,129 @@ class DispatcherNamespace(socketio.AsyncClientNamespace):
             for param in errors:
                 error_msg += f"\n{param} = {passed_params[param]} " f"did not validate correctly: {errors[param]}"
             logger.error(error_msg)
-            await self.emit(
-                "run_status",
-                json.dumps(
-                    {
-                        "action": "RUN_STATUS",
-                        "execution_ids": self.dispatcher.execution_ids,
-                        "executor_name": executor.name,
-                        "running": False,
-                        "successful": False,
-                        "message": error_msg,
-                    }
-                ),
-            )
-            return
+            await self.emit_status(run, running=False, successful=False, message=error_msg)
+            return False
+        return True
 
-        if mandatory_full and all_accepted:
-            if not await executor.check_cmds():
-                # The function logs why cant run
-                return
-            logger.info(f"Running {executor.name} executor")
-            status_message = json.dumps(
-                {
-                    "action": "RUN_STATUS",
-                    "execution_ids": self.dispatcher.execution_ids,
-                    "executor_name": executor.name,
-                    "running": True,
-                    "successful": None,  # Not determined yet
-                    "message": f"Executor {executor.name} from {self.dispatcher.agent_name} started running",
-                }
-            )
+    async def execute(self, run: RunContext):
+        executor = run.executor
+        logger.info(f"Running {executor.name} executor")
+        await self.emit_status(
+            run,
+            running=True,
+            successful=None,  # Not determined yet
+            message=f"Executor {executor.name} from {self.dispatcher.agent_name} started running",
+        )
 
-            await self.emit("run_status", status_message)
-
-            plugin_args = data.get("plugin_args", {})
-            process = await self.dispatcher.create_process(executor, passed_params, plugin_args)
-            start_date = datetime.utcnow()
-            command_json = {
-                "tool": self.dispatcher.agent_name,
-                "command": executor.name,
-                "user": "",
-                "hostname": "",
-                "params": ", ".join([f"{key}={value}" for (key, value) in passed_params.items()]),
-                "import_source": "agent",
-                "start_date": start_date.isoformat(),
-            }
-            tasks = [
-                StdOutLineProcessor(
-                    process,
-                    self.dispatcher.session,
-                    self.dispatcher.execution_ids,
-                    workspaces_selected,
-                    self.dispatcher.api_ssl_enabled,
-                    self.dispatcher.api_kwargs,
-                    command_json,
-                    start_date,
-                ).process_f(),
-                StdErrLineProcessor(process).process_f(),
-            ]
+        run.progress = ProgressReporter(
+            lambda progress: self.emit_status(
+                run,
+                running=True,
+                successful=None,
+                message=f"Executor {executor.name} from {self.dispatcher.agent_name} is running",
+                progress=progress,
+            ),
+            executor.progress_interval,
+        )
+        run.cgroup = executor.limits.create_cgroup(f"faraday-run-{'-'.join(map(str, run.execution_ids))}")
+        run.result_channel = ResultChannel(executor.result_channel)
+        run.spawning = True
+        try:
+            run.process = await self.dispatcher.create_process(
+                executor,
+                run.passed_params,
+                run.plugin_args,
+                cgroup_path=run.cgroup,
+                result_channel=run.result_channel,
+            )
+        except Exception:
+            executor.limits.remove_cgroup(run.cgroup)
+            run.result_channel.close()
+            raise
+        finally:
+            run.spawning = False
+        run.started()
+        run.stdout_processor = StdOutLineProcessor(
+            run.process,
+            self.dispatcher.session,
+            run.execution_ids,
+            run.workspaces,
+            self.dispatcher.api_ssl_enabled,
+            self.dispatcher.api_kwargs,
+            run.command_json(),
+            run.start_date,
+            executor,
+            spool=self.dispatcher.spool,
+            stream=await run.result_channel.open_stream(),
+            result_channel=run.result_channel,
+            progress=run.progress,
+            delta=self.dispatcher.delta_filter(run),
+            validator=self.dispatcher.result_validator(executor),
+        )
+        run.stderr_processor = StdErrLineProcessor(run.process, executor)
+        watchdog = asyncio.create_task(self.watchdog(run)) if executor.timeout else None
+        tasks = [
+            run.stdout_processor.process_f(),
+            run.stderr_processor.process_f(),
+        ]
+        if run.result_channel.mode != ResultChannel.STDOUT:
+            tasks.append(StdOutLogProcessor(run.process, run.progress).process_f())
+        if run.stop_reason is not None:
+            # Stopped while it was spawned, its output is still drained
+            tasks.append(self.terminate(run))
+        try:
             await asyncio.gather(*tasks)
-            await process.communicate()
-            if process.returncode is None:
-                logger.error(f"Executor {executor.name} finished but returncode is None")
-                status_message = json.dumps(
-                    {
-                        "action": "RUN_STATUS",
-                        "execution_ids": self.dispatcher.execution_ids,
-                        "executor_name": executor.name,
-                        "running": False,
-                        "successful": False,
-                        "message": f"Executor {executor.name} from {self.dispatcher.agent_name} failed: "
-                        f"process returncode is None",
-                    }
-                )
-                await self.emit("run_status", status_message)
-                return
-            if process.returncode == 0:
-                logger.info(f"Executor {executor.name} finished successfully")
-                status_message = json.dumps(
-                    {
-                        "action": "RUN_STATUS",
-                        "execution_ids": self.dispatcher.execution_ids,
-                        "executor_name": executor.name,
-                        "running": False,
-                        "successful": True,
-                        "message": f"Executor "
-                        f"{executor.name} from "
-                        f"{self.dispatcher.agent_name} finished "
-                        "successfully",
-                    }
-                )
-                await self.emit("run_status", status_message)
-                return
-            else:
-                logger.warning(f"Executor {executor.name} finished with exit code" f" {process.returncode}")
+            await run.process.communicate()
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            run.progress.close()
+            run.result_channel.close()
+            run.limits_breached = executor.limits.breaches(run.process.returncode, run.cgroup)
+            executor.limits.remove_cgroup(run.cgroup)
+        run.finished()
+        if run.limits_breached:
+            logger.warning(f"Executor {executor.name} breached its limits: {', '.join(run.limits_breached)}")
+        if run.stop_reason == "timeout":
+            await self.emit_status(
+                run,
+                running=False,
+                successful=False,
+                message=f"Executor {executor.name} from {self.dispatcher.agent_name} failed: "
+                f"timed out after {executor.timeout} seconds",
+                stop_reason=run.stop_reason,
+            )
+        elif run.stop_reason == "cancelled":
+            await self.emit_status(
+                run,
+                running=False,
+                successful=False,
+                message=f"Executor {executor.name} from {self.dispatcher.agent_name} was cancelled",
+                stop_reason=run.stop_reason,
+            )
+        elif run.process.returncode is None:
+            logger.error(f"Executor {executor.name} finished but returncode is None")
+            await self.emit_status(
+                run,
+                running=False,
+                successful=False,
+                message=f"Executor {executor.name} from {self.dispatcher.agent_name} failed: "
+                f"process returncode is None",
+            )
+        elif run.process.returncode == 0:
+            logger.info(f"Executor {executor.name} finished successfully")
+            await self.emit_status(
+                run,
+                running=False,
+                successful=True,
+                message=f"Executor " f"{executor.name} from " f"{self.dispatcher.agent_name} finished " "successfully",
+            )
+        else:
+            logger.warning(f"Executor {executor.name} finished with exit code" f" {run.process.returncode}")
+            await self.emit_status(
+                run,
+                running=False,
+                successful=False,
+                message=f"Executor {executor.name} from {self.dispatcher.agent_name} failed: "
+                f"exit code {run.process.returncode}",
+            )
@@ -1,16 +1,23 @@
 import re
+import time
 
 from faraday_agent_dispatcher.config import Sections
 from faraday_agent_dispatcher.utils.metadata_utils import (
     executor_metadata,
     executor_folder,
     check_commands,
+    check_commands_fingerprint,
 )
 from faraday_agent_dispatcher.utils.control_values_utils import (
     control_int,
+    control_float,
     control_str,
+    control_limits,
+    control_optional_bool,
+    LimitsSchema,
     ParamsSchema,
 )
+from faraday_agent_dispatcher.utils.limits_utils import ResourceLimits
 from faraday_agent_dispatcher.utils.text_utils import Bcolors
 from faraday_agent_dispatcher.logger import get_logger
 
@@ -22,6 +29,29 @@ class Executor:
         "cmd": control_str(True),
         "repo_executor": control_str(True),
         "max_size": control_int(True),
+        "batch_lines": control_int(True),
+        "batch_size": control_int(True),
+        "batch_timeout": control_float(True),
+        "merge_hosts": control_optional_bool,
+        "delta_uploads": control_optional_bool,
+        "delta_resync_interval": control_float(True),
+        "validate_results": control_optional_bool,
+        "quarantine_results": control_optional_bool,
+        "upload_workers": control_int(True),
+        "upload_queue_size": control_int(True),
+        "upload_rate": control_float(True),
+        "upload_max_bytes": control_int(True),
+        "upload_max_hosts": control_int(True),
+        "workspace_concurrency": control_int(True),
+        "max_concurrent_runs": control_int(True),
+        "timeout": control_float(True),
+        "limits": control_limits,
+        "framing": control_str(True),
+        "result_channel": control_str(True),
+        "stderr_tail": control_int(True),
+        "stderr_rate": control_float(True),
+        "progress_interval": control_float(True),
+        "check_cmds_ttl": control_float(True),
     }
 
     def __init__(self, name: str, config):
@@ -39,6 +69,34 @@ class Executor:
             self.repo_name = None
 
         self.max_size = int(config.get("max_size", 64 * 1024))
+        self.batch_lines = int(config.get("batch_lines", 1))
+        self.batch_size = int(config.get("batch_size", 1024 * 1024))
+        self.batch_timeout = float(config.get("batch_timeout", 5))
+        self.merge_hosts = str(config.get("merge_hosts", False)).lower() in ("true", "t")
+        self.delta_uploads = str(config.get("delta_uploads", False)).lower() in ("true", "t")
+        # Hours between full syncs, which upload again the records deleted in the
+        # server. 0 only resyncs when the run data has full_resync
+        self.delta_resync_interval = float(config.get("delta_resync_interval", 24))
+        self.validate_results = str(config.get("validate_results", False)).lower() in ("true", "t")
+        self.quarantine_results = str(config.get("quarantine_results", True)).lower() in ("true", "t")
+        self.upload_workers = int(config.get("upload_workers", 2))
+        self.upload_queue_size = int(config.get("upload_queue_size", 64))
+        self.upload_rate = float(config.get("upload_rate", 0))
+        self.upload_max_bytes = int(config.get("upload_max_bytes", 32 * 1024 * 1024))
+        self.upload_max_hosts = int(config.get("upload_max_hosts", 0))
+        self.workspace_concurrency = int(config.get("workspace_concurrency", 4))
+        self.max_concurrent_runs = int(config.get("max_concurrent_runs", 0))
+        self.timeout = float(config.get("timeout", 0))
+        self.framing = config.get("framing", "ndjson")
+        self.result_channel = config.get("result_channel", "stdout")
+        self.stderr_tail = int(config.get("stderr_tail", 50))
+        self.stderr_rate = float(config.get("stderr_rate", 50))
+        self.progress_interval = float(config.get("progress_interval", 5))
+        # Seconds a successful dependency check is trusted, 0 checks on every run
+        self.check_cmds_ttl = float(config.get("check_cmds_ttl", 300))
+        # (monotonic time, fingerprint) of the last successful check
+        self.checked_cmds = None
+        self.limits = ResourceLimits(**LimitsSchema().load(config.get("limits") or {}))
         self.params = dict(config[Sections.EXECUTOR_PARAMS]) if Sections.EXECUTOR_PARAMS in config else {}
         self.varenvs = dict(config[Sections.EXECUTOR_VARENVS]) if Sections.EXECUTOR_VARENVS in config else {}
 
@@ -58,12 +116,18 @@ class Executor:
     async def check_cmds(self):
         if self.repo_executor is None:
             return True
-        repo_name = re.search(r"(^[a-zA-Z0-9_-]+)(?:\..*)*$", self.repo_executor).group(1)
-        metadata = executor_metadata(repo_name)
+        metadata = executor_metadata(self.repo_name)
+        fingerprint = check_commands_fingerprint(metadata)
+        if self.checked_cmds is not None:
+            checked_at, checked_fingerprint = self.checked_cmds
+            if time.monotonic() - checked_at < self.check_cmds_ttl and checked_fingerprint == fingerprint:
+                return True
+            self.checked_cmds = None
         if not await check_commands(metadata):
             logger.info(
                 f"{Bcolors.WARNING}Invalid bash dependency for " f"{Bcolors.BOLD}{self.repo_name}{Bcolors.ENDC}"
             )
             return False
         else:
+            self.checked_cmds = (time.monotonic(), fingerprint)
             return True
@@ -13,34 +13,46 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import json
-import time
+import asyncio
+from collections import deque
 from datetime import datetime
+from typing import Optional
 from json import JSONDecodeError
 
 from faraday_agent_dispatcher import logger as logging
-from faraday_agent_dispatcher.config import instance as config
+from faraday_agent_dispatcher.delta import DeltaFilter
+from faraday_agent_dispatcher.executor import Executor
+from faraday_agent_dispatcher.framing import FrameReader
+from faraday_agent_dispatcher.progress import PROGRESS_KEY, ProgressReporter
+from faraday_agent_dispatcher.result_channel import ResultChannel
+from faraday_agent_dispatcher.spool import Spool
+from faraday_agent_dispatcher.uploader import BulkCreateBatcher, BulkCreateUploader
+from faraday_agent_dispatcher.utils import json_utils
+from faraday_agent_dispatcher.utils.rate_utils import RateLimiter
 from faraday_agent_dispatcher.utils.text_utils import Bcolors
-from faraday_agent_dispatcher.utils.url_utils import api_url
+from faraday_agent_dispatcher.validation import ResultValidator
 
 from aiohttp import ClientSession
 
 logger = logging.get_logger()
 
 
+async def report_progress(progress: Optional[ProgressReporter], value):
+    if progress is None:
+        logger.debug(f"Progress not reported: {value}")
+    else:
+        await progress.update(value)
+
+
 class FileLineProcessor:
     @staticmethod
     async def _process_lines(line_getter, process_f, logger_f, end_f, name):
         while True:
-            try:
-                line = await line_getter()
-                if line != "":
-                    await process_f(line)
-                    logger_f(line)
-                else:
-                    break
-            except ValueError:
-                logger.error(f"ValueError raised processing {name}, try with bigger " "limiting size in config")
+            line = await line_getter()
+            if line is None:
+                break
+            await process_f(line)
+            logger_f(line)
         await end_f()
         print(f"{Bcolors.WARNING}{name} sent empty data, {Bcolors.ENDC}")
 
@@ -74,59 +86,99 @@ class StdOutLineProcessor(FileLineProcessor):
         api_kwargs,
         command_json: dict,
         start_date: datetime,
+        executor: Executor,
+        spool: Spool = None,
+        stream: asyncio.StreamReader = None,
+        result_channel: ResultChannel = None,
+        progress: ProgressReporter = None,
+        delta: DeltaFilter = None,
+        validator: ResultValidator = None,
     ):
         super().__init__("stdout")
         self.process = process
+        self.progress = progress
+        self.validator = validator
         self.execution_ids = execution_ids
-        self.__session = session
-        self.api_kwargs = api_kwargs
         self.workspaces = workspaces
-        self.api_ssl_enabled = api_ssl_enabled
         self.command_json = command_json
         self.start_date = start_date
+        self.result_channel = result_channel
+        # Results are read from stdout unless the executor has another result channel
+        self.reader = FrameReader(stream or process.stdout, executor.framing)
+        self.from_stdout = stream is None
+        self.uploader = BulkCreateUploader(
+            session,
+            execution_ids,
+            workspaces,
+            api_ssl_enabled,
+            api_kwargs,
+            command_json,
+            workers=executor.upload_workers,
+            queue_size=executor.upload_queue_size,
+            rate=executor.upload_rate,
+            workspace_concurrency=executor.workspace_concurrency,
+            spool=spool,
+            delta=delta,
+            max_bytes=executor.upload_max_bytes,
+            max_hosts=executor.upload_max_hosts,
+        )
+        self.batcher = BulkCreateBatcher(
+            self.uploader.put,
+            max_lines=executor.batch_lines,
+            max_bytes=executor.batch_size,
+            timeout=executor.batch_timeout,
+            merge_hosts=executor.merge_hosts,
+        )
 
     async def next_line(self):
-        line = await self.process.stdout.readline()
-        line = line.decode("utf-8")
-        return line[:-1]
+        frame = await self.reader.next_frame()
+        if frame == "" and self.from_stdout:
+            # An empty line ends the results printed in stdout
+            return None
+        while frame == "":
+            frame = await self.reader.next_frame()
+        return frame
 
     def post_url(self, ws):
-        host = config["server"]["host"]
-        port = config["server"]["api_port"]
-        return api_url(
-            host,
-            port,
-            postfix="/_api/v3/ws/" f"{ws}/bulk_create",
-            secure=self.api_ssl_enabled,
-        )
+        return self.uploader.post_url(ws)
+
+    async def process_f(self):
+        self.uploader.start()
+        try:
+            if self.result_channel is not None and self.result_channel.mode == ResultChannel.FILE:
+                return await self.process_result_file()
+            return await super().process_f()
+        finally:
+            self.batcher.cancel()
+            await self.uploader.close()
+
+    async def process_result_file(self):
+        await self.process.wait()
+        try:
+            result_file = self.result_channel.result_file()
+        except ValueError as e:
+            logger.error(f"Invalid result file: {e}")
+            result_file = None
+        if result_file is None:
+            logger.warning("The executor did not write any result")
+        else:
+            await self.uploader.put(result_file)
+        await self.end_f()
 
     async def processing(self, line):
         try:
-            loaded_json = json.loads(line)
+            loaded_json = json_utils.loads(line)
             print(f"{Bcolors.OKBLUE}{line}{Bcolors.ENDC}")
-            headers = [("authorization", f"agent {config['tokens'].get('agent')}")]
-            for workspace, execution_id in zip(self.workspaces, self.execution_ids):
-                loaded_json["execution_id"] = execution_id
-                loaded_json["command"] = self.command_json
-
-                res = await self.__session.post(
-                    self.post_url(workspace),
-                    json=loaded_json,
-                    headers=headers,
-                    raise_for_status=False,
-                    **self.api_kwargs,
-                )
-                if res.status == 201:
-                    logger.info("Data sent to bulk create")
-                else:
-                    logger.error(
-                        "Invalid data supplied by the executor to"
-                        " the bulk create "
-                        f"endpoint. Server responded: {res.status} "
-                        f"{await res.text()}"
-                    )
-                time.sleep(1)
-
+            if isinstance(loaded_json, dict) and PROGRESS_KEY in loaded_json:
+                await report_progress(self.progress, loaded_json.pop(PROGRESS_KEY))
+                if not loaded_json:
+                    return
+            if self.validator is not None and isinstance(loaded_json, dict):
+                loaded_json = self.validator.clean(loaded_json)
+                if loaded_json is None:
+                    logger.warning("Every host of the result was invalid, nothing to send")
+                    return
+            await self.batcher.add(loaded_json, len(line))
         except JSONDecodeError as e:
             logger.error(f"JSON Parsing error: {e}")
             print(f"{Bcolors.WARNING}JSON Parsing error: {e}{Bcolors.ENDC}")
@@ -135,49 +187,96 @@ class StdOutLineProcessor(FileLineProcessor):
         logger.debug(f"Output line: {line}")
 
     async def end_f(self):
-        headers = [("authorization", f"agent {config['tokens'].get('agent')}")]
-        for workspace, execution_id in zip(self.workspaces, self.execution_ids):
-            loaded_json = {
-                "hosts": [],
-                "execution_id": execution_id,
-                "command": self.command_json,
-            }
-            loaded_json["command"]["duration"] = (
-                datetime.utcnow() - self.start_date
-            ).total_seconds() * 1000000  # microsecs
-
-            res = await self.__session.post(
-                self.post_url(workspace),
-                json=loaded_json,
-                headers=headers,
-                raise_for_status=False,
-                **self.api_kwargs,
-            )
-            if res.status == 201:
-                logger.info("Data sent to bulk create")
-            else:
-                logger.error(
-                    "Invalid data supplied by the executor to the bulk create "
-                    f"endpoint. Server responded: {res.status} "
-                    f"{await res.text()}"
-                )
+        # The duration must be sent after every queued result was uploaded
+        await self.batcher.close()
+        await self.uploader.join()
+        self.command_json["duration"] = (datetime.utcnow() - self.start_date).total_seconds() * 1000000  # microsecs
+        await self.uploader.send({"hosts": []}, track=False)
+        if self.uploader.delta is not None:
+            self.uploader.delta.finish()
+
+    def workspaces_summary(self) -> dict:
+        return self.uploader.summary()
+
+    def retries_summary(self) -> dict:
+        return self.uploader.retry_stats.as_dict()
+
+    def skipped_summary(self) -> Optional[dict]:
+        return self.uploader.delta.summary() if self.uploader.delta is not None else None
+
+    def validation_summary(self) -> Optional[dict]:
+        return self.validator.summary() if self.validator is not None else None
 
 
 class StdErrLineProcessor(FileLineProcessor):
-    def __init__(self, process):
+    """
+    Keeps the last lines of stderr in a ring buffer, sent with the status of
+    failed runs. Printing and logging are rate limited, so verbose tools do
+    not slow down the run with terminal and log I/O.
+    """
+
+    TAIL_LINE_SIZE = 1024
+
+    def __init__(self, process, executor: Executor = None):
         super().__init__("stderr")
         self.process = process
+        self.reader = FrameReader(process.stderr)
+        self.tail = deque(maxlen=executor.stderr_tail if executor is not None else 50)
+        rate = executor.stderr_rate if executor is not None else 0
+        self.rate_limiter = RateLimiter(rate, burst=int(rate))
+        self.shown = True
+        self.suppressed = 0
+
+    async def next_line(self):
+        return await self.reader.read_line()
+
+    async def processing(self, line):
+        self.tail.append(line[: self.TAIL_LINE_SIZE])
+        self.shown = self.rate_limiter.try_acquire()
+        if self.shown:
+            print(f"{Bcolors.FAIL}{line}{Bcolors.ENDC}")
+        else:
+            self.suppressed += 1
+
+    def log(self, line):
+        if self.shown:
+            logger.debug(f"Error line: {line}")
+
+    async def end_f(self):
+        if self.suppressed:
+            logger.info(
+                f"{self.suppressed} stderr lines were not shown, over the limit of "
+                f"{self.rate_limiter.rate:g} lines per second"
+            )
+
+    def tail_lines(self) -> list:
+        return list(self.tail)
+
+
+class StdOutLogProcessor(FileLineProcessor):
+    """stdout of executors that send their results through another channel"""
+
+    def __init__(self, process, progress: ProgressReporter = None):
+        super().__init__("stdout")
+        self.process = process
+        self.progress = progress
+        self.reader = FrameReader(process.stdout)
 
     async def next_line(self):
-        line = await self.process.stderr.readline()
-        line = line.decode("utf-8")
-        return line[:-1]
+        return await self.reader.read_line()
 
     async def processing(self, line):
-        print(f"{Bcolors.FAIL}{line}{Bcolors.ENDC}")
+        print(line)
+        if PROGRESS_KEY in line:
+            try:
+                loaded_json = json_utils.loads(line)
+            except JSONDecodeError:
+                return
+            if isinstance(loaded_json, dict) and PROGRESS_KEY in loaded_json:
+                await report_progress(self.progress, loaded_json[PROGRESS_KEY])
 
     def log(self, line):
-        logger.debug(f"Error line: {line}")
+        logger.debug(f"Output line: {line}")
 
     async def end_f(self):
         pass
@@ -0,0 +1,136 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import Optional
+
+from faraday_agent_dispatcher import logger as logging
+
+logger = logging.get_logger()
+
+READ_CHUNK_SIZE = 64 * 1024
+# Length and chunk headers are short, anything longer is data
+MAX_HEADER_SIZE = 32
+
+
+def decode(data) -> str:
+    # Invalid bytes are replaced, they never stop the stream
+    return str(data, "utf-8", "replace")
+
+
+class FrameReader:
+    """
+    Reads frames of any size from an executor output stream. Bytes are read
+    in chunks into a single buffer, and the frame is decoded once from a view
+    of it, so it is only held once as bytes and once as text.
+
+    Framings:
+        ndjson: one frame per line.
+        length: a line with the decimal byte length, followed by the frame.
+        chunked: lines with the hex length of the next chunk, followed by the
+            chunk; a 0 length chunk ends the frame.
+    Blank lines between frames are ignored in the length and chunked
+    framings. A line that is not a valid header is taken as a ndjson frame,
+    so executors can still print plain JSON lines.
+    """
+
+    FRAMINGS = ("ndjson", "length", "chunked")
+
+    def __init__(self, stream: asyncio.StreamReader, framing: str = "ndjson", chunk_size: int = READ_CHUNK_SIZE):
+        if framing not in self.FRAMINGS:
+            raise ValueError(f"Unknown framing {framing}, must be one of {', '.join(self.FRAMINGS)}")
+        self.stream = stream
+        self.framing = framing
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    async def _fill(self) -> bool:
+        data = await self.stream.read(self.chunk_size)
+        if not data:
+            return False
+        self.buffer += data
+        return True
+
+    def _take(self, size: int, skip: int = 0) -> str:
+        """Decodes the first `size` bytes of the buffer and removes them, plus `skip` more"""
+        with memoryview(self.buffer) as view:
+            text = decode(view[:size])
+        del self.buffer[: size + skip]
+        return text
+
+    async def read_line(self) -> Optional[str]:
+        """Next line without the line break, None at the end of the stream"""
+        # The buffer before it has no line break, it is not searched again
+        start = 0
+        while True:
+            index = self.buffer.find(b"\n", start)
+            if index >= 0:
+                return self._take(index, skip=1)
+            start = len(self.buffer)
+            if not await self._fill():
+                if not self.buffer:
+                    return None
+                return self._take(len(self.buffer))
+
+    async def _read_exactly(self, size: int):
+        while len(self.buffer) < size:
+            if not await self._fill():
+                raise asyncio.IncompleteReadError(b"", size)
+
+    async def read_header(self):
+        """Returns (size, None) for a valid header or (None, line) for data"""
+        while True:
+            line = await self.read_line()
+            if line is None:
+                return None, None
+            if not line.strip():
+                continue
+            header = line.strip()
+            if len(header) <= MAX_HEADER_SIZE:
+                try:
+                    return int(header, 16 if self.framing == "chunked" else 10), None
+                except ValueError:
+                    pass
+            logger.warning(f"Invalid {self.framing} frame header, reading the line as a ndjson frame")
+            return None, line
+
+    async def next_frame(self) -> Optional[str]:
+        """Next frame as text, None at the end of the stream"""
+        if self.framing == "ndjson":
+            return await self.read_line()
+        size, line = await self.read_header()
+        if size is None:
+            return line
+        try:
+            if self.framing == "length":
+                await self._read_exactly(size)
+                return self._take(size)
+            # The chunks are gathered as bytes and the frame decoded once
+            frame = bytearray()
+            while size:
+                await self._read_exactly(size)
+                with memoryview(self.buffer) as view:
+                    frame += view[:size]
+                del self.buffer[:size]
+                size, line = await self.read_header()
+                if line is None and size is None:
+                    raise asyncio.IncompleteReadError(b"", None)
+                if size is None:
+                    logger.error("Chunked frame interrupted by an invalid chunk header, discarding it")
+                    return line
+        except asyncio.IncompleteReadError:
+            logger.error("The output ended in the middle of a frame, discarding it")
+            return None
+        return decode(frame)
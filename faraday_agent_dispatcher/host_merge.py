@@ -0,0 +1,201 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import ipaddress
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+
+def record_digest(record: dict, context: bytes = b"") -> bytes:
+    # A compact key of the whole record (and where it is), to drop exact duplicates.
+    # Stored by the delta uploads, so the encoding must not depend on the JSON
+    # codec installed nor on the order of the keys.
+    digest = hashlib.blake2b(context, digest_size=16)
+    digest.update(json.dumps(record, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return digest.digest()
+
+
+def host_address(host: dict) -> Optional[str]:
+    """The IP of the host, None if it has none or its ip field is a name"""
+    ip = host.get("ip")
+    if not isinstance(ip, str) or not ip:
+        return None
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return ip
+
+
+def host_names(host: dict) -> List[str]:
+    names = [hostname for hostname in host.get("hostnames") or [] if isinstance(hostname, str) and hostname]
+    ip = host.get("ip")
+    if isinstance(ip, str) and ip and host_address(host) is None:
+        # Reported under a name instead of its IP
+        names.append(ip)
+    return names
+
+
+class MergedService:
+    def __init__(self, service: dict):
+        self.service = {key: value for key, value in service.items() if key != "vulnerabilities"}
+        self.vulnerabilities: List[dict] = []
+        self.digests: Set[bytes] = set()
+        self.merge(service)
+
+    def merge(self, service: dict):
+        for key, value in service.items():
+            if key != "vulnerabilities":
+                self.service.setdefault(key, value)
+        add_unique(self.vulnerabilities, self.digests, service.get("vulnerabilities") or [])
+
+    def as_dict(self) -> dict:
+        service = dict(self.service)
+        if self.vulnerabilities:
+            service["vulnerabilities"] = self.vulnerabilities
+        return service
+
+
+class MergedHost:
+    NESTED_KEYS = ("hostnames", "services", "vulnerabilities", "credentials")
+
+    def __init__(self, host: dict):
+        self.host = {key: value for key, value in host.items() if key not in self.NESTED_KEYS}
+        self.hostnames: Dict[str, None] = {}
+        self.services: Dict[Tuple, MergedService] = {}
+        self.vulnerabilities: List[dict] = []
+        self.credentials: List[dict] = []
+        self.vulnerability_digests: Set[bytes] = set()
+        self.credential_digests: Set[bytes] = set()
+        self.merge(host)
+
+    def merge(self, host: dict):
+        for key, value in host.items():
+            if key not in self.NESTED_KEYS:
+                self.host.setdefault(key, value)
+        for hostname in host.get("hostnames") or []:
+            self.hostnames[hostname] = None
+        for service in host.get("services") or []:
+            key = (str(service.get("port")), str(service.get("protocol", "")).lower())
+            if key in self.services:
+                self.services[key].merge(service)
+            else:
+                self.services[key] = MergedService(service)
+        add_unique(self.vulnerabilities, self.vulnerability_digests, host.get("vulnerabilities") or [])
+        add_unique(self.credentials, self.credential_digests, host.get("credentials") or [])
+
+    @property
+    def address(self) -> Optional[str]:
+        return host_address(self.host)
+
+    def set_address(self, address: str):
+        name = self.host.get("ip")
+        if isinstance(name, str) and name:
+            self.hostnames[name] = None
+        self.host["ip"] = address
+
+    def as_dict(self) -> dict:
+        host = dict(self.host)
+        if self.hostnames:
+            host["hostnames"] = list(self.hostnames)
+        if self.services:
+            host["services"] = [service.as_dict() for service in self.services.values()]
+        if self.vulnerabilities:
+            host["vulnerabilities"] = self.vulnerabilities
+        if self.credentials:
+            host["credentials"] = self.credentials
+        return host
+
+
+def add_unique(records: List[dict], digests: Set[bytes], new_records: List[dict]):
+    for record in new_records:
+        digest = record_digest(record)
+        if digest not in digests:
+            digests.add(digest)
+            records.append(record)
+
+
+class HostMergeIndex:
+    """
+    Merges the hosts of a batch as the server would, so a host reported many
+    times by an executor is uploaded once. Hosts are identified by IP, and by
+    hostname when one of them has no IP (or is reported under a name in its
+    ip field), services by port and protocol, and hostnames are joined.
+    Hosts with different IPs are never merged, even with a hostname in
+    common. Vulnerabilities and credentials that are exact duplicates are
+    dropped, the rest are kept. Hosts without IP nor hostnames are sent as
+    they are.
+    """
+
+    def __init__(self):
+        self.hosts: List[MergedHost] = []
+        self.by_address: Dict[str, MergedHost] = {}
+        self.by_name: Dict[str, MergedHost] = {}
+        self.unindexed: List[dict] = []
+        self.added = 0
+
+    def __len__(self) -> int:
+        return len(self.hosts) + len(self.unindexed)
+
+    @property
+    def merged(self) -> int:
+        """Hosts merged into another one"""
+        return self.added - len(self)
+
+    def find(self, address: Optional[str], names: List[str]) -> Optional[MergedHost]:
+        if address is not None and address in self.by_address:
+            return self.by_address[address]
+        for name in names:
+            merged = self.by_name.get(name)
+            if merged is not None and (address is None or merged.address is None):
+                return merged
+        return None
+
+    def add(self, host: dict):
+        self.added += 1
+        if not isinstance(host, dict):
+            self.unindexed.append(host)
+            return
+        address = host_address(host)
+        names = host_names(host)
+        if address is None and not names:
+            self.unindexed.append(host)
+            return
+        merged = self.find(address, names)
+        if merged is None:
+            merged = MergedHost(host)
+            self.hosts.append(merged)
+        else:
+            merged.merge(host)
+        if address is not None and merged.address is None:
+            merged.set_address(address)
+        if merged.address is not None:
+            self.by_address.setdefault(merged.address, merged)
+        for name in names:
+            self.by_name.setdefault(name, merged)
+
+    def extend(self, hosts: List[dict]):
+        for host in hosts:
+            self.add(host)
+
+    def pop_hosts(self) -> List[dict]:
+        hosts = [host.as_dict() for host in self.hosts] + self.unindexed
+        self.hosts = []
+        self.by_address = {}
+        self.by_name = {}
+        self.unindexed = []
+        self.added = 0
+        return hosts
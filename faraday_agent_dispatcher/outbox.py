@@ -0,0 +1,52 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+from typing import Awaitable, Callable, Deque, Tuple
+
+from faraday_agent_dispatcher import logger as logging
+
+logger = logging.get_logger()
+
+
+class Outbox:
+    """
+    Bounded buffer of the events that could not be emitted while the
+    socket.io connection was down, flushed in order once it is back. When it
+    is full, the oldest events are dropped.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.events: Deque[Tuple[str, object]] = deque(maxlen=max(max_size, 1))
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def put(self, event: str, data):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+            logger.warning(f"Outbox full, dropping the oldest buffered event ({self.dropped} dropped)")
+        self.events.append((event, data))
+
+    async def flush(self, emit_f: Callable[[str, object], Awaitable]) -> int:
+        """Emits the buffered events in order, stops at the first failure"""
+        sent = 0
+        while self.events:
+            event, data = self.events[0]
+            await emit_f(event, data)
+            self.events.popleft()
+            sent += 1
+        return sent
@@ -0,0 +1,97 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+from faraday_agent_dispatcher import logger as logging
+
+logger = logging.get_logger()
+
+# Executors report progress printing a JSON line with this key, e.g.
+# {"faraday_progress": {"percent": 42.5, "phase": "scanning", "eta": 600}}
+PROGRESS_KEY = "faraday_progress"
+
+
+def parse_progress(value) -> Optional[dict]:
+    """The valid progress fields, None if there is none"""
+    if not isinstance(value, dict):
+        return None
+    progress = {}
+    for key in ("percent", "eta"):
+        number = value.get(key)
+        if isinstance(number, (int, float)) and not isinstance(number, bool):
+            progress[key] = number
+    if "percent" in progress:
+        progress["percent"] = min(max(progress["percent"], 0), 100)
+    if isinstance(value.get("phase"), str):
+        progress["phase"] = value["phase"]
+    return progress or None
+
+
+class ProgressReporter:
+    """
+    Coalesces the progress lines of a run into progress events, sending at
+    most one every `interval` seconds with the latest progress received.
+    """
+
+    def __init__(self, emit_f: Callable[[dict], Awaitable], interval: float = 5):
+        self.emit_f = emit_f
+        self.interval = max(interval, 0)
+        self.latest: Optional[dict] = None
+        self.sent_at: Optional[float] = None
+        self.timer: Optional[asyncio.Task] = None
+        self.received = 0
+        self.sent = 0
+
+    async def update(self, value):
+        progress = parse_progress(value)
+        if progress is None:
+            logger.warning(f"Invalid progress line: {value}")
+            return
+        self.received += 1
+        self.latest = progress
+        if self.timer is not None:
+            # Already scheduled, it will send the latest progress
+            return
+        wait = 0 if self.sent_at is None else self.sent_at + self.interval - time.monotonic()
+        if wait <= 0:
+            await self.flush()
+        else:
+            self.timer = asyncio.create_task(self._flush_later(wait))
+
+    async def _flush_later(self, wait: float):
+        await asyncio.sleep(wait)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self.latest is None:
+            return
+        progress, self.latest = self.latest, None
+        self.sent_at = time.monotonic()
+        self.sent += 1
+        try:
+            await self.emit_f(progress)
+        except Exception as e:
+            logger.warning(f"Could not send the run progress: {e}")
+
+    def close(self):
+        # The final status supersedes any pending progress
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.latest = None
@@ -0,0 +1,171 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from faraday_agent_dispatcher import logger as logging
+
+logger = logging.get_logger()
+
+FILE_CHUNK_SIZE = 256 * 1024
+WHITESPACE = b" \t\r\n"
+
+
+class ResultFile:
+    """
+    A bulk_create JSON object written by an executor to a file. It is sent
+    as a chunked body read straight from the file, with the execution
+    envelope (execution_id and command) spliced before its closing brace, so
+    the result is never loaded in memory.
+    """
+
+    def __init__(self, path: Path, envelope: dict = None):
+        self.path = Path(path)
+        self.envelope = envelope or {}
+        self.end, self.empty = self._bounds()
+
+    def _bounds(self):
+        with self.path.open("rb") as result_file:
+            head = result_file.read(4096).lstrip(WHITESPACE)
+            if not head.startswith(b"{"):
+                raise ValueError("The result file must contain a JSON object")
+            empty = head[1:].lstrip(WHITESPACE).startswith(b"}")
+            end = result_file.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(end - 4096, 0)
+                result_file.seek(start)
+                block = result_file.read(end - start).rstrip(WHITESPACE)
+                if block:
+                    if not block.endswith(b"}"):
+                        raise ValueError("The result file must contain a JSON object")
+                    return start + len(block) - 1, empty
+                end = start
+        raise ValueError("The result file must contain a JSON object")
+
+    def with_envelope(self, envelope: dict) -> "ResultFile":
+        result_file = ResultFile.__new__(ResultFile)
+        result_file.path = self.path
+        result_file.envelope = envelope
+        result_file.end = self.end
+        result_file.empty = self.empty
+        return result_file
+
+    def tail(self) -> bytes:
+        members = json.dumps(self.envelope)[1:-1]
+        if members and not self.empty:
+            members = f", {members}"
+        return f"{members}}}".encode("utf-8")
+
+    @property
+    def size(self) -> int:
+        return self.end + len(self.tail())
+
+    async def chunks(self, chunk_size: int = FILE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        with self.path.open("rb") as result_file:
+            remaining = self.end
+            while remaining > 0:
+                chunk = await loop.run_in_executor(None, result_file.read, min(chunk_size, remaining))
+                if not chunk:
+                    raise ValueError(f"Result file {self.path} was truncated while sending it")
+                remaining -= len(chunk)
+                yield chunk
+        yield self.tail()
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.chunks()])
+
+
+class ResultChannel:
+    """
+    How an executor hands its results to the dispatcher:
+        stdout: JSON lines printed in stdout (the default).
+        fd: JSON lines written to the inherited file descriptor in the
+            FARADAY_RESULT_FD environment variable.
+        file: a bulk_create JSON object written to the file in the
+            FARADAY_RESULT_FILE environment variable, sent when the executor
+            finishes.
+    With the fd and file channels, stdout is only logged.
+    """
+
+    STDOUT = "stdout"
+    FD = "fd"
+    FILE = "file"
+    MODES = (STDOUT, FD, FILE)
+    FD_ENV = "FARADAY_RESULT_FD"
+    FILE_ENV = "FARADAY_RESULT_FILE"
+
+    def __init__(self, mode: str = STDOUT):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown result channel {mode}, must be one of {', '.join(self.MODES)}")
+        self.mode = mode
+        self.read_fd: Optional[int] = None
+        self.write_fd: Optional[int] = None
+        self.path: Optional[Path] = None
+        self.transport = None
+
+    def prepare(self) -> dict:
+        """Creates the channel, returns the environment for the executor"""
+        if self.mode == self.FD:
+            self.read_fd, self.write_fd = os.pipe()
+            return {self.FD_ENV: str(self.write_fd)}
+        if self.mode == self.FILE:
+            fd, path = tempfile.mkstemp(prefix="faraday-result-", suffix=".json")
+            os.close(fd)
+            self.path = Path(path)
+            return {self.FILE_ENV: path}
+        return {}
+
+    @property
+    def pass_fds(self) -> tuple:
+        return (self.write_fd,) if self.write_fd is not None else ()
+
+    def spawned(self):
+        # Only the executor keeps the write end, so the reader gets EOF when it exits
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    async def open_stream(self) -> Optional[asyncio.StreamReader]:
+        if self.read_fd is None:
+            return None
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        self.transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(self.read_fd, "rb", 0)
+        )
+        self.read_fd = None
+        return reader
+
+    def result_file(self) -> Optional[ResultFile]:
+        if self.path is None or not self.path.exists() or self.path.stat().st_size == 0:
+            return None
+        return ResultFile(self.path)
+
+    def close(self):
+        self.spawned()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self.read_fd is not None:
+            os.close(self.read_fd)
+            self.read_fd = None
+        if self.path is not None and self.path.exists():
+            self.path.unlink()
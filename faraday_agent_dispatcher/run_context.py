@@ -0,0 +1,110 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from asyncio import Task
+from asyncio.subprocess import Process
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from faraday_agent_dispatcher.executor import Executor
+from faraday_agent_dispatcher.utils import json_utils
+
+
+class RunContext:
+    """
+    Everything a single RUN event needs, from the validation of its data to
+    its last run_status. Each run owns its context, so concurrent runs never
+    report under each other's execution ids.
+    """
+
+    def __init__(self, data: dict, agent_name: str):
+        self.data = data
+        self.agent_name = agent_name
+        self.execution_ids: List = list(data.get("execution_ids", []))
+        self.workspaces: List[str] = list(data.get("workspaces", []))
+        self.executor_name: Optional[str] = data.get("executor")
+        self.passed_params: dict = data.get("args", {})
+        self.plugin_args: dict = data.get("plugin_args", {})
+        self.executor: Optional[Executor] = None
+        self.process: Optional[Process] = None
+        self.stdout_processor = None
+        self.stderr_processor = None
+        self.progress = None
+        self.task: Optional[Task] = None
+        # While the process is being created, it can not be cancelled
+        self.spawning = False
+        # "timeout" or "cancelled" when the run was stopped by the dispatcher
+        self.stop_reason: Optional[str] = None
+        self.cgroup: Optional[Path] = None
+        self.result_channel = None
+        self.limits_breached: List[str] = []
+        self.received_at = datetime.utcnow()
+        # Seconds waited in the scheduler queue
+        self.wait_time: Optional[float] = None
+        self.start_date: Optional[datetime] = None
+        self.end_date: Optional[datetime] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.start_date is None:
+            return None
+        return ((self.end_date or datetime.utcnow()) - self.start_date).total_seconds()
+
+    def started(self):
+        self.start_date = datetime.utcnow()
+
+    def finished(self):
+        self.end_date = datetime.utcnow()
+
+    def command_json(self) -> dict:
+        return {
+            "tool": self.agent_name,
+            "command": self.executor.name,
+            "user": "",
+            "hostname": "",
+            "params": ", ".join([f"{key}={value}" for (key, value) in self.passed_params.items()]),
+            "import_source": "agent",
+            "start_date": self.start_date.isoformat(),
+        }
+
+    def status(self, running: bool, successful: Optional[bool], message: str, **extra) -> str:
+        status = {
+            "action": "RUN_STATUS",
+            "execution_ids": self.execution_ids,
+            "executor_name": self.executor.name if self.executor is not None else self.executor_name,
+            "running": running,
+            "successful": successful,
+            "message": message,
+        }
+        if not running and self.stdout_processor is not None:
+            status["workspaces"] = self.stdout_processor.workspaces_summary()
+            status["retries"] = self.stdout_processor.retries_summary()
+            status["duration"] = self.duration
+            status["wait_time"] = self.wait_time
+            if self.limits_breached:
+                status["limits_breached"] = self.limits_breached
+            skipped = self.stdout_processor.skipped_summary()
+            if skipped is not None:
+                status["skipped"] = skipped
+            validation = self.stdout_processor.validation_summary()
+            if validation is not None:
+                status["validation"] = validation
+        if not running and successful is False and self.stderr_processor is not None:
+            tail = self.stderr_processor.tail_lines()
+            if tail:
+                status["stderr_tail"] = tail
+        status.update(extra)
+        return json_utils.dumps(status)
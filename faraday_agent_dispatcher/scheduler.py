@@ -0,0 +1,144 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.run_context import RunContext
+
+logger = logging.get_logger()
+
+
+class QueuedRun:
+    def __init__(self, run: RunContext, priority: int, sequence: int):
+        self.run = run
+        self.priority = priority
+        self.sequence = sequence
+        self.granted = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other: "QueuedRun") -> bool:
+        # Higher priority first, FIFO between runs with the same priority
+        return (-self.priority, self.sequence) < (-other.priority, other.sequence)
+
+
+class RunScheduler:
+    """
+    Admission control in front of the executor processes. A run starts when
+    there is a free slot both in the agent (`max_concurrent_runs`) and in its
+    executor (the executor `max_concurrent_runs`), 0 meaning unlimited.
+    Otherwise it waits in a priority queue (FIFO for equal priorities). A
+    run blocked by its executor limit does not hold back runs of other
+    executors.
+    """
+
+    def __init__(self, max_concurrent_runs: int = 0, executor_limits: Dict[str, int] = None):
+        self.max_concurrent_runs = max(max_concurrent_runs, 0)
+        self.executor_limits = executor_limits or {}
+        self.running = 0
+        self.running_per_executor = Counter()
+        self.waiting: List[QueuedRun] = []
+        self.sequence = itertools.count()
+        self.started_runs = 0
+        self.queued_runs = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def can_start(self, executor_name: str) -> bool:
+        if self.max_concurrent_runs and self.running >= self.max_concurrent_runs:
+            return False
+        executor_limit = self.executor_limits.get(executor_name, 0)
+        return not executor_limit or self.running_per_executor[executor_name] < executor_limit
+
+    def position(self, queued: QueuedRun) -> int:
+        return sorted(self.waiting).index(queued) + 1
+
+    async def run(
+        self,
+        run: RunContext,
+        run_f: Callable[[RunContext], Awaitable],
+        on_queued: Optional[Callable[[RunContext, int], Awaitable]] = None,
+    ):
+        await self.acquire(run, on_queued)
+        try:
+            return await run_f(run)
+        finally:
+            self.release(run)
+
+    @staticmethod
+    def priority(run: RunContext) -> int:
+        priority = run.data.get("priority", 0)
+        try:
+            return int(priority)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid priority {priority!r} of run {run.execution_ids}, using 0")
+            return 0
+
+    async def acquire(self, run: RunContext, on_queued=None):
+        queued = QueuedRun(run, self.priority(run), next(self.sequence))
+        heapq.heappush(self.waiting, queued)
+        self.dispatch()
+        try:
+            if not queued.granted.done():
+                self.queued_runs += 1
+                position = self.position(queued)
+                logger.info(f"Run {run.execution_ids} of {run.executor_name} queued in position {position}")
+                if on_queued is not None:
+                    await on_queued(run, position)
+            await queued.granted
+        except asyncio.CancelledError:
+            if queued in self.waiting:
+                self.waiting.remove(queued)
+                heapq.heapify(self.waiting)
+            elif queued.granted.done() and not queued.granted.cancelled():
+                # Granted right before being cancelled, give the slot back
+                self.release(run)
+            raise
+        wait = time.monotonic() - queued.queued_at
+        run.wait_time = wait
+        self.started_runs += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def release(self, run: RunContext):
+        self.running -= 1
+        self.running_per_executor[run.executor_name] -= 1
+        self.dispatch()
+
+    def dispatch(self):
+        for queued in sorted(self.waiting):
+            if queued.granted.done():
+                continue
+            if self.can_start(queued.run.executor_name):
+                self.waiting.remove(queued)
+                self.running += 1
+                self.running_per_executor[queued.run.executor_name] += 1
+                queued.granted.set_result(True)
+        heapq.heapify(self.waiting)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": len(self.waiting),
+            "started_runs": self.started_runs,
+            "queued_runs": self.queued_runs,
+            "average_wait": self.total_wait / self.started_runs if self.started_runs else 0.0,
+            "max_wait": self.max_wait,
+        }
@@ -0,0 +1,301 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.utils.retry_utils import RETRY_STATUSES
+
+logger = logging.get_logger()
+
+SEGMENT_SUFFIX = ".spool"
+OFFSET_SUFFIX = ".offset"
+PARTIAL_SUFFIX = ".partial"
+
+
+def sync_file(file: BinaryIO):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def read_offset(offset_file: Path) -> int:
+    return int(offset_file.read_text()) if offset_file.exists() else 0
+
+
+def remove_partial(partial: Path):
+    if partial.exists():
+        partial.unlink()
+
+
+class SpoolSegment:
+    """
+    Append-only file with the bulk_create payloads of one run. Each record
+    is a JSON header line followed by the body bytes. The file is fsynced
+    every `fsync_every` records or `fsync_interval` seconds, whatever comes
+    first, and when it is closed. Its methods block, the Spool runs them in
+    its I/O thread.
+    """
+
+    def __init__(self, path: Path, fsync_every: int = 16, fsync_interval: float = 1):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        # Opened by the first append, in the I/O thread
+        self.file: Optional[BinaryIO] = None
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    @staticmethod
+    def header(workspace: str, size: int) -> bytes:
+        return json.dumps({"workspace": workspace, "size": size}).encode("utf-8") + b"\n"
+
+    def append(self, workspace: str, body: bytes) -> int:
+        header = self.header(workspace, len(body))
+        if self.file is None:
+            self.file = self.path.open("ab")
+        self.file.write(header)
+        self.file.write(body)
+        self.file.write(b"\n")
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.synced_at >= self.fsync_interval:
+            self.sync()
+        return len(header) + len(body) + 1
+
+    def sync(self):
+        sync_file(self.file)
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        if self.file is not None and not self.file.closed:
+            self.sync()
+            self.file.close()
+
+
+def read_record(segment_file: BinaryIO, path: Path) -> Optional[Tuple[str, bytes, int]]:
+    """
+    (workspace, body, next_offset) of the record at the position of the
+    segment file, None at its end. A torn record at the end of the file (e.g.
+    a crash while writing) is also the end.
+    """
+    header_line = segment_file.readline()
+    if not header_line.endswith(b"\n"):
+        return None
+    try:
+        header = json.loads(header_line)
+    except ValueError:
+        logger.error(f"Corrupted spool segment {path.name}, skipping the rest of it")
+        return None
+    body = segment_file.read(header["size"] + 1)
+    if len(body) != header["size"] + 1:
+        return None
+    return header["workspace"], body[:-1], segment_file.tell()
+
+
+def read_records(path: Path, offset: int = 0):
+    """Yields the records of a segment, see read_record"""
+    with path.open("rb") as segment_file:
+        segment_file.seek(offset)
+        while True:
+            record = read_record(segment_file, path)
+            if record is None:
+                return
+            yield record
+
+
+class Spool:
+    """
+    Write-ahead spool of bulk_create payloads that could not be delivered
+    because the server was down or overloaded. There is one segment per run,
+    replayed in order once the server is reachable again. When the spool
+    grows over `max_size` bytes, the oldest closed segments are evicted.
+
+    The reads, writes and fsyncs run in a single thread of their own, so the
+    event loop (and the socket.io heartbeats) never waits for the disk, and
+    the records of a segment are written in the order they were appended.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_size: int = 512 * 1024 * 1024,
+        replay_concurrency: int = 2,
+        fsync_every: int = 16,
+        fsync_interval: float = 1,
+    ):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.replay_concurrency = max(replay_concurrency, 1)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.open_segments: Dict[str, SpoolSegment] = {}
+        self.path.mkdir(parents=True, exist_ok=True)
+        for partial in self.path.glob(f"*{PARTIAL_SUFFIX}"):
+            # Interrupted while streaming it, never complete
+            partial.unlink()
+        self.size = sum(segment.stat().st_size for segment in self.segments())
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool")
+        self.__replay_lock = None
+
+    async def run_io(self, function: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, function, *args)
+
+    def segments(self) -> List[Path]:
+        # Names start with the creation timestamp, so this is oldest first
+        return sorted(self.path.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def pending(self) -> List[Path]:
+        return [segment for segment in self.segments() if segment.stem not in self.open_segments]
+
+    @staticmethod
+    def new_run_id(execution_ids: list) -> str:
+        return f"{time.time_ns()}_{'-'.join(str(execution_id) for execution_id in execution_ids)}"
+
+    def has_room(self, workspace: str, record_size: int) -> bool:
+        if self.size + record_size > self.max_size:
+            self.evict(record_size)
+        if self.size + record_size > self.max_size:
+            logger.error(f"Spool is full ({self.max_size} bytes), dropping payload for workspace {workspace}")
+            return False
+        return True
+
+    async def append(self, run_id: str, workspace: str, body: bytes) -> bool:
+        record_size = len(SpoolSegment.header(workspace, len(body))) + len(body) + 1
+        if not self.has_room(workspace, record_size):
+            return False
+        # Taken before writing, so concurrent appends can not overflow the spool
+        self.size += record_size
+        try:
+            if run_id not in self.open_segments:
+                self.open_segments[run_id] = SpoolSegment(
+                    self.path / f"{run_id}{SEGMENT_SUFFIX}", self.fsync_every, self.fsync_interval
+                )
+            await self.run_io(self.open_segments[run_id].append, workspace, body)
+        except OSError as e:
+            self.size -= record_size
+            logger.error(f"Could not spool the payload for workspace {workspace}: {e}")
+            return False
+        logger.warning(f"Payload for workspace {workspace} spooled to be sent later")
+        return True
+
+    async def append_stream(self, run_id: str, workspace: str, size: int, chunks: AsyncIterator[bytes]) -> bool:
+        """
+        As append, for bodies that are not held in memory (e.g. result files).
+        The body is streamed to a segment of its own, renamed to be replayed
+        only once it is complete.
+        """
+        header = SpoolSegment.header(workspace, size)
+        record_size = len(header) + size + 1
+        if not self.has_room(workspace, record_size):
+            return False
+        self.size += record_size
+        segment = self.path / f"{run_id}_{time.time_ns()}{SEGMENT_SUFFIX}"
+        partial = segment.with_suffix(PARTIAL_SUFFIX)
+        try:
+            segment_file = await self.run_io(partial.open, "wb")
+            try:
+                await self.run_io(segment_file.write, header)
+                written = 0
+                async for chunk in chunks:
+                    await self.run_io(segment_file.write, chunk)
+                    written += len(chunk)
+                if written != size:
+                    raise ValueError(f"the body has {written} bytes instead of {size}")
+                await self.run_io(segment_file.write, b"\n")
+                await self.run_io(sync_file, segment_file)
+            finally:
+                await self.run_io(segment_file.close)
+            await self.run_io(partial.rename, segment)
+        except (OSError, ValueError) as e:
+            self.size -= record_size
+            logger.error(f"Could not spool the payload for workspace {workspace}: {e}")
+            return False
+        finally:
+            await self.run_io(remove_partial, partial)
+        logger.warning(f"Payload for workspace {workspace} spooled to be sent later")
+        return True
+
+    async def close(self, run_id: str):
+        segment = self.open_segments.pop(run_id, None)
+        if segment is not None:
+            await self.run_io(segment.close)
+
+    async def close_all(self):
+        for run_id in list(self.open_segments):
+            await self.close(run_id)
+
+    def evict(self, needed: int):
+        for segment in self.pending():
+            if self.size + needed <= self.max_size:
+                break
+            logger.warning(f"Spool size limit reached, evicting the oldest segment {segment.name}")
+            self.remove(segment)
+
+    def remove(self, segment: Path):
+        if not segment.exists():
+            # Already evicted while it was being replayed
+            return
+        self.size -= segment.stat().st_size
+        segment.unlink()
+        offset_file = segment.with_suffix(OFFSET_SUFFIX)
+        if offset_file.exists():
+            offset_file.unlink()
+
+    async def replay(self, post_f: Callable[[str, bytes], Awaitable[Optional[int]]]):
+        """
+        Replays every closed segment. `post_f` returns the server status or
+        None if the server could not be reached.
+        """
+        if self.__replay_lock is None:
+            self.__replay_lock = asyncio.Lock()
+        if self.__replay_lock.locked():
+            return
+        async with self.__replay_lock:
+            semaphore = asyncio.Semaphore(self.replay_concurrency)
+
+            async def bounded_replay(segment: Path):
+                async with semaphore:
+                    await self.replay_segment(segment, post_f)
+
+            await asyncio.gather(*(bounded_replay(segment) for segment in self.pending()))
+
+    async def replay_segment(self, segment: Path, post_f: Callable[[str, bytes], Awaitable[Optional[int]]]):
+        offset_file = segment.with_suffix(OFFSET_SUFFIX)
+        offset = await self.run_io(read_offset, offset_file)
+        segment_file = await self.run_io(segment.open, "rb")
+        try:
+            await self.run_io(segment_file.seek, offset)
+            while True:
+                record = await self.run_io(read_record, segment_file, segment)
+                if record is None:
+                    break
+                workspace, body, next_offset = record
+                status = await post_f(workspace, body)
+                if status is None or status in RETRY_STATUSES:
+                    logger.info(f"Server still unavailable, spool segment {segment.name} kept for later")
+                    return
+                if status != 201:
+                    logger.error(f"Spooled payload for workspace {workspace} rejected by the server: {status}")
+                await self.run_io(offset_file.write_text, str(next_offset))
+        finally:
+            await self.run_io(segment_file.close)
+        logger.info(f"Spool segment {segment.name} replayed")
+        self.remove(segment)
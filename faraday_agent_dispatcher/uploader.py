@@ -0,0 +1,570 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import itertools
+import zlib
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Set, Union
+
+from aiohttp import ClientConnectionError, ClientSession
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.config import instance as config
+from faraday_agent_dispatcher.delta import DeltaFilter
+from faraday_agent_dispatcher.host_merge import HostMergeIndex
+from faraday_agent_dispatcher.result_channel import ResultFile
+from faraday_agent_dispatcher.spool import Spool
+from faraday_agent_dispatcher.utils import json_utils
+from faraday_agent_dispatcher.utils.rate_utils import RateLimiter
+from faraday_agent_dispatcher.utils.retry_utils import (
+    RETRY_STATUSES,
+    RetryBudget,
+    RetryPolicy,
+    RetryStats,
+    request_with_retry,
+)
+from faraday_agent_dispatcher.utils.url_utils import api_url
+
+logger = logging.get_logger()
+
+GZIP_CHUNK_SIZE = 64 * 1024
+
+
+def bulk_create_url(workspace: str, secure: bool) -> str:
+    return api_url(
+        config["server"]["host"],
+        config["server"]["api_port"],
+        postfix="/_api/v3/ws/" f"{workspace}/bulk_create",
+        secure=secure,
+    )
+
+
+def bulk_create_headers() -> list:
+    return [("authorization", f"agent {config['tokens'].get('agent')}")]
+
+
+class EncodedPayload:
+    """
+    A bulk_create payload serialized once for every workspace of a run. Each
+    host is encoded on its own and only those bytes are kept: the body is
+    streamed from them without its closing brace, and the envelope of each
+    workspace (execution_id and command) is spliced after it, so the hosts are
+    never encoded nor copied again per workspace. The gzip compression of the
+    body is also done once, each workspace only compresses its envelope from
+    a copy of the compressor state.
+
+    Big payloads can be split in chunks of hosts without encoding them again.
+    """
+
+    ENVELOPE_KEYS = ("execution_id", "command")
+    # Room left in every chunk for the envelope
+    ENVELOPE_SIZE = 1024
+
+    def __init__(self, payload: dict):
+        payload = {key: value for key, value in payload.items() if key not in self.ENVELOPE_KEYS}
+        hosts = payload.pop("hosts") if isinstance(payload.get("hosts"), list) else None
+        self._build(
+            [json_utils.dumps_bytes(host) for host in hosts] if hosts is not None else None,
+            json_utils.dumps_bytes(payload)[1:-1],
+        )
+
+    @classmethod
+    def from_parts(cls, hosts: Optional[List[bytes]], members: bytes) -> "EncodedPayload":
+        payload = cls.__new__(cls)
+        payload._build(hosts, members)
+        return payload
+
+    def _build(self, hosts: Optional[List[bytes]], members: bytes):
+        self.hosts = hosts
+        # The other members of the payload, without braces
+        self.members = members
+        self.empty = hosts is None and not members
+        # Both braces and the members
+        self.size = len(members) + 2
+        if hosts is not None:
+            self.size += len(b'"hosts":[]') + sum(len(host) for host in hosts) + max(len(hosts) - 1, 0)
+            if members:
+                self.size += 1
+        self.envelope = {}
+        # Shared with the copies of every workspace
+        self.gzip = {"lock": None, "prefix": None, "compressor": None}
+        self._halves = None
+
+    def _body_parts(self) -> Iterator[bytes]:
+        yield b"{"
+        if self.hosts is not None:
+            yield b'"hosts":['
+            for index, host in enumerate(self.hosts):
+                if index:
+                    yield b","
+                yield host
+            yield b"]"
+            if self.members:
+                yield b","
+        yield self.members
+
+    def _body(self, chunk_size: int = GZIP_CHUNK_SIZE) -> Iterator[bytes]:
+        """The body without its closing brace, in pieces of about chunk_size bytes"""
+        pending = []
+        pending_size = 0
+        for part in self._body_parts():
+            pending.append(part)
+            pending_size += len(part)
+            if pending_size >= chunk_size:
+                yield b"".join(pending)
+                pending = []
+                pending_size = 0
+        if pending:
+            yield b"".join(pending)
+
+    def split(self, max_bytes: int = 0, max_hosts: int = 0) -> List["EncodedPayload"]:
+        """Chunks of consecutive hosts under the byte and hosts budgets (0 is no limit)"""
+        if (
+            not self.hosts
+            or (not max_bytes or self.size + self.ENVELOPE_SIZE <= max_bytes)
+            and (not max_hosts or len(self.hosts) <= max_hosts)
+        ):
+            return [self]
+        chunks = []
+        members = self.members
+        hosts = []
+        base_size = len(b'{"hosts":[]}') + len(members) + self.ENVELOPE_SIZE
+        size = base_size
+        for host in self.hosts:
+            if hosts and ((max_hosts and len(hosts) >= max_hosts) or (max_bytes and size + len(host) + 1 > max_bytes)):
+                chunks.append(EncodedPayload.from_parts(hosts, members))
+                # The other members are only sent once, in the first chunk
+                members = b""
+                hosts = []
+                size = base_size
+            hosts.append(host)
+            size += len(host) + 1
+        chunks.append(EncodedPayload.from_parts(hosts, members))
+        return chunks
+
+    def halves(self) -> Optional[List["EncodedPayload"]]:
+        """Built once, every workspace rejected with a 413 shares them"""
+        if not self.hosts or len(self.hosts) < 2:
+            return None
+        if self._halves is None:
+            middle = len(self.hosts) // 2
+            self._halves = [
+                EncodedPayload.from_parts(self.hosts[:middle], self.members),
+                EncodedPayload.from_parts(self.hosts[middle:], b""),
+            ]
+        return self._halves
+
+    def with_envelope(self, envelope: dict) -> "EncodedPayload":
+        payload = EncodedPayload.__new__(EncodedPayload)
+        payload.hosts = self.hosts
+        payload.members = self.members
+        payload.size = self.size
+        payload.empty = self.empty
+        payload.envelope = envelope
+        payload.gzip = self.gzip
+        payload._halves = None
+        return payload
+
+    def tail(self) -> bytes:
+        members = json_utils.dumps_bytes(self.envelope)[1:-1]
+        if members and not self.empty:
+            members = b"," + members
+        return members + b"}"
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        for piece in self._body():
+            yield piece
+        yield self.tail()
+
+    async def _gzip_prefix(self, chunk_size: int = GZIP_CHUNK_SIZE):
+        if self.gzip["lock"] is None:
+            self.gzip["lock"] = asyncio.Lock()
+        async with self.gzip["lock"]:
+            if self.gzip["compressor"] is None:
+                compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+                prefix = []
+                for piece in self._body(chunk_size):
+                    prefix.append(compressor.compress(piece))
+                    # Let other tasks run between chunks of huge payloads
+                    await asyncio.sleep(0)
+                self.gzip["prefix"] = b"".join(prefix)
+                self.gzip["compressor"] = compressor
+        return self.gzip["prefix"], self.gzip["compressor"].copy()
+
+    async def gzip_chunks(self) -> AsyncIterator[bytes]:
+        prefix, compressor = await self._gzip_prefix()
+        yield prefix
+        yield compressor.compress(self.tail()) + compressor.flush()
+
+    async def read(self) -> bytes:
+        return b"".join(itertools.chain(self._body_parts(), [self.tail()]))
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class BulkCreateUploader:
+    """
+    Async upload stage between the executor output and the bulk_create
+    endpoint. Payloads are queued (with backpressure when the queue is full)
+    and posted by a set of worker tasks, so the event loop is never blocked
+    waiting for the server. Each payload is sent concurrently to every
+    workspace of the run, bounded by the workspace concurrency.
+    """
+
+    # Shared by every run, once the server rejects gzip bodies there is no
+    # reason to try again
+    compression_supported = True
+    COMPRESSION_REJECTED_STATUSES = (400, 411, 415)
+
+    def __init__(
+        self,
+        session: ClientSession,
+        execution_ids: List,
+        workspaces: List[str],
+        api_ssl_enabled,
+        api_kwargs,
+        command_json: dict,
+        workers: int = 2,
+        queue_size: int = 64,
+        rate: float = 0,
+        workspace_concurrency: int = 4,
+        spool: Spool = None,
+        delta: DeltaFilter = None,
+        max_bytes: int = 0,
+        max_hosts: int = 0,
+    ):
+        self.__session = session
+        self.execution_ids = execution_ids
+        self.workspaces = workspaces
+        self.api_ssl_enabled = api_ssl_enabled
+        self.api_kwargs = api_kwargs
+        self.command_json = command_json
+        self.workers_count = max(workers, 1)
+        self.queue_size = max(queue_size, 1)
+        self.rate_limiter = RateLimiter(rate)
+        self.workspace_concurrency = max(workspace_concurrency, 1)
+        self.fanout_semaphore = None
+        self.workspace_stats = {workspace: {"sent": 0, "failed": 0, "spooled": 0} for workspace in workspaces}
+        self.compress = config["server"].get("compress_uploads", False)
+        self.retry_policy = RetryPolicy.from_config(config["server"])
+        # Every request of the run draws from the same budget, so a server
+        # that keeps failing is not hammered once per payload and workspace
+        self.retry_budget = RetryBudget(int(config["server"].get("retry_budget", 20)))
+        self.retry_stats = RetryStats()
+        self.spool = spool
+        self.delta = delta
+        # Adjusted when the server rejects a payload as too large
+        self.max_bytes = max(max_bytes, 0)
+        self.max_hosts = max(max_hosts, 0)
+        self.run_id = Spool.new_run_id(execution_ids)
+        self.queue = None
+        self.workers = []
+
+    def post_url(self, ws):
+        return bulk_create_url(ws, self.api_ssl_enabled)
+
+    @staticmethod
+    def headers():
+        return bulk_create_headers()
+
+    def start(self):
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.fanout_semaphore = asyncio.Semaphore(self.workspace_concurrency)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    async def put(self, payload: dict):
+        if not self.workers:
+            self.start()
+        await self.queue.put(payload)
+
+    async def join(self):
+        if self.workers:
+            await self.queue.join()
+
+    async def close(self):
+        for worker in self.workers:
+            worker.cancel()
+        if self.workers:
+            await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.spool is not None:
+            await self.spool.close(self.run_id)
+
+    async def _worker(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                await self.send(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Unexpected error uploading data to bulk create: {e}")
+                logger.debug("Upload failed traceback", exc_info=e)
+            finally:
+                self.queue.task_done()
+
+    async def send(self, payload: Union[dict, ResultFile], track: bool = True):
+        if isinstance(payload, dict) and self.delta is not None:
+            await self.send_delta(payload, track)
+            return
+        if isinstance(payload, dict):
+            # Serialized once, whatever the number of workspaces
+            payload = EncodedPayload(payload)
+        chunks = self.split(payload)
+        await asyncio.gather(
+            *(
+                self._send_to_workspace(workspace, execution_id, chunks, track)
+                for workspace, execution_id in zip(self.workspaces, self.execution_ids)
+            )
+        )
+
+    def split(self, payload: Union[EncodedPayload, ResultFile]) -> List[Union[EncodedPayload, ResultFile]]:
+        """Chunks shared by every workspace, so each one is joined and compressed once"""
+        if isinstance(payload, EncodedPayload):
+            return payload.split(self.max_bytes, self.max_hosts)
+        return [payload]
+
+    async def send_delta(self, payload: dict, track: bool):
+        fingerprints = self.delta.fingerprints(payload)
+        # Workspaces that need the same records share the encoded payload
+        groups = {}
+        for workspace, execution_id in zip(self.workspaces, self.execution_ids):
+            delta_payload, digests = self.delta.filter(workspace, payload, fingerprints)
+            if delta_payload is None:
+                logger.debug(f"Nothing new to send to workspace {workspace}")
+                continue
+            key = frozenset(digests)
+            if key not in groups:
+                groups[key] = (self.split(EncodedPayload(delta_payload)), digests, [])
+            groups[key][2].append((workspace, execution_id))
+        await asyncio.gather(
+            *(
+                self._send_to_workspace(workspace, execution_id, chunks, track, digests)
+                for chunks, digests, targets in groups.values()
+                for workspace, execution_id in targets
+            )
+        )
+
+    async def _send_to_workspace(
+        self,
+        workspace: str,
+        execution_id,
+        payloads: List[Union[EncodedPayload, ResultFile]],
+        track: bool,
+        digests: Set[bytes] = None,
+    ):
+        envelope = {"execution_id": execution_id, "command": self.command_json}
+        chunks = deque(payloads)
+        all_sent = True
+        # Chunks are sent in order, one at a time for each workspace
+        while chunks:
+            shared = chunks.popleft()
+            chunk = shared.with_envelope(envelope)
+            status = await self._upload(workspace, chunk)
+            if status == 413 and isinstance(chunk, EncodedPayload):
+                halves = shared.halves()
+                if halves is not None:
+                    self.lower_max_bytes(chunk.size // 2)
+                    chunks.extendleft(reversed(halves))
+                    continue
+            all_sent = all_sent and status == 201
+            spooled = False
+            if status != 201 and self.spool is not None and (status is None or status in RETRY_STATUSES):
+                if isinstance(chunk, ResultFile):
+                    spooled = await self.spool.append_stream(self.run_id, workspace, chunk.size, chunk.chunks())
+                else:
+                    spooled = await self.spool.append(self.run_id, workspace, await chunk.read())
+            if track:
+                self.workspace_stats[workspace]["sent" if status == 201 else "failed"] += 1
+                if spooled:
+                    self.workspace_stats[workspace]["spooled"] += 1
+        if digests:
+            if all_sent:
+                self.delta.commit(workspace, digests)
+            else:
+                self.delta.fail(workspace)
+
+    async def _upload(self, workspace: str, payload: Union[EncodedPayload, ResultFile]) -> Optional[int]:
+        try:
+            async with self.fanout_semaphore:
+                await self.rate_limiter.acquire()
+                return await self.post(workspace, payload)
+        except asyncio.CancelledError:
+            raise
+        except (ClientConnectionError, asyncio.TimeoutError) as e:
+            logger.error(f"Can not connect to Faraday server to send data to workspace {workspace}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Error sending data to bulk create of workspace {workspace}: {e}")
+            logger.debug("Upload failed traceback", exc_info=e)
+            return 0
+
+    def lower_max_bytes(self, max_bytes: int):
+        if not self.max_bytes or max_bytes < self.max_bytes:
+            self.max_bytes = max(max_bytes, 1)
+            logger.warning(f"Payload too large for the server, splitting uploads in chunks of {self.max_bytes} bytes")
+
+    def summary(self) -> dict:
+        return {workspace: dict(stats) for workspace, stats in self.workspace_stats.items()}
+
+    async def post(self, workspace: str, payload: Union[EncodedPayload, ResultFile]) -> int:
+        compressed = self.compress and BulkCreateUploader.compression_supported
+        res = await self._request(workspace, payload, compressed)
+        if compressed and res.status in self.COMPRESSION_REJECTED_STATUSES:
+            logger.warning(f"Server responded {res.status} to a compressed upload, retrying without compression")
+            res = await self._request(workspace, payload, False)
+            if res.status == 201:
+                logger.warning("Disabling compressed uploads, the server does not support them")
+                BulkCreateUploader.compression_supported = False
+        if res.status == 201:
+            logger.info("Data sent to bulk create")
+            return res.status
+        if res.status == 413 and isinstance(payload, EncodedPayload) and payload.hosts and len(payload.hosts) > 1:
+            # Split and sent again by the caller
+            res.release()
+            return res.status
+        logger.error(
+            "Invalid data supplied by the executor to the bulk create "
+            f"endpoint. Server responded: {res.status} "
+            f"{await res.text()}"
+        )
+        return res.status
+
+    async def _request(self, workspace: str, payload: Union[EncodedPayload, ResultFile], compressed: bool):
+        return await request_with_retry(
+            lambda: self._post(workspace, payload, compressed),
+            self.retry_policy,
+            self.retry_budget,
+            self.retry_stats,
+            description=f"Bulk create to workspace {workspace}",
+            retry_connection_errors=True,
+        )
+
+    async def _post(self, workspace: str, payload: Union[EncodedPayload, ResultFile], compressed: bool):
+        # Streamed bodies are generators, they are built again for every attempt
+        if isinstance(payload, EncodedPayload):
+            body = payload.gzip_chunks() if compressed else payload.chunks()
+        else:
+            body = gzip_stream(payload.chunks()) if compressed else payload.chunks()
+        headers = self.headers() + [("Content-Type", "application/json")]
+        if compressed:
+            headers.append(("Content-Encoding", "gzip"))
+        return await self.__session.post(
+            self.post_url(workspace),
+            data=body,
+            headers=headers,
+            raise_for_status=False,
+            **self.api_kwargs,
+        )
+
+
+class BulkCreateBatcher:
+    """
+    Coalesces consecutive executor results into a single bulk_create payload
+    by concatenating their hosts. The batch is flushed when it reaches the
+    lines count or the byte size limit, or when the oldest line waited more
+    than the timeout. Results with other keys than the mergeable ones are
+    sent as they are, keeping the original order.
+
+    With merge_hosts, the hosts of the batch are merged in a HostMergeIndex,
+    and only the byte size and the timeout flush the batch unless a lines
+    count is also set.
+    """
+
+    MERGEABLE_KEYS = {"hosts", "command", "execution_id"}
+
+    def __init__(
+        self,
+        flush_f: Callable[[dict], Awaitable],
+        max_lines: int = 1,
+        max_bytes: int = 1024 * 1024,
+        timeout: float = 5,
+        merge_hosts: bool = False,
+    ):
+        self.flush_f = flush_f
+        self.max_lines = max(max_lines, 1)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.merge_index = HostMergeIndex() if merge_hosts else None
+        self.hosts = []
+        self.lines = 0
+        self.size = 0
+        self.timer = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_lines > 1 or self.merge_index is not None
+
+    def mergeable(self, payload: dict) -> bool:
+        return (
+            isinstance(payload, dict)
+            and isinstance(payload.get("hosts"), list)
+            and payload.keys() <= self.MERGEABLE_KEYS
+        )
+
+    async def add(self, payload: dict, size: int):
+        if not self.enabled or not self.mergeable(payload):
+            await self.flush()
+            await self.flush_f(payload)
+            return
+        if self.merge_index is not None:
+            self.merge_index.extend(payload["hosts"])
+        else:
+            self.hosts.extend(payload["hosts"])
+        self.lines += 1
+        self.size += size
+        if self.lines == 1 and self.timeout > 0:
+            self.timer = asyncio.create_task(self._flush_on_timeout())
+        if (self.max_lines > 1 and self.lines >= self.max_lines) or self.size >= self.max_bytes:
+            await self.flush()
+
+    async def flush(self):
+        if self.lines == 0:
+            return
+        if self.merge_index is not None:
+            if self.merge_index.merged:
+                logger.debug(f"Merged {self.merge_index.merged} duplicated hosts of {self.lines} lines")
+            payload = {"hosts": self.merge_index.pop_hosts()}
+        else:
+            payload = {"hosts": self.hosts}
+        self.hosts = []
+        self.lines = 0
+        self.size = 0
+        if self.timer is not None and self.timer is not asyncio.current_task():
+            self.timer.cancel()
+        self.timer = None
+        await self.flush_f(payload)
+
+    async def close(self):
+        await self.flush()
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    async def _flush_on_timeout(self):
+        await asyncio.sleep(self.timeout)
+        await self.flush()
@@ -1,4 +1,4 @@
-from marshmallow import fields, schema, ValidationError, validates_schema
+from marshmallow import fields, schema, validate, ValidationError, validates_schema
 
 
 def control_int(nullable=False):
@@ -15,6 +15,20 @@ def control_int(nullable=False):
     return control
 
 
+def control_float(nullable=False):
+    def control(field_name, value):
+        if value is None and nullable:
+            return
+        if value is None:
+            raise ValueError(f"Trying to parse {field_name} with None value and should be " "a number")
+        try:
+            float(value)
+        except ValueError:
+            raise ValueError(f"Trying to parse {field_name} with value {value} and should " "be a number")
+
+    return control
+
+
 def control_str(nullable=False):
     def control(field_name, value):
         if value is None and nullable:
@@ -44,6 +58,11 @@ def control_bool(field_name, value):
         raise ValueError(f"Trying to parse {field_name} with value {value} and should be a " f"bool")
 
 
+def control_optional_bool(field_name, value):
+    if value is not None:
+        control_bool(field_name, value)
+
+
 def control_registration_token(field_name: str, value: str):
     if value is None:
         raise ValueError("No connected before, provide a token. For more " "help see `faraday-dispatcher run --help`")
@@ -64,6 +83,16 @@ def control_token(field_name, size: int, value: str):
         raise ValueError(f"{field_name} must be {size} character length")
 
 
+def control_limits(field_name, value):
+    if value is None:
+        return
+    if not isinstance(value, dict):
+        raise ValueError(f"{field_name} must be a dictionary")
+    errors = LimitsSchema().validate(value)
+    if errors:
+        raise ValueError(errors)
+
+
 def control_executors(field_name, value):
     if not isinstance(value, dict):
         raise ValueError(f"{field_name} must be a dictionary")
@@ -88,8 +117,39 @@ class ParamsField(fields.Field):
                 raise ValidationError(f'{param} - "base" field missing or not string')
 
 
+class LimitsSchema(schema.Schema):
+    memory = fields.Integer(validate=validate.Range(min=1))
+    cpu_time = fields.Integer(validate=validate.Range(min=1))
+    nofile = fields.Integer(validate=validate.Range(min=1))
+    nice = fields.Integer(validate=validate.Range(min=-20, max=19))
+    cgroup = fields.String()
+
+
 class ExecutorSchema(schema.Schema):
     max_size = fields.Integer(required=True)
+    batch_lines = fields.Integer(validate=validate.Range(min=1))
+    batch_size = fields.Integer(validate=validate.Range(min=1))
+    batch_timeout = fields.Float(validate=validate.Range(min=0))
+    merge_hosts = fields.Boolean()
+    delta_uploads = fields.Boolean()
+    delta_resync_interval = fields.Float(validate=validate.Range(min=0))
+    validate_results = fields.Boolean()
+    quarantine_results = fields.Boolean()
+    upload_workers = fields.Integer(validate=validate.Range(min=1))
+    upload_queue_size = fields.Integer(validate=validate.Range(min=1))
+    upload_rate = fields.Float(validate=validate.Range(min=0))
+    upload_max_bytes = fields.Integer(validate=validate.Range(min=0))
+    upload_max_hosts = fields.Integer(validate=validate.Range(min=0))
+    workspace_concurrency = fields.Integer(validate=validate.Range(min=1))
+    max_concurrent_runs = fields.Integer(validate=validate.Range(min=0))
+    timeout = fields.Float(validate=validate.Range(min=0))
+    limits = fields.Nested(LimitsSchema)
+    framing = fields.String(validate=validate.OneOf(["ndjson", "length", "chunked"]))
+    result_channel = fields.String(validate=validate.OneOf(["stdout", "fd", "file"]))
+    stderr_tail = fields.Integer(validate=validate.Range(min=0))
+    stderr_rate = fields.Float(validate=validate.Range(min=0))
+    progress_interval = fields.Float(validate=validate.Range(min=0))
+    check_cmds_ttl = fields.Float(validate=validate.Range(min=0))
     repo_executor = fields.String()
     repo_name = fields.String()
     cmd = fields.String()
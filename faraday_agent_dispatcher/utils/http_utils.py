@@ -0,0 +1,101 @@
+import ssl
+from collections import Counter
+from typing import List, Optional
+
+from aiohttp import ClientSession, TCPConnector, TraceConfig
+
+from faraday_agent_dispatcher import logger as logging
+
+logger = logging.get_logger()
+
+
+class ConnectionStats:
+    """Counters of the pool connections, filled by aiohttp request tracing"""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.trace_config = TraceConfig()
+        for signal, counter in (
+            (self.trace_config.on_request_start, "requests"),
+            (self.trace_config.on_request_exception, "request_errors"),
+            (self.trace_config.on_connection_create_end, "connections_created"),
+            (self.trace_config.on_connection_reuseconn, "connections_reused"),
+            (self.trace_config.on_connection_queued_start, "connections_queued"),
+            (self.trace_config.on_dns_cache_hit, "dns_cache_hits"),
+            (self.trace_config.on_dns_cache_miss, "dns_cache_misses"),
+        ):
+            signal.append(self.counter(counter))
+
+    def counter(self, name: str):
+        async def count(session, trace_config_ctx, params):
+            self.counters[name] += 1
+
+        return count
+
+    def as_dict(self) -> dict:
+        return dict(self.counters)
+
+
+class HttpPool:
+    """
+    The connection pool shared by the REST API calls and the socket.io
+    transport, so both reuse the same keep-alive connections (and TLS
+    handshakes) to the server. Sessions built from it do not own the
+    connector, it is closed once with the pool.
+
+    Server options:
+        http_pool_limit: max connections of the pool (default 100).
+        http_pool_limit_per_host: max connections to the same host (default 16).
+        http_keepalive_timeout: seconds an idle connection is kept (default 60).
+        http_dns_cache_ttl: seconds a DNS resolution is cached (default 300).
+    """
+
+    def __init__(
+        self,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        limit: int = 100,
+        limit_per_host: int = 16,
+        keepalive_timeout: float = 60,
+        dns_cache_ttl: int = 300,
+    ):
+        self.stats = ConnectionStats()
+        self.connector = TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl,
+            # One context for every connection, the certificates are loaded once
+            ssl=ssl_context if ssl_context is not None else True,
+        )
+        self.sessions: List[ClientSession] = []
+
+    @classmethod
+    def from_config(cls, server_config, ssl_context: Optional[ssl.SSLContext] = None) -> "HttpPool":
+        return cls(
+            ssl_context,
+            limit=int(server_config.get("http_pool_limit", 100)),
+            limit_per_host=int(server_config.get("http_pool_limit_per_host", 16)),
+            keepalive_timeout=float(server_config.get("http_keepalive_timeout", 60)),
+            dns_cache_ttl=int(server_config.get("http_dns_cache_ttl", 300)),
+        )
+
+    def session(self, **kwargs) -> ClientSession:
+        session = ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            trust_env=True,
+            trace_configs=[self.stats.trace_config],
+            **kwargs,
+        )
+        self.sessions.append(session)
+        return session
+
+    async def close(self):
+        for session in self.sessions:
+            if not session.closed:
+                await session.close()
+        self.sessions = []
+        if not self.connector.closed:
+            await self.connector.close()
+        logger.info(f"HTTP connections: {self.stats.as_dict()}")
@@ -0,0 +1,78 @@
+"""
+JSON codec of the dispatcher hot path. The fastest of orjson, msgspec and
+ujson installed is used, falling back to the stdlib json module. The
+FARADAY_JSON_CODEC environment variable forces one of them (e.g. "stdlib").
+
+Values the fast codecs can not handle (e.g. integers over 64 bits) are
+encoded and decoded with the stdlib, and decoding errors are always raised as
+stdlib `json.JSONDecodeError`, with its messages. Note that orjson and msgspec
+write NaN and infinities as null, which is valid JSON, where the stdlib writes
+the NaN and Infinity tokens.
+"""
+
+import json
+import os
+from typing import Any, Union
+
+_forced = os.environ.get("FARADAY_JSON_CODEC", "").lower()
+
+
+def _load_codec():
+    candidates = [_forced] if _forced else ["orjson", "msgspec", "ujson"]
+    for candidate in candidates:
+        try:
+            if candidate == "orjson":
+                import orjson
+
+                def encode(obj) -> bytes:
+                    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+                return "orjson", encode, orjson.loads, (TypeError,)
+            if candidate == "msgspec":
+                import msgspec
+
+                encoder = msgspec.json.Encoder()
+                return "msgspec", encoder.encode, msgspec.json.decode, (TypeError, msgspec.EncodeError)
+            if candidate == "ujson":
+                import ujson
+
+                def encode(obj) -> bytes:
+                    return ujson.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+                return "ujson", encode, ujson.loads, (TypeError, OverflowError)
+        except ImportError:
+            continue
+    return "stdlib", None, None, ()
+
+
+CODEC, _encode, _decode, _ENCODE_ERRORS = _load_codec()
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if _decode is not None:
+        try:
+            return _decode(data)
+        except Exception:
+            # Either invalid, raised below with the stdlib messages, or valid
+            # JSON the fast codec does not support
+            pass
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    if _encode is not None:
+        try:
+            return _encode(obj)
+        except _ENCODE_ERRORS:
+            pass
+    return json.dumps(obj).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """Also the aiohttp ClientSession `json_serialize` hook"""
+    if _encode is not None:
+        try:
+            return _encode(obj).decode("utf-8")
+        except _ENCODE_ERRORS:
+            pass
+    return json.dumps(obj)
@@ -0,0 +1,154 @@
+import os
+import signal
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import faraday_agent_dispatcher.logger as logging
+
+try:
+    import resource
+except ImportError:  # pragma: no cover, not available on Windows
+    resource = None
+
+logger = logging.get_logger()
+
+# Shell exit code when its child was killed by a signal
+SIGNAL_EXIT_BASE = 128
+
+
+class ResourceLimits:
+    """
+    Resource limits of the processes of an executor. The rlimits and the
+    niceness are set in the child before the executor command runs, so every
+    process it spawns inherits them. Note the memory rlimit (RLIMIT_AS)
+    applies to each process; when `cgroup` is the path of a writable cgroup
+    v2 group (e.g. one delegated to the dispatcher user), each run also gets
+    its own sub-group with `memory.max`, bounding the run as a whole.
+    """
+
+    def __init__(
+        self,
+        memory: int = None,
+        cpu_time: int = None,
+        nofile: int = None,
+        nice: int = None,
+        cgroup: str = None,
+    ):
+        self.memory = memory
+        self.cpu_time = cpu_time
+        self.nofile = nofile
+        self.nice = nice
+        self.cgroup = Path(cgroup) if cgroup else None
+        self.memory_controller: Optional[bool] = None
+
+    @property
+    def enabled(self) -> bool:
+        return any(value is not None for value in (self.memory, self.cpu_time, self.nofile, self.nice, self.cgroup))
+
+    def rlimits(self) -> list:
+        if resource is None:
+            return []
+        rlimits = []
+        if self.memory is not None:
+            rlimits.append((resource.RLIMIT_AS, self.memory))
+        if self.cpu_time is not None:
+            rlimits.append((resource.RLIMIT_CPU, self.cpu_time))
+        if self.nofile is not None:
+            rlimits.append((resource.RLIMIT_NOFILE, self.nofile))
+        return rlimits
+
+    def preexec_fn(self, cgroup_path: Optional[Path] = None) -> Optional[Callable[[], None]]:
+        """
+        Function to run in the child between fork and exec. Nothing is
+        logged from there, errors abort the process creation.
+        """
+        rlimits = self.rlimits()
+        if not rlimits and self.nice is None and cgroup_path is None:
+            return None
+        nice = self.nice
+
+        def apply_limits():
+            if cgroup_path is not None:
+                (cgroup_path / "cgroup.procs").write_text("0")
+            for limit, value in rlimits:
+                _, hard = resource.getrlimit(limit)
+                if hard != resource.RLIM_INFINITY:
+                    value = min(value, hard)
+                resource.setrlimit(limit, (value, hard))
+            if nice is not None:
+                try:
+                    os.setpriority(os.PRIO_PROCESS, 0, nice)
+                except OSError:
+                    # Only privileged users can lower the niceness
+                    pass
+
+        return apply_limits
+
+    def create_cgroup(self, name: str) -> Optional[Path]:
+        if self.cgroup is None:
+            return None
+        if not os.access(self.cgroup, os.W_OK):
+            logger.warning(f"The cgroup {self.cgroup} is not writable, only the rlimits are applied")
+            return None
+        if self.memory is not None and not self.enable_memory_controller():
+            return None
+        cgroup_path = self.cgroup / name
+        try:
+            cgroup_path.mkdir(exist_ok=True)
+            if self.memory is not None:
+                (cgroup_path / "memory.max").write_text(str(self.memory))
+                (cgroup_path / "memory.oom.group").write_text("1")
+        except OSError as e:
+            logger.warning(f"Could not set up the cgroup {cgroup_path}: {e}")
+            self.remove_cgroup(cgroup_path)
+            return None
+        return cgroup_path
+
+    def enable_memory_controller(self) -> bool:
+        """
+        The memory files of the run sub-groups only exist when the memory
+        controller is enabled in the subtree of the parent group
+        """
+        if self.memory_controller is None:
+            subtree_control = self.cgroup / "cgroup.subtree_control"
+            try:
+                if "memory" not in subtree_control.read_text().split():
+                    subtree_control.write_text("+memory")
+                self.memory_controller = True
+            except OSError as e:
+                # e.g. not delegated, or the parent group has processes of its own
+                logger.warning(
+                    f"Could not enable the memory controller of the cgroup {self.cgroup}, "
+                    f"the memory limit only applies to each process: {e}"
+                )
+                self.memory_controller = False
+        return self.memory_controller
+
+    @staticmethod
+    def remove_cgroup(cgroup_path: Optional[Path]):
+        if cgroup_path is None:
+            return
+        try:
+            cgroup_path.rmdir()
+        except OSError as e:
+            logger.debug(f"Could not remove the cgroup {cgroup_path}", exc_info=e)
+
+    def breaches(self, returncode: Optional[int], cgroup_path: Optional[Path] = None) -> List[str]:
+        """
+        Limits the run hit, as far as they can be told apart from its exit.
+        A memory rlimit makes allocations fail, which executors report as any
+        other error, so it can only be detected through the cgroup.
+        """
+        breaches = []
+        sigxcpu = getattr(signal, "SIGXCPU", None)
+        if self.cpu_time is not None and sigxcpu is not None and returncode in (-sigxcpu, SIGNAL_EXIT_BASE + sigxcpu):
+            breaches.append("cpu_time")
+        if cgroup_path is not None and self.memory is not None:
+            try:
+                events = (cgroup_path / "memory.events").read_text().split("\n")
+            except OSError:
+                events = []
+            counters = dict(line.split() for line in events if line.strip())
+            if int(counters.get("oom_kill", 0)) > 0:
+                breaches.append("memory")
+        return breaches
@@ -1,11 +1,12 @@
 import asyncio
 import os
+import shlex
+import shutil
 from pathlib import Path
 from typing import Union
 
 import faraday_agent_dispatcher.logger as logging
-from faraday_agent_parameters_types.utils import get_manifests
-from faraday_agent_dispatcher import __version__ as current_version
+from faraday_agent_dispatcher.config import manifest_registry
 
 logger = logging.get_logger()
 
@@ -35,7 +36,7 @@ def executor_folder() -> Union[Path, str]:
 
 
 def executor_metadata(executor_name: str) -> dict:
-    return get_manifests(current_version).get(executor_name)
+    return manifest_registry.get(executor_name)
 
 
 def check_metadata(metadata) -> bool:
@@ -46,30 +47,40 @@ def full_check_metadata(metadata) -> bool:
     return all(k in metadata for k in INFO_METADATA_KEYS) and check_metadata(metadata)
 
 
+def check_commands_fingerprint(metadata: dict) -> tuple:
+    """PATH and the modification time of the programs the dependency checks run"""
+    path = os.environ.get("PATH", "")
+    programs = []
+    for check_cmd in metadata["check_cmds"]:
+        try:
+            program = shlex.split(check_cmd)[0]
+        except (ValueError, IndexError):
+            continue
+        binary = shutil.which(program, path=path)
+        try:
+            mtime = os.stat(binary).st_mtime_ns if binary else None
+        except OSError:
+            mtime = None
+        programs.append((program, binary, mtime))
+    return path, tuple(programs)
+
+
 async def check_commands(metadata: dict) -> bool:
     async def run_check_command(cmd: str) -> int:
         proc = await asyncio.create_subprocess_shell(
             cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
         )
-        while True:
-            stdout, stderr = await proc.communicate()
-            if len(stdout) > 0:
-                logger.debug(f"Dependency check {cmd} prints: {stdout.decode()}")
-            if len(stderr) > 0:
-                logger.error(f"Dependency check {cmd} prints to " f"error: {stderr.decode()}")
-            if len(stdout) == 0 and len(stderr) == 0:
-                break
-
+        stdout, stderr = await proc.communicate()
+        if len(stdout) > 0:
+            logger.debug(f"Dependency check {cmd} prints: {stdout.decode()}")
+        if len(stderr) > 0:
+            logger.error(f"Dependency check {cmd} prints to " f"error: {stderr.decode()}")
         return proc.returncode
 
-    for check_cmd in metadata["check_cmds"]:
-        response = await run_check_command(check_cmd)
-        if response != 0:
-            return False
+    check_coros = [run_check_command(cmd) for cmd in metadata["check_cmds"]]
+    responses = await asyncio.gather(*check_coros)
+    if any(response != 0 for response in responses):
+        return False
 
     logger.info("Dependency check ended. Ready to go")
     return True
-    # Async check if needed
-    # check_coros = [run_check_command(cmd) for cmd in metadata["check_cmds"]]
-    # responses = await asyncio.gather(*check_coros)
-    # return all(response == 0 for response in responses)
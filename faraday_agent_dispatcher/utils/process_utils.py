@@ -0,0 +1,47 @@
+import asyncio
+import os
+import signal
+from asyncio.subprocess import Process
+
+import faraday_agent_dispatcher.logger as logging
+
+logger = logging.get_logger()
+
+# Seconds between the SIGTERM and the SIGKILL of the process group
+TERMINATE_GRACE = 10
+
+
+def process_group_kwargs() -> dict:
+    # A new session makes the shell the leader of its own process group, so
+    # the executor and every child it spawns can be signaled together
+    return {"start_new_session": True} if os.name == "posix" else {}
+
+
+def signal_process_group(process: Process, signal_number: int):
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal_number)
+        elif signal_number == signal.SIGTERM:
+            process.terminate()
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def terminate_process_group(process: Process, grace: float = TERMINATE_GRACE) -> bool:
+    """
+    Sends SIGTERM to the process group and SIGKILL if the process is still
+    alive after `grace` seconds. Returns if the group had to be killed.
+    """
+    if process.returncode is not None:
+        return False
+    signal_process_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+        return False
+    except asyncio.TimeoutError:
+        logger.warning(f"Process {process.pid} did not terminate after {grace} seconds, killing it")
+        signal_process_group(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+        await process.wait()
+        return True
@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket to pace events without blocking the event loop.
+    A rate lower or equal than 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.__lock = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        if not self.enabled:
+            return True
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        if not self.enabled:
+            return
+        if self.__lock is None:
+            # Created lazily, so the limiter can be built outside the loop
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
@@ -0,0 +1,155 @@
+import asyncio
+import random
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import ClientResponse
+from aiohttp.client_exceptions import ClientConnectorError, ClientResponseError, ClientSSLError
+
+import faraday_agent_dispatcher.logger as logging
+
+logger = logging.get_logger()
+
+# Server answers that mean "try again later", shared by the retries and the
+# spool. A 500 is usually caused by the request itself, retrying it or keeping
+# it in the spool would not help.
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class RetryStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.exhausted = 0
+        self.by_reason = Counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "exhausted": self.exhausted,
+            "by_reason": dict(self.by_reason),
+        }
+
+
+class RetryBudget:
+    """Amount of retries a run can spend, shared by all its requests"""
+
+    def __init__(self, max_retries: int):
+        self.remaining = max_retries
+
+    def consume(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 30,
+        max_retry_after: float = 300,
+        statuses=RETRY_STATUSES,
+    ):
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.statuses = statuses
+
+    @classmethod
+    def from_config(cls, server_config: dict) -> "RetryPolicy":
+        return cls(
+            max_attempts=int(server_config.get("retry_max_attempts", 4)),
+            base_delay=float(server_config.get("retry_base_delay", 0.5)),
+            max_delay=float(server_config.get("retry_max_delay", 30)),
+        )
+
+    def next_delay(self, previous: float) -> float:
+        # Decorrelated jitter, see https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+        return min(self.max_delay, random.uniform(self.base_delay, max(previous, self.base_delay) * 3))
+
+
+def retry_after(headers) -> Optional[float]:
+    value = headers.get("Retry-After") if headers else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def is_connection_error(error: Exception) -> bool:
+    # SSL errors will not be solved by retrying
+    return isinstance(error, ClientConnectorError) and not isinstance(error, ClientSSLError)
+
+
+async def request_with_retry(
+    request_f: Callable[[], Awaitable[ClientResponse]],
+    policy: RetryPolicy,
+    budget: RetryBudget = None,
+    stats: RetryStats = None,
+    description: str = "Request",
+    retry_connection_errors: bool = False,
+) -> ClientResponse:
+    """
+    Runs `request_f` until it gets a non retryable answer. Both sessions with
+    and without `raise_for_status` are supported: a retryable status is
+    either a response or a ClientResponseError. When the attempts or the
+    budget are exhausted, the last response is returned (or the last error
+    raised) as if there were no retries at all.
+    """
+    delay = policy.base_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        if stats is not None:
+            stats.requests += 1
+        try:
+            response = await request_f()
+        except ClientResponseError as e:
+            if e.status not in policy.statuses:
+                raise
+            reason, wait, error, response = str(e.status), retry_after(e.headers), e, None
+        except ClientConnectorError as e:
+            if not retry_connection_errors or not is_connection_error(e):
+                raise
+            reason, wait, error, response = "connection", None, e, None
+        else:
+            if response.status not in policy.statuses:
+                return response
+            reason, wait, error = str(response.status), retry_after(response.headers), None
+
+        if attempt >= policy.max_attempts or (budget is not None and not budget.consume()):
+            if stats is not None:
+                stats.exhausted += 1
+            logger.warning(f"{description} failed ({reason}) after {attempt} attempt(s), giving up")
+            if error is not None:
+                raise error
+            return response
+
+        if response is not None:
+            response.release()
+        delay = policy.next_delay(delay)
+        if wait is None:
+            wait = delay
+        else:
+            wait = min(wait, policy.max_retry_after)
+        if stats is not None:
+            stats.retries += 1
+            stats.by_reason[reason] += 1
+        logger.warning(f"{description} failed ({reason}), retrying in {wait:.2f} seconds")
+        await asyncio.sleep(wait)
@@ -0,0 +1,171 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+from marshmallow import INCLUDE, fields, schema, validate
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.utils import json_utils
+
+logger = logging.get_logger()
+
+QUARANTINE_MAX_SIZE = 64 * 1024 * 1024
+
+
+class VulnerabilitySchema(schema.Schema):
+    class Meta:
+        unknown = INCLUDE
+
+    name = fields.String(required=True, validate=validate.Length(min=1))
+    desc = fields.String()
+    severity = fields.String()
+    type = fields.String(validate=validate.OneOf(["Vulnerability", "VulnerabilityWeb"]))
+    refs = fields.List(fields.Raw())
+    policyviolations = fields.List(fields.String())
+
+
+class CredentialSchema(schema.Schema):
+    class Meta:
+        unknown = INCLUDE
+
+    name = fields.String()
+    username = fields.String()
+    password = fields.String()
+
+
+class ServiceSchema(schema.Schema):
+    """The service fields, its vulnerabilities are checked one by one"""
+
+    class Meta:
+        unknown = INCLUDE
+
+    name = fields.String()
+    port = fields.Integer(required=True, validate=validate.Range(min=0, max=65535))
+    protocol = fields.String(required=True, validate=validate.Length(min=1))
+    status = fields.String(validate=validate.OneOf(["open", "closed", "filtered"]))
+    version = fields.String(allow_none=True)
+    description = fields.String(allow_none=True)
+    vulnerabilities = fields.List(fields.Raw())
+
+
+class HostSchema(schema.Schema):
+    """The host fields, its services, vulnerabilities and credentials are checked one by one"""
+
+    class Meta:
+        unknown = INCLUDE
+
+    ip = fields.String(required=True, validate=validate.Length(min=1))
+    description = fields.String(allow_none=True)
+    hostnames = fields.List(fields.String())
+    os = fields.String(allow_none=True)
+    mac = fields.String(allow_none=True)
+    services = fields.List(fields.Raw())
+    vulnerabilities = fields.List(fields.Raw())
+    credentials = fields.List(fields.Raw())
+
+
+@lru_cache(maxsize=None)
+def get_schema(kind: str) -> schema.Schema:
+    # Building a schema is expensive, each one is built once and reused
+    return {
+        "hosts": HostSchema,
+        "services": ServiceSchema,
+        "vulnerabilities": VulnerabilitySchema,
+        "credentials": CredentialSchema,
+    }[kind]()
+
+
+class ResultValidator:
+    """
+    Validates the executor results against the bulk_create schema before
+    they are uploaded. Invalid hosts, services, vulnerabilities or credentials
+    are dropped (and written to the quarantine file, if any), so the rest of
+    the result still reaches the server. Counters are kept per run.
+    """
+
+    KINDS = ("hosts", "services", "vulnerabilities", "credentials")
+
+    def __init__(self, executor: str, quarantine_path: Optional[Path] = None):
+        self.executor = executor
+        self.quarantine_path = quarantine_path
+        self.checked = Counter()
+        self.invalid = Counter()
+
+    def errors(self, kind: str, record) -> Optional[dict]:
+        self.checked[kind] += 1
+        if not isinstance(record, dict):
+            return {"_schema": ["Must be an object"]}
+        return get_schema(kind).validate(record) or None
+
+    def clean_records(self, kind: str, records, parent: Optional[dict] = None) -> List[dict]:
+        valid = []
+        for record in records or []:
+            errors = self.errors(kind, record)
+            if errors is None:
+                valid.append(self.clean_nested(kind, record))
+            else:
+                self.reject(kind, record, errors, parent)
+        return valid
+
+    def clean_nested(self, kind: str, record: dict) -> dict:
+        if kind == "hosts":
+            nested = ("services", "vulnerabilities", "credentials")
+        elif kind == "services":
+            nested = ("vulnerabilities",)
+        else:
+            return record
+        cleaned = dict(record)
+        for nested_kind in nested:
+            if nested_kind in record:
+                cleaned[nested_kind] = self.clean_records(nested_kind, record[nested_kind], record)
+        return cleaned
+
+    def clean(self, payload: dict) -> Optional[dict]:
+        """The payload without its invalid records, None if no host is left"""
+        if not isinstance(payload.get("hosts"), list):
+            return payload
+        hosts = self.clean_records("hosts", payload["hosts"])
+        if payload["hosts"] and not hosts:
+            return None
+        return {**payload, "hosts": hosts}
+
+    def reject(self, kind: str, record, errors: dict, parent: Optional[dict]):
+        self.invalid[kind] += 1
+        location = f" of host {parent.get('ip')}" if isinstance(parent, dict) and "ip" in parent else ""
+        logger.warning(f"Invalid {kind[:-1]}{location} from executor {self.executor} dropped: {errors}")
+        if self.quarantine_path is not None:
+            self.quarantine(kind, record, errors)
+
+    def quarantine(self, kind: str, record, errors: dict):
+        line = json_utils.dumps_bytes(
+            {"time": time.time(), "executor": self.executor, "kind": kind, "errors": errors, "record": record}
+        )
+        try:
+            self.quarantine_path.parent.mkdir(parents=True, exist_ok=True)
+            if self.quarantine_path.exists() and self.quarantine_path.stat().st_size > QUARANTINE_MAX_SIZE:
+                logger.warning(f"Quarantine file {self.quarantine_path} is full, not saving the invalid record")
+                return
+            with self.quarantine_path.open("ab") as quarantine_file:
+                quarantine_file.write(line + b"\n")
+        except OSError as e:
+            logger.error(f"Could not quarantine the invalid record: {e}")
+
+    def summary(self) -> dict:
+        return {kind: {"checked": self.checked[kind], "invalid": self.invalid[kind]} for kind in self.KINDS}
@@ -62,6 +62,7 @@ extra_req = {
         "mkdocs",
         "mkdocs-material",
     ],
+    "speedups": ["orjson"],
 }
 
 setup(
@@ -0,0 +1,79 @@
+"""
+Microbenchmark of the dispatcher JSON codec against the stdlib json module,
+on a synthetic report (50 MB by default). As in real reports, the fields an
+executor does not know are null.
+
+    python -m tests.benchmarks.json_codec [--size-mb 50] [--rounds 3]
+"""
+
+import argparse
+import gc
+import json
+import time
+
+from faraday_agent_dispatcher.utils import json_utils
+from tests.data.basic_executor import host_data, vuln_data
+
+
+def synthetic_report(size_mb: int) -> dict:
+    hosts = []
+    host_size = 0
+    index = 0
+    while not host_size or len(hosts) * host_size < size_mb * 1024 * 1024:
+        host = dict(host_data, ip=f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}", os=None, mac=None)
+        host["vulnerabilities"] = [
+            dict(
+                vuln_data,
+                name=f"{vuln_data['name']} {index}-{vuln}",
+                desc=vuln_data["desc"] * 20,
+                resolution=None,
+                data=None,
+            )
+            for vuln in range(10)
+        ]
+        hosts.append(host)
+        if not host_size:
+            host_size = len(json.dumps(host))
+        index += 1
+    return {"hosts": hosts}
+
+
+def best_of(rounds: int, function, *args) -> float:
+    times = []
+    for _ in range(rounds):
+        # As timeit, keep the garbage collector out of the measure
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function(*args)
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    report = synthetic_report(args.size_mb)
+    line = json.dumps(report)
+    print(f"Report: {len(report['hosts'])} hosts, {len(line) / 1024 / 1024:.1f} MB, codec: {json_utils.CODEC}")
+    cases = [
+        ("decode", json.loads, json_utils.loads, line),
+        ("encode", json.dumps, json_utils.dumps, report),
+    ]
+    for name, stdlib_f, codec_f, data in cases:
+        stdlib_time = best_of(args.rounds, stdlib_f, data)
+        codec_time = best_of(args.rounds, codec_f, data)
+        print(
+            f"{name}: stdlib {stdlib_time:.3f}s, {json_utils.CODEC} {codec_time:.3f}s, "
+            f"{stdlib_time / codec_time:.1f}x faster"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Startup benchmark of the faraday-dispatcher console script: the `-X importtime`
+cumulative time of importing it in a fresh interpreter, against its budget.
+
+    python -m tests.benchmarks.startup [--rounds 5]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict
+
+CLI_MODULE = "faraday_agent_dispatcher.cli.main"
+# Microseconds, most of it is click, yaml and marshmallow
+IMPORTTIME_BUDGET = 300 * 1000
+# Only the subcommands needing them import these
+LAZY_MODULES = {
+    "aiohttp",
+    "socketio",
+    "engineio",
+    "websockets",
+    "faraday_agent_parameters_types",
+    "faraday_agent_dispatcher.dispatcher_io",
+    "faraday_agent_dispatcher.cli.wizard",
+}
+
+
+def import_profile(module: str = CLI_MODULE, env: dict = None) -> Dict[str, int]:
+    """Cumulative import time in microseconds of each module imported"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env={**os.environ, **(env or {})},
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    profile = {}
+    for line in process.stderr.decode().splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            profile[name.strip()] = int(cumulative)
+    return profile
+
+
+def eager_modules(profile: Dict[str, int]) -> list:
+    return sorted(name for name in profile if name in LAZY_MODULES or name.split(".")[0] in LAZY_MODULES)
+
+
+def best_profile(rounds: int, env: dict = None) -> Dict[str, int]:
+    return min((import_profile(env=env) for _ in range(rounds)), key=lambda profile: profile[CLI_MODULE])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    profile = best_profile(args.rounds)
+    print(f"{CLI_MODULE}: {profile[CLI_MODULE] / 1000:.1f}ms, budget {IMPORTTIME_BUDGET / 1000:.0f}ms")
+    slowest = sorted((time, name) for name, time in profile.items() if name != CLI_MODULE)[-10:]
+    for time, name in reversed(slowest):
+        print(f"    {name}: {time / 1000:.1f}ms")
+    eager = eager_modules(profile)
+    if eager:
+        print(f"Imported eagerly: {', '.join(eager)}")
+
+
+if __name__ == "__main__":
+    main()
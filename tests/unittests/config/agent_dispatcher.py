@@ -561,6 +561,47 @@ def generate_executor_options():
                 },
             ],
         },
+        {
+            "id_str": "OK (N json in N lines, batched)",
+            "data": {
+                "action": "RUN",
+                "agent_id": 1,
+                "executor": "ex1",
+                "execution_ids": [1],
+                "workspaces": ["{}"],
+                "args": {"out": "json", "count": "5", "spare": "T"},
+            },
+            "executor_config": {"batch_lines": "5"},
+            "logs": [
+                {"levelname": "INFO", "msg": "Running ex1 executor"},
+                {
+                    "levelname": "INFO",
+                    "msg": "Data sent to bulk create",
+                    "min_count": 1,
+                    "max_count": 1,
+                },
+                {
+                    "levelname": "INFO",
+                    "msg": "Executor ex1 finished successfully",
+                },
+            ],
+            "ws_responses": [
+                {
+                    "action": "RUN_STATUS",
+                    "executor_name": "ex1",
+                    "execution_ids": [1],
+                    "running": True,
+                    "message": "Running ex1 executor from unnamed_agent agent",
+                },
+                {
+                    "action": "RUN_STATUS",
+                    "executor_name": "ex1",
+                    "execution_ids": [1],
+                    "successful": True,
+                    "message": "Executor ex1 from unnamed_agent " "finished successfully",
+                },
+            ],
+        },
         {
             "id_str": "OK (\n before the data)",
             "data": {
@@ -1063,7 +1104,7 @@ def generate_executor_options():
             ],
         },
         {
-            "id_str": "Bad configuration over data size",
+            "id_str": "Lines bigger than max_size",
             "data": {
                 "action": "RUN",
                 "agent_id": 1,
@@ -1077,12 +1118,13 @@ def generate_executor_options():
                 {
                     "levelname": "INFO",
                     "msg": "Data sent to bulk create",
-                    "min_count": 0,
-                    "max_count": 0,
+                    "min_count": 1,
                 },
                 {
                     "levelname": "ERROR",
-                    "msg": "ValueError raised processing stdout, " "try with bigger limiting size in config",
+                    "msg": "ValueError raised processing stdout",
+                    "min_count": 0,
+                    "max_count": 0,
                 },
                 {
                     "levelname": "INFO",
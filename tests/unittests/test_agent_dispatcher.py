@@ -229,6 +229,9 @@ async def test_run_once(
 
     configuration[Sections.SERVER]["api_port"] = str(test_config.client.port)
     configuration[Sections.SERVER]["websocket_port"] = str(test_config.client.port)
+    # Keep the retries of the error workspaces fast
+    configuration[Sections.SERVER]["retry_base_delay"] = "0.01"
+    configuration[Sections.SERVER]["retry_max_delay"] = "0.05"
     if Sections.TOKENS not in configuration:
         configuration[Sections.TOKENS] = {}
     configuration[Sections.TOKENS]["agent"] = test_config.agent_token
@@ -279,6 +282,8 @@ async def test_run_once(
 
         max_size = str(64 * 1024) if "max_size" not in executor_options else executor_options["max_size"]
         configuration[Sections.AGENT][Sections.EXECUTORS][ex]["max_size"] = max_size
+        for option, value in executor_options.get("executor_config", {}).items():
+            configuration[Sections.AGENT][Sections.EXECUTORS][ex][option] = value
         executor_metadata = {
             "executor_name": ex,
             "args": {
@@ -0,0 +1,84 @@
+import hashlib
+
+from faraday_agent_dispatcher.delta import DeltaFilter, FingerprintStore
+from faraday_agent_dispatcher.host_merge import record_digest
+
+
+def scan_result(severity="high"):
+    service = {"name": "http", "port": 80, "protocol": "tcp", "vulnerabilities": [{"name": "xss", "severity": "low"}]}
+    return {
+        "hosts": [
+            {
+                "ip": "10.0.0.1",
+                "hostnames": ["a.com"],
+                "services": [service],
+                "vulnerabilities": [{"name": "sqli", "severity": severity}, {"name": "ssl", "severity": "info"}],
+            },
+            {
+                "ip": "10.0.0.2",
+                "vulnerabilities": [{"name": "weak ssh", "severity": "medium"}],
+                "credentials": [{"name": "ssh", "username": "root", "password": "toor"}],
+            },
+        ]
+    }
+
+
+def send(delta: DeltaFilter, workspace: str, payload: dict):
+    delta_payload, digests = delta.filter(workspace, payload, delta.fingerprints(payload))
+    delta.commit(workspace, digests)
+    return delta_payload
+
+
+def test_only_new_or_changed_records_are_sent(tmp_path):
+    store = FingerprintStore(tmp_path / "delta.sqlite")
+    first_run = DeltaFilter(store, "ex1", ["ws1"])
+    assert send(first_run, "ws1", scan_result()) == scan_result()
+    assert first_run.summary() == {"ws1": {"full_resync": True, **dict.fromkeys(DeltaFilter.SKIPPED_KINDS, 0)}}
+    first_run.finish()
+
+    second_run = DeltaFilter(store, "ex1", ["ws1", "ws2"])
+    assert send(second_run, "ws1", scan_result()) is None
+    assert send(second_run, "ws1", scan_result(severity="critical")) == {
+        "hosts": [
+            {"ip": "10.0.0.1", "hostnames": ["a.com"], "vulnerabilities": [{"name": "sqli", "severity": "critical"}]}
+        ]
+    }
+    # Other workspaces keep their own fingerprints
+    assert send(second_run, "ws2", scan_result()) == scan_result()
+    assert second_run.summary()["ws1"] == {
+        "full_resync": False,
+        "hosts": 3,
+        "services": 2,
+        "vulnerabilities": 5,
+        "service_vulnerabilities": 2,
+        "credentials": 2,
+    }
+    assert second_run.summary()["ws2"]["full_resync"]
+    assert send(second_run, "ws1", {"hosts": []}) == {"hosts": []}
+
+    resync_run = DeltaFilter(store, "ex1", ["ws1"], full_resync=True)
+    assert send(resync_run, "ws1", scan_result()) == scan_result()
+    store.close()
+
+
+def test_failed_full_sync_is_retried(tmp_path):
+    store = FingerprintStore(tmp_path / "delta.sqlite")
+    failed_run = DeltaFilter(store, "ex1", ["ws1"])
+    send(failed_run, "ws1", scan_result())
+    failed_run.fail("ws1")
+    failed_run.finish()
+    assert store.last_full_sync("ws1", "ex1") is None
+
+    run = DeltaFilter(store, "ex1", ["ws1"])
+    assert run.full_resync["ws1"]
+    assert send(run, "ws1", scan_result()) == scan_result()
+    run.finish()
+    assert store.last_full_sync("ws1", "ex1") is not None
+    assert len(store.load("ws1", "ex1")) == 8
+    store.close()
+
+
+def test_record_digest_is_canonical():
+    assert record_digest({"name": "xss", "severity": "low"}) == record_digest({"severity": "low", "name": "xss"})
+    # The same bytes whatever JSON codec is installed
+    assert record_digest({"name": "xss"}) == hashlib.blake2b(b'{"name":"xss"}', digest_size=16).digest()
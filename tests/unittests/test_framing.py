@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from faraday_agent_dispatcher.framing import FrameReader
+
+
+def stream_of(*chunks: bytes) -> asyncio.StreamReader:
+    stream = asyncio.StreamReader()
+    for chunk in chunks:
+        stream.feed_data(chunk)
+    stream.feed_eof()
+    return stream
+
+
+async def frames(reader: FrameReader) -> list:
+    result = []
+    while (frame := await reader.next_frame()) is not None:
+        result.append(frame)
+    return result
+
+
+@pytest.mark.asyncio
+async def test_ndjson_frames_bigger_than_the_chunk_size():
+    big = '{"hosts": ["' + "a" * 10000 + '"]}'
+    reader = FrameReader(stream_of(big.encode()[:5000], big.encode()[5000:] + b"\n{}\n", b"{}"), chunk_size=1024)
+    assert await frames(reader) == [big, "{}", "{}"]
+
+
+@pytest.mark.asyncio
+async def test_invalid_and_split_utf8_does_not_break_the_stream():
+    text = "ñandú".encode()
+    reader = FrameReader(stream_of(text[:1], text[1:] + b"\xff\n", b"ok\n"), chunk_size=2)
+    assert await frames(reader) == ["ñandú�", "ok"]
+
+
+@pytest.mark.asyncio
+async def test_length_prefixed_frames():
+    payload = '{"hosts": []}\n{"multi": "line"}'
+    data = f"{len(payload.encode())}\n{payload}\n\n4\nñ{{}}".encode()
+    reader = FrameReader(stream_of(data, b'{"plain": 1}\n'), framing="length", chunk_size=3)
+    assert await frames(reader) == [payload, "ñ{}", '{"plain": 1}']
+
+
+@pytest.mark.asyncio
+async def test_chunked_frames():
+    data = b'5\n{"hos\n8\nts": []}\n0\n\nb\n{"a": 1234}\n0\n'
+    reader = FrameReader(stream_of(data), framing="chunked")
+    assert await frames(reader) == ['{"hosts": []}', '{"a": 1234}']
+
+    reader = FrameReader(stream_of(b"5\n{}"), framing="chunked")
+    assert await frames(reader) == []
+
+
+@pytest.mark.asyncio
+async def test_utf8_split_between_chunks_of_a_frame():
+    text = "ñandú".encode()
+    data = b"%x\n%s\n%x\n%s\n0\n" % (1, text[:1], len(text) - 1, text[1:])
+    reader = FrameReader(stream_of(data), framing="chunked", chunk_size=2)
+    assert await frames(reader) == ["ñandú"]
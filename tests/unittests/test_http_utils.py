@@ -0,0 +1,30 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from faraday_agent_dispatcher.utils.http_utils import HttpPool
+
+
+@pytest.mark.asyncio
+async def test_sessions_share_the_pool_connections():
+    async def handler(_):
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    server = TestServer(app)
+    await server.start_server()
+    pool = HttpPool.from_config({"http_pool_limit_per_host": "2"})
+    rest_session = pool.session(raise_for_status=True)
+    socketio_session = pool.session()
+    try:
+        for session in (rest_session, socketio_session, rest_session):
+            async with session.get(server.make_url("/")) as response:
+                assert await response.json() == {"ok": True}
+        assert pool.stats.as_dict()["requests"] == 3
+        assert pool.stats.as_dict()["connections_created"] == 1
+        assert pool.stats.as_dict()["connections_reused"] == 2
+    finally:
+        await pool.close()
+        await server.close()
+    assert rest_session.closed and socketio_session.closed and pool.connector.closed
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from faraday_agent_dispatcher.utils import json_utils
+
+
+@pytest.mark.parametrize("data", ['{"hosts": []} {}', "", "[1, 2"])
+def test_decode_errors_are_the_stdlib_ones(data):
+    with pytest.raises(json.JSONDecodeError) as codec_error:
+        json_utils.loads(data)
+    with pytest.raises(json.JSONDecodeError) as stdlib_error:
+        json.loads(data)
+    assert str(codec_error.value) == str(stdlib_error.value)
+
+
+def test_values_unsupported_by_fast_codecs():
+    big = 2**70
+    assert json_utils.loads(json.dumps({"big": big})) == {"big": big}
+    assert json_utils.loads(json.dumps({"big": big}).encode()) == {"big": big}
+    assert json.loads(json_utils.dumps({"big": big, 1: "one"})) == {"big": big, "1": "one"}
+    assert json_utils.loads(json_utils.dumps_bytes({"ñ": [1.5, None, True]})) == {"ñ": [1.5, None, True]}
+
+
+def test_non_finite_floats():
+    data = {"hosts": [{"ip": "10.0.0.1", "os": None, "cvss": float("nan")}], "score": float("inf")}
+    if json_utils.CODEC in ("orjson", "msgspec"):
+        # Written as null by these codecs instead of the NaN and Infinity tokens
+        expected = {"hosts": [{"ip": "10.0.0.1", "os": None, "cvss": None}], "score": None}
+        assert json.loads(json_utils.dumps(data)) == expected
+        assert json.loads(json_utils.dumps_bytes(data)) == expected
+    else:
+        assert json_utils.dumps(data) == json.dumps(data)
+        assert json_utils.dumps_bytes(data) == json.dumps(data).encode()
@@ -0,0 +1,57 @@
+import asyncio
+import os
+
+import pytest
+
+from faraday_agent_dispatcher.utils.control_values_utils import LimitsSchema, control_limits
+from faraday_agent_dispatcher.utils.limits_utils import ResourceLimits
+from faraday_agent_dispatcher.utils.process_utils import process_group_kwargs
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="Resource limits are POSIX only")
+
+
+@pytest.mark.asyncio
+async def test_resource_limits_are_applied():
+    limits = ResourceLimits(nofile=32, nice=5)
+    process = await asyncio.create_subprocess_shell(
+        "ulimit -n; nice", stdout=asyncio.subprocess.PIPE, preexec_fn=limits.preexec_fn()
+    )
+    stdout, _ = await process.communicate()
+    nofile, niceness = stdout.decode().split()
+    assert nofile == "32"
+    assert int(niceness) == max(5, os.getpriority(os.PRIO_PROCESS, 0))
+
+
+@pytest.mark.asyncio
+async def test_cpu_time_breach_is_reported():
+    limits = ResourceLimits(cpu_time=1)
+    process = await asyncio.create_subprocess_shell(
+        "exec python -c 'while True: pass'", preexec_fn=limits.preexec_fn(), **process_group_kwargs()
+    )
+    await asyncio.wait_for(process.wait(), 10)
+    assert limits.breaches(process.returncode) == ["cpu_time"]
+    assert ResourceLimits().breaches(process.returncode) == []
+
+
+def test_limits_config_validation():
+    assert ResourceLimits(**LimitsSchema().load({"memory": "1048576", "nice": 10})).memory == 1048576
+    with pytest.raises(ValueError):
+        control_limits("limits", {"nice": 40})
+    with pytest.raises(ValueError):
+        control_limits("limits", {"unknown": 1})
+
+
+def test_memory_controller_is_enabled_for_the_run_cgroups(tmp_path):
+    (tmp_path / "cgroup.subtree_control").write_text("cpu io\n")
+    limits = ResourceLimits(memory=1024 * 1024, cgroup=str(tmp_path))
+    cgroup_path = limits.create_cgroup("run-1")
+    assert (tmp_path / "cgroup.subtree_control").read_text() == "+memory"
+    assert (cgroup_path / "memory.max").read_text() == str(1024 * 1024)
+    limits.remove_cgroup(cgroup_path)
+
+
+def test_cgroup_is_skipped_without_memory_controller(tmp_path):
+    # No cgroup.subtree_control, e.g. not a cgroup v2 group
+    limits = ResourceLimits(memory=1024 * 1024, cgroup=str(tmp_path))
+    assert limits.create_cgroup("run-1") is None
+    assert not (tmp_path / "run-1").exists()
@@ -0,0 +1,72 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import faraday_agent_parameters_types.utils as parameters_utils
+
+import faraday_agent_dispatcher.config as config
+import faraday_agent_dispatcher.executor as executor_module
+from faraday_agent_dispatcher.config import manifest_registry
+from faraday_agent_dispatcher.dispatcher_io import DispatcherNamespace
+from faraday_agent_dispatcher.executor import Executor
+
+
+def test_manifests_load_once_until_invalidated(monkeypatch):
+    loads = []
+    get_manifests = parameters_utils.get_manifests
+
+    def counted_get_manifests(version=None):
+        loads.append(version)
+        return get_manifests(version)
+
+    counted_get_manifests.cache_clear = get_manifests.cache_clear
+    monkeypatch.setattr(parameters_utils, "get_manifests", counted_get_manifests)
+    manifest_registry.invalidate()
+
+    nmap = manifest_registry.get("nmap")
+    assert manifest_registry.get("nmap") is nmap
+    assert manifest_registry.get("unknown") is None
+    assert loads == [config.current_version]
+
+    executor = SimpleNamespace(name="ex1", params={}, repo_name="nmap")
+    namespace = DispatcherNamespace(dispatcher=SimpleNamespace(executors={"ex1": executor}))
+    executors = namespace.join_executors()
+    assert executors[0]["tool"] == "nmap" and executors[0]["category"]
+    assert namespace.join_executors() is executors
+
+    manifest_registry.invalidate()
+    assert namespace.join_executors() is not executors
+    assert loads == [config.current_version] * 2
+
+
+@pytest.mark.asyncio
+async def test_check_cmds_results_are_cached(monkeypatch, tmp_path):
+    checks = []
+    program = tmp_path / "nmap"
+    program.write_text("#!/bin/sh\nexit 0\n")
+    program.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path))
+
+    async def check_commands(metadata):
+        checks.append(metadata["check_cmds"])
+        return len(checks) > 1
+
+    monkeypatch.setattr(executor_module, "check_commands", check_commands)
+    executor = Executor("ex1", {"repo_executor": "nmap.py"})
+    # Failures are not cached
+    assert not await executor.check_cmds()
+    assert await executor.check_cmds()
+    assert await executor.check_cmds()
+    assert len(checks) == 2
+
+    os.utime(program, ns=(0, 0))
+    assert await executor.check_cmds()
+    assert len(checks) == 3
+    monkeypatch.setenv("PATH", f"{tmp_path}:/bin")
+    assert await executor.check_cmds()
+    assert len(checks) == 4
+
+    executor.check_cmds_ttl = 0
+    assert await executor.check_cmds()
+    assert len(checks) == 5
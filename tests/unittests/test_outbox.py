@@ -0,0 +1,36 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+import socketio
+
+from faraday_agent_dispatcher.dispatcher_io import DispatcherNamespace
+from faraday_agent_dispatcher.outbox import Outbox
+from faraday_agent_dispatcher.run_context import RunContext
+
+
+@pytest.mark.asyncio
+async def test_statuses_are_buffered_while_disconnected():
+    emitted = []
+    connected = False
+    dispatcher = SimpleNamespace(websocket_token="token", executors={}, outbox=Outbox(max_size=2))
+    namespace = DispatcherNamespace(dispatcher=dispatcher)
+
+    async def emit(event, data):
+        if not connected:
+            raise socketio.exceptions.BadNamespaceError("/dispatcher is not a connected namespace.")
+        emitted.append((event, data))
+
+    namespace.emit = emit
+    run = RunContext({"execution_ids": [1], "executor": "ex1"}, "agent")
+    for message in ("first", "second", "third"):
+        await namespace.emit_status(run, running=False, successful=True, message=message)
+    await namespace.emit_status(run, running=True, successful=None, message="progress", progress={"percent": 5})
+    # Bounded, the oldest is dropped and progress is not buffered
+    assert len(dispatcher.outbox) == 2 and dispatcher.outbox.dropped == 1
+
+    connected = True
+    await namespace.on_connect()
+    assert [event for event, _ in emitted] == ["join_agent", "run_status", "run_status"]
+    assert [json.loads(data)["message"] for _, data in emitted[1:]] == ["second", "third"]
+    assert len(dispatcher.outbox) == 0
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import subprocess
+
+import pytest
+
+from faraday_agent_dispatcher.utils.process_utils import process_group_kwargs, terminate_process_group
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="Process groups are POSIX only")
+
+
+async def spawn(command):
+    return await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE, **process_group_kwargs())
+
+
+def group_alive(pgid) -> bool:
+    # Orphaned children may stay as zombies until init reaps them
+    states = subprocess.run(["ps", "-o", "stat=", "-g", str(pgid)], capture_output=True, text=True).stdout.split()
+    return any(not state.startswith("Z") for state in states)
+
+
+@pytest.mark.asyncio
+async def test_terminate_process_group_ends_children():
+    process = await spawn("sleep 30 & sleep 30")
+    assert os.getpgid(process.pid) == process.pid
+    assert not await terminate_process_group(process, grace=5)
+    await asyncio.sleep(0.1)
+    assert not group_alive(process.pid)
+
+
+@pytest.mark.asyncio
+async def test_terminate_process_group_escalates_to_kill():
+    process = await spawn("trap '' TERM; echo ready; while true; do sleep 0.1; done")
+    await process.stdout.readline()
+    assert await terminate_process_group(process, grace=0.3)
+    assert process.returncode is not None
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from faraday_agent_dispatcher.progress import ProgressReporter, parse_progress
+
+
+def test_parse_progress():
+    assert parse_progress({"percent": 150, "phase": "scan", "eta": 30, "other": 1}) == {
+        "percent": 100,
+        "phase": "scan",
+        "eta": 30,
+    }
+    assert parse_progress({"percent": True, "phase": 3}) is None
+    assert parse_progress("50%") is None
+
+
+@pytest.mark.asyncio
+async def test_progress_is_coalesced_and_throttled():
+    sent = []
+
+    async def emit_f(progress):
+        sent.append(progress)
+
+    reporter = ProgressReporter(emit_f, interval=0.1)
+    for percent in range(10):
+        await reporter.update({"percent": percent})
+    # The first one is sent at once, the rest coalesced into the latest
+    assert sent == [{"percent": 0}]
+    await asyncio.sleep(0.15)
+    assert sent == [{"percent": 0}, {"percent": 9}]
+    assert reporter.received == 10
+
+    await reporter.update({"percent": 10})
+    reporter.close()
+    await asyncio.sleep(0.15)
+    assert len(sent) == 2
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from faraday_agent_dispatcher.result_channel import ResultChannel, ResultFile
+
+
+@pytest.mark.asyncio
+async def test_result_file_envelope_is_spliced(tmp_path):
+    envelope = {"execution_id": 1, "command": {"tool": "test"}}
+    result_path = tmp_path / "result.json"
+    result_path.write_text('  {"hosts": [{"ip": "127.0.0.1"}]}\n\n')
+    result_file = ResultFile(result_path).with_envelope(envelope)
+    body = b"".join([chunk async for chunk in result_file.chunks(chunk_size=4)])
+    assert json.loads(body) == {"hosts": [{"ip": "127.0.0.1"}], **envelope}
+    assert await result_file.read() == body
+
+    result_path.write_text("{ }")
+    assert json.loads(await ResultFile(result_path).with_envelope(envelope).read()) == envelope
+
+    for invalid in ('["hosts"]', '{"hosts": []', "   "):
+        result_path.write_text(invalid)
+        with pytest.raises(ValueError):
+            ResultFile(result_path)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Inherited fds are POSIX only")
+@pytest.mark.asyncio
+async def test_fd_result_channel():
+    channel = ResultChannel(ResultChannel.FD)
+    env = {**os.environ, **channel.prepare()}
+    process = await asyncio.create_subprocess_shell(
+        'echo log; python -c \'import os; os.write(int(os.environ["FARADAY_RESULT_FD"]), b"{}\\n")\'',
+        stdout=asyncio.subprocess.PIPE,
+        env=env,
+        pass_fds=channel.pass_fds,
+    )
+    channel.spawned()
+    stream = await channel.open_stream()
+    assert await stream.read() == b"{}\n"
+    assert (await process.communicate())[0] == b"log\n"
+    channel.close()
+
+
+def test_file_result_channel_cleanup():
+    channel = ResultChannel(ResultChannel.FILE)
+    path = channel.prepare()[ResultChannel.FILE_ENV]
+    assert channel.result_file() is None
+    channel.close()
+    assert not os.path.exists(path)
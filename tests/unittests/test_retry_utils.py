@@ -0,0 +1,96 @@
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from faraday_agent_dispatcher.utils.retry_utils import (
+    RetryBudget,
+    RetryPolicy,
+    RetryStats,
+    request_with_retry,
+    retry_after,
+)
+
+
+class FakeResponse:
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+def fake_requests(*responses):
+    responses = list(responses)
+
+    async def request_f():
+        return responses.pop(0)
+
+    return request_f
+
+
+def test_retry_after_parsing():
+    assert retry_after({}) is None
+    assert retry_after({"Retry-After": "3"}) == 3
+    assert retry_after({"Retry-After": "-1"}) == 0
+    assert retry_after({"Retry-After": "soon"}) is None
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 50 < retry_after({"Retry-After": date}) <= 60
+
+
+def test_decorrelated_jitter_bounds():
+    policy = RetryPolicy(base_delay=1, max_delay=10)
+    delay = policy.base_delay
+    for _ in range(100):
+        previous, delay = delay, policy.next_delay(delay)
+        assert 1 <= delay <= min(10, previous * 3)
+
+
+@pytest.mark.asyncio
+async def test_request_with_retry_honors_retry_after_and_stops_on_success(monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr("faraday_agent_dispatcher.utils.retry_utils.asyncio.sleep", fake_sleep)
+    stats = RetryStats()
+    first = FakeResponse(429, {"Retry-After": "7"})
+    response = await request_with_retry(
+        fake_requests(first, FakeResponse(503), FakeResponse(201)),
+        RetryPolicy(base_delay=0.01, max_delay=0.05),
+        stats=stats,
+    )
+    assert response.status == 201
+    assert first.released
+    assert sleeps[0] == 7 and 0.01 <= sleeps[1] <= 0.05
+    assert stats.as_dict() == {"requests": 3, "retries": 2, "exhausted": 0, "by_reason": {"429": 1, "503": 1}}
+
+
+@pytest.mark.asyncio
+async def test_request_with_retry_budget_and_attempts(monkeypatch):
+    async def fake_sleep(delay):
+        pass
+
+    monkeypatch.setattr("faraday_agent_dispatcher.utils.retry_utils.asyncio.sleep", fake_sleep)
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    stats = RetryStats()
+    response = await request_with_retry(fake_requests(*(FakeResponse(503) for _ in range(3))), policy, stats=stats)
+    assert response.status == 503 and stats.requests == 3
+    # Not retried, the request itself is wrong
+    response = await request_with_retry(fake_requests(FakeResponse(500)), policy)
+    assert response.status == 500
+
+    budget = RetryBudget(1)
+    stats = RetryStats()
+    for _ in range(2):
+        response = await request_with_retry(
+            fake_requests(*(FakeResponse(502) for _ in range(3))), policy, budget, stats
+        )
+        assert response.status == 502
+    assert stats.retries == 1 and stats.exhausted == 2 and stats.requests == 3
+
+    response = await request_with_retry(fake_requests(FakeResponse(404)), policy)
+    assert response.status == 404
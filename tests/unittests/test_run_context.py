@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from faraday_agent_dispatcher import dispatcher_io
+from faraday_agent_dispatcher.dispatcher_io import Dispatcher, DispatcherNamespace
+from faraday_agent_dispatcher.executor import Executor
+from faraday_agent_dispatcher.executor_helper import StdErrLineProcessor
+from faraday_agent_dispatcher.run_context import RunContext
+from faraday_agent_dispatcher.scheduler import RunScheduler
+from faraday_agent_dispatcher.utils.process_utils import terminate_process_group
+from tests.unittests.test_process_utils import group_alive
+from tests.utils.testing_faraday_server import tmp_default_config  # noqa: F401
+
+
+def run_data(execution_id, executor="ex1"):
+    return {
+        "execution_ids": [execution_id],
+        "workspaces": [f"ws{execution_id}"],
+        "executor": executor,
+        "args": {"out": "json"},
+    }
+
+
+def test_run_contexts_are_independent():
+    first = RunContext(run_data(1), "agent")
+    second = RunContext(run_data(2), "agent")
+    first.execution_ids.append(3)
+    assert second.execution_ids == [2]
+    assert json.loads(second.status(True, None, "running"))["execution_ids"] == [2]
+
+    first.started()
+    first.executor = SimpleNamespace(name="ex1")
+    assert first.command_json()["params"] == "out=json"
+    assert first.duration >= 0
+    assert second.duration is None
+
+
+@pytest.mark.asyncio
+async def test_run_of_unknown_executor_reports_own_ids():
+    emitted = []
+    namespace = DispatcherNamespace(dispatcher=SimpleNamespace(agent_name="agent", executors={}))
+
+    async def emit(event, data):
+        emitted.append((event, json.loads(data)))
+
+    namespace.emit = emit
+    await namespace.on_run(run_data(7, executor="missing"))
+    assert len(emitted) == 1
+    event, status = emitted[0]
+    assert event == "run_status"
+    assert status["execution_ids"] == [7]
+    assert status["executor_name"] == "missing"
+    assert status["successful"] is False
+
+
+@pytest.mark.asyncio
+async def test_cancel_queued_run():
+    emitted = []
+
+    async def check_cmds():
+        return True
+
+    executor = SimpleNamespace(name="ex1", params={}, check_cmds=check_cmds)
+    dispatcher = SimpleNamespace(
+        agent_name="agent", executors={"ex1": executor}, runs={}, scheduler=RunScheduler(max_concurrent_runs=1)
+    )
+    namespace = DispatcherNamespace(dispatcher=dispatcher)
+
+    async def emit(event, data):
+        emitted.append(json.loads(data))
+
+    namespace.emit = emit
+    await dispatcher.scheduler.acquire(RunContext(run_data(1), "agent"))
+    data = run_data(2)
+    data["args"] = {}
+    task = asyncio.create_task(namespace.on_run(data))
+    await asyncio.sleep(0.01)
+    assert dispatcher.runs[2].process is None
+    await namespace.on_cancel({"execution_ids": [2]})
+    await task
+    assert [status.get("stop_reason") for status in emitted] == [None, "cancelled"]
+    assert emitted[0]["queued"] and emitted[0]["position"] == 1
+    assert dispatcher.runs == {}
+
+
+@pytest.mark.asyncio
+async def test_cancel_while_spawning_terminates_the_process(tmp_default_config):  # noqa F811
+    emitted = []
+    processes = []
+    spawning = asyncio.Event()
+
+    async def create_process(*args, **kwargs):
+        spawning.set()
+        await asyncio.sleep(0.1)
+        processes.append(await Dispatcher.create_process(*args, **kwargs))
+        return processes[-1]
+
+    executor = Executor("ex1", {"cmd": "sleep 30"})
+    dispatcher = SimpleNamespace(
+        agent_name="agent",
+        executors={"ex1": executor},
+        runs={},
+        scheduler=RunScheduler(),
+        create_process=create_process,
+        session=None,
+        spool=None,
+        api_ssl_enabled=False,
+        api_kwargs={},
+        delta_filter=lambda run: None,
+        result_validator=lambda executor: None,
+    )
+    namespace = DispatcherNamespace(dispatcher=dispatcher)
+
+    async def emit(event, data):
+        emitted.append(json.loads(data))
+
+    namespace.emit = emit
+    data = run_data(3)
+    data["args"] = {}
+    task = asyncio.create_task(namespace.on_run(data))
+    await spawning.wait()
+    await namespace.on_cancel({"execution_ids": [3]})
+    await asyncio.wait_for(task, 10)
+    assert processes[0].returncode is not None
+    assert emitted[-1]["stop_reason"] == "cancelled" and emitted[-1]["successful"] is False
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Process groups are POSIX only")
+@pytest.mark.asyncio
+async def test_timeout_kills_the_process_group(tmp_default_config, monkeypatch):  # noqa F811
+    emitted = []
+    processes = []
+    killed = []
+
+    async def terminate(process):
+        # Keep the SIGKILL escalation of the test short
+        killed.append(await terminate_process_group(process, grace=0.5))
+        return killed[-1]
+
+    monkeypatch.setattr(dispatcher_io, "terminate_process_group", terminate)
+
+    async def create_process(*args, **kwargs):
+        processes.append(await Dispatcher.create_process(*args, **kwargs))
+        return processes[-1]
+
+    # The shell and its child ignore SIGTERM
+    executor = Executor("ex1", {"cmd": "trap '' TERM; sleep 30 & while true; do sleep 0.1; done", "timeout": 0.3})
+    dispatcher = SimpleNamespace(
+        agent_name="agent",
+        executors={"ex1": executor},
+        runs={},
+        scheduler=RunScheduler(),
+        create_process=create_process,
+        session=None,
+        spool=None,
+        api_ssl_enabled=False,
+        api_kwargs={},
+        delta_filter=lambda run: None,
+        result_validator=lambda executor: None,
+    )
+    namespace = DispatcherNamespace(dispatcher=dispatcher)
+
+    async def emit(event, data):
+        emitted.append(json.loads(data))
+
+    namespace.emit = emit
+    data = run_data(4)
+    data["args"] = {}
+    await asyncio.wait_for(namespace.on_run(data), 10)
+    assert emitted[-1]["stop_reason"] == "timeout" and emitted[-1]["successful"] is False
+    assert killed == [True]
+    await asyncio.sleep(0.1)
+    assert not group_alive(processes[0].pid)
+
+
+@pytest.mark.asyncio
+async def test_failed_status_has_stderr_tail():
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-c",
+        "import sys\nfor i in range(100): print(f'error {i}', file=sys.stderr)",
+        stderr=asyncio.subprocess.PIPE,
+    )
+    run = RunContext(run_data(1), "agent")
+    run.stderr_processor = StdErrLineProcessor(process, SimpleNamespace(stderr_tail=3, stderr_rate=10))
+    await run.stderr_processor.process_f()
+    await process.wait()
+    assert 80 <= run.stderr_processor.suppressed <= 90
+    assert json.loads(run.status(False, False, "failed"))["stderr_tail"] == ["error 97", "error 98", "error 99"]
+    assert "stderr_tail" not in json.loads(run.status(False, True, "finished"))
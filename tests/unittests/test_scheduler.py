@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from faraday_agent_dispatcher.run_context import RunContext
+from faraday_agent_dispatcher.scheduler import RunScheduler
+
+
+def new_run(execution_id, executor="ex1", priority=0):
+    return RunContext(
+        {"execution_ids": [execution_id], "workspaces": ["ws"], "executor": executor, "priority": priority},
+        "agent",
+    )
+
+
+@pytest.mark.asyncio
+async def test_scheduler_limits_and_priority_order():
+    scheduler = RunScheduler(max_concurrent_runs=2, executor_limits={"ex1": 1})
+    started = []
+    queued = {}
+    release = asyncio.Event()
+
+    async def run_f(run):
+        started.append(run.execution_ids[0])
+        await release.wait()
+
+    async def on_queued(run, position):
+        queued[run.execution_ids[0]] = position
+
+    runs = [new_run(1), new_run(2), new_run(3, executor="ex2"), new_run(4, executor="ex2", priority=5)]
+    tasks = []
+    for run in runs:
+        tasks.append(asyncio.create_task(scheduler.run(run, run_f, on_queued)))
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+    # The ex1 limit holds run 2 back, but not run 3 of another executor
+    assert started == [1, 3]
+    assert queued == {2: 1, 4: 1}
+    assert scheduler.stats()["running"] == 2 and scheduler.stats()["waiting"] == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    # Run 4 has a higher priority than run 2
+    assert started == [1, 3, 4, 2]
+    stats = scheduler.stats()
+    assert stats["running"] == 0 and stats["started_runs"] == 4 and stats["queued_runs"] == 2
+    assert runs[1].wait_time > 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_cancelled_waiting_run_frees_its_place():
+    scheduler = RunScheduler(max_concurrent_runs=1)
+    release = asyncio.Event()
+
+    async def run_f(run):
+        await release.wait()
+
+    first = asyncio.create_task(scheduler.run(new_run(1), run_f))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(scheduler.run(new_run(2), run_f))
+    await asyncio.sleep(0)
+    second.cancel()
+    await asyncio.gather(second, return_exceptions=True)
+    assert scheduler.stats()["waiting"] == 0
+
+    # Cancelled while its queued status is being sent
+    emitting = asyncio.Event()
+
+    async def on_queued(run, position):
+        emitting.set()
+        await asyncio.Event().wait()
+
+    third = asyncio.create_task(scheduler.run(new_run(3), run_f, on_queued))
+    await emitting.wait()
+    third.cancel()
+    await asyncio.gather(third, return_exceptions=True)
+    assert scheduler.stats()["waiting"] == 0
+
+    # Granted while its queued status is being sent, and then cancelled
+    emitting.clear()
+    fourth = asyncio.create_task(scheduler.run(new_run(4), run_f, on_queued))
+    await emitting.wait()
+    release.set()
+    await first
+    assert scheduler.stats()["running"] == 1
+    fourth.cancel()
+    await asyncio.gather(fourth, return_exceptions=True)
+    assert scheduler.stats()["running"] == 0
+    assert scheduler.stats()["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_invalid_priority_falls_back_to_zero():
+    scheduler = RunScheduler()
+    run = new_run(1, priority="high")
+    assert scheduler.priority(run) == 0
+    assert scheduler.priority(new_run(2, priority="3")) == 3
+
+    async def run_f(run):
+        return run.execution_ids[0]
+
+    assert await scheduler.run(run, run_f) == 1
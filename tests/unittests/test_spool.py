@@ -0,0 +1,145 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from faraday_agent_dispatcher import spool as spool_module
+from faraday_agent_dispatcher.result_channel import ResultFile
+from faraday_agent_dispatcher.spool import Spool, read_records
+from faraday_agent_dispatcher.uploader import BulkCreateUploader
+from tests.unittests.test_uploader import bulk_data, set_server_config
+from tests.utils.testing_faraday_server import (  # noqa: F401
+    FaradayTestConfig,
+    test_config,
+    tmp_default_config,
+)
+
+
+def body(index: int) -> bytes:
+    return json.dumps({"hosts": [{"ip": f"10.0.0.{index}"}]}).encode()
+
+
+@pytest.mark.asyncio
+async def test_spool_segment_records(tmp_path):
+    spool = Spool(tmp_path)
+    for index in range(3):
+        assert await spool.append("run", "ws", body(index))
+    await spool.close("run")
+    segment = spool.pending()[0]
+    assert [json.loads(record[1])["hosts"][0]["ip"] for record in read_records(segment)] == [
+        "10.0.0.0",
+        "10.0.0.1",
+        "10.0.0.2",
+    ]
+    # A torn record at the end is ignored
+    with segment.open("ab") as segment_file:
+        segment_file.write(b'{"workspace": "ws", "size": 100}\n{"hosts"')
+    assert len(list(read_records(segment))) == 3
+    assert spool.size == Spool(tmp_path).size - len(b'{"workspace": "ws", "size": 100}\n{"hosts"')
+
+
+@pytest.mark.asyncio
+async def test_spool_evicts_oldest_segments(tmp_path):
+    spool = Spool(tmp_path, max_size=150)
+    await spool.append("1_old", "ws", body(1))
+    await spool.close("1_old")
+    await spool.append("2_new", "ws", body(2))
+    await spool.close("2_new")
+    await spool.append("3_newer", "ws", body(3))
+    assert [segment.stem for segment in spool.segments()] == ["2_new", "3_newer"]
+    assert not await spool.append("3_newer", "ws", b"x" * 500)
+
+
+@pytest.mark.asyncio
+async def test_spool_io_does_not_block_the_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool_module.os, "fsync", lambda fd: time.sleep(0.2))
+    spool = Spool(tmp_path, fsync_every=1)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker_task = asyncio.create_task(ticker())
+    assert await spool.append("run", "ws", body(1))
+    await spool.close("run")
+    ticker_task.cancel()
+    # The loop kept running during the 0.4 seconds of fsyncs
+    assert ticks > 10
+
+
+@pytest.mark.asyncio
+async def test_spool_streams_result_files(tmp_path):
+    result_path = tmp_path / "result.json"
+    result_path.write_bytes(body(1))
+    result_file = ResultFile(result_path).with_envelope({"execution_id": 1})
+    spool = Spool(tmp_path / "spool")
+    assert await spool.append_stream("run", "ws", result_file.size, result_file.chunks(chunk_size=4))
+    [(workspace, data, _)] = read_records(spool.pending()[0])
+    assert workspace == "ws" and data == await result_file.read()
+    assert spool.size == Spool(tmp_path / "spool").size
+
+    # A body shorter than announced is not spooled
+    assert not await spool.append_stream("run", "ws", result_file.size + 1, result_file.chunks())
+    assert len(spool.segments()) == 1 and not list((tmp_path / "spool").glob("*.partial"))
+
+
+@pytest.mark.asyncio
+async def test_spool_replay_in_order_and_resume(tmp_path):
+    spool = Spool(tmp_path)
+    for index in range(4):
+        await spool.append("run", "ws", body(index))
+    await spool.append("open_run", "ws", body(9))
+    await spool.close("run")
+    received = []
+    statuses = iter([201, 201, 503])
+
+    async def post_f(workspace, data):
+        status = next(statuses, 201)
+        if status == 201:
+            received.append(json.loads(data)["hosts"][0]["ip"])
+        return status
+
+    await spool.replay(post_f)
+    assert received == ["10.0.0.0", "10.0.0.1"]
+    assert len(spool.segments()) == 2
+
+    await spool.replay(post_f)
+    assert received == ["10.0.0.0", "10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    # The segment of a running execution is not replayed
+    assert [segment.stem for segment in spool.segments()] == ["open_run"]
+
+
+@pytest.mark.asyncio
+async def test_uploader_spools_retryable_errors(
+    test_config: FaradayTestConfig,  # noqa F811
+    tmp_default_config,  # noqa F811
+    tmp_path,
+):
+    if test_config.is_ssl:
+        pytest.skip("Covered without SSL")
+    set_server_config(test_config)
+    spool = Spool(tmp_path)
+    uploader = BulkCreateUploader(
+        test_config.client.session,
+        [1, 2],
+        ["error429", "error500"],
+        False,
+        {},
+        {"tool": "test"},
+        spool=spool,
+    )
+    uploader.start()
+    await uploader.put(bulk_data())
+    await uploader.join()
+    await uploader.close()
+    assert uploader.summary() == {
+        "error429": {"sent": 0, "failed": 1, "spooled": 1},
+        "error500": {"sent": 0, "failed": 1, "spooled": 0},
+    }
+    records = list(read_records(spool.pending()[0]))
+    assert [record[0] for record in records] == ["error429"]
+    assert json.loads(records[0][1])["execution_id"] == 1
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+from faraday_agent_dispatcher import __version__
+from tests.benchmarks.startup import CLI_MODULE, IMPORTTIME_BUDGET, best_profile, eager_modules
+
+
+def test_cli_startup_is_within_budget(tmp_path):
+    env = {"FARADAY_HOME": str(tmp_path / "faraday")}
+    profile = best_profile(3, env=env)
+    assert eager_modules(profile) == []
+    assert profile[CLI_MODULE] < IMPORTTIME_BUDGET, f"{profile[CLI_MODULE] / 1000:.1f}ms importing the CLI"
+
+    version = subprocess.run(
+        [sys.executable, "-m", CLI_MODULE, "--version"], env={**os.environ, **env}, stdout=subprocess.PIPE, check=True
+    )
+    assert __version__ in version.stdout.decode()
+    # Importing the CLI does not create the configuration folders
+    assert not (tmp_path / "faraday").exists()
@@ -0,0 +1,370 @@
+import asyncio
+import gzip
+import json
+import time
+import zlib
+
+import pytest
+
+from faraday_agent_dispatcher.config import instance as configuration, Sections
+from faraday_agent_dispatcher.delta import DeltaFilter, FingerprintStore
+from faraday_agent_dispatcher.host_merge import HostMergeIndex
+from faraday_agent_dispatcher.result_channel import ResultFile
+from faraday_agent_dispatcher.uploader import (
+    BulkCreateBatcher,
+    BulkCreateUploader,
+    EncodedPayload,
+    GZIP_CHUNK_SIZE,
+)
+from faraday_agent_dispatcher.utils import json_utils
+from faraday_agent_dispatcher.utils.rate_utils import RateLimiter
+from tests.data.basic_executor import host_data, vuln_data
+from tests.utils.testing_faraday_server import (  # noqa: F401
+    FaradayTestConfig,
+    test_config,
+    tmp_default_config,
+    test_logger_handler,
+)
+
+
+def set_server_config(test_config: FaradayTestConfig):  # noqa F811
+    if test_config.base_route:
+        configuration[Sections.SERVER]["base_route"] = test_config.base_route
+    configuration[Sections.SERVER]["host"] = test_config.client.host
+    configuration[Sections.SERVER]["api_port"] = str(test_config.client.port)
+    configuration[Sections.TOKENS] = {"agent": test_config.agent_token}
+    configuration[Sections.SERVER]["retry_base_delay"] = "0.01"
+    configuration[Sections.SERVER]["retry_max_delay"] = "0.05"
+
+
+def bulk_data():
+    _host_data = host_data.copy()
+    _host_data["vulnerabilities"] = [vuln_data.copy()]
+    return {"hosts": [_host_data]}
+
+
+def build_uploader(test_config: FaradayTestConfig, workspaces=None, **kwargs):  # noqa F811
+    workspaces = workspaces or test_config.workspaces
+    return BulkCreateUploader(
+        test_config.client.session,
+        list(range(len(workspaces))),
+        workspaces,
+        False,
+        {},
+        {"tool": "test"},
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_paces_without_blocking():
+    limiter = RateLimiter(20)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker_task = asyncio.create_task(ticker())
+    start = time.monotonic()
+    for _ in range(5):
+        await limiter.acquire()
+    elapsed = time.monotonic() - start
+    ticker_task.cancel()
+    assert elapsed >= 0.15
+    assert ticks > 5
+
+
+def test_rate_limiter_disabled():
+    limiter = RateLimiter(0)
+    assert all(limiter.try_acquire() for _ in range(100))
+
+
+@pytest.mark.asyncio
+async def test_uploader_sends_every_queued_payload(
+    test_config: FaradayTestConfig,  # noqa F811
+    tmp_default_config,  # noqa F811
+    test_logger_handler,  # noqa F811
+):
+    if test_config.is_ssl:
+        pytest.skip("Covered without SSL")
+    set_server_config(test_config)
+    uploader = build_uploader(test_config, workers=3, queue_size=2)
+    uploader.start()
+    for _ in range(6):
+        await uploader.put(bulk_data())
+    await uploader.join()
+    await uploader.close()
+    sent = [record for record in test_logger_handler.history if "Data sent to bulk create" in record.message]
+    assert len(sent) == 6 * len(test_config.workspaces)
+
+
+@pytest.mark.asyncio
+async def test_uploader_workspaces_summary(
+    test_config: FaradayTestConfig,  # noqa F811
+    tmp_default_config,  # noqa F811
+):
+    if test_config.is_ssl:
+        pytest.skip("Covered without SSL")
+    set_server_config(test_config)
+    workspaces = test_config.workspaces + ["error500"]
+    uploader = build_uploader(test_config, workspaces=workspaces, workspace_concurrency=2)
+    uploader.start()
+    for _ in range(3):
+        await uploader.put(bulk_data())
+    await uploader.join()
+    await uploader.send({"hosts": []}, track=False)
+    await uploader.close()
+    summary = uploader.summary()
+    assert summary.pop("error500") == {"sent": 0, "failed": 3, "spooled": 0}
+    assert all(stats == {"sent": 3, "failed": 0, "spooled": 0} for stats in summary.values())
+
+
+@pytest.mark.asyncio
+async def test_batcher_merges_hosts_by_lines_count():
+    flushed = []
+
+    async def flush_f(payload):
+        flushed.append(payload)
+
+    batcher = BulkCreateBatcher(flush_f, max_lines=3, timeout=0)
+    for index in range(7):
+        await batcher.add({"hosts": [{"ip": f"10.0.0.{index}"}], "command": {}}, 30)
+    assert [len(payload["hosts"]) for payload in flushed] == [3, 3]
+    await batcher.close()
+    assert [len(payload["hosts"]) for payload in flushed] == [3, 3, 1]
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_by_size_time_and_unmergeable_payloads():
+    flushed = []
+
+    async def flush_f(payload):
+        flushed.append(payload)
+
+    batcher = BulkCreateBatcher(flush_f, max_lines=100, max_bytes=50, timeout=0.05)
+    await batcher.add({"hosts": [{"ip": "10.0.0.1"}]}, 30)
+    await batcher.add({"hosts": [{"ip": "10.0.0.2"}]}, 30)
+    assert len(flushed) == 1 and len(flushed[0]["hosts"]) == 2
+
+    await batcher.add({"hosts": [{"ip": "10.0.0.3"}]}, 30)
+    await asyncio.sleep(0.1)
+    assert len(flushed) == 2
+
+    await batcher.add({"hosts": [{"ip": "10.0.0.4"}]}, 30)
+    await batcher.add({"hosts": [], "extra": True}, 30)
+    assert flushed[2] == {"hosts": [{"ip": "10.0.0.4"}]}
+    assert flushed[3] == {"hosts": [], "extra": True}
+    batcher.cancel()
+
+
+@pytest.mark.asyncio
+async def test_uploader_gzip_bodies(
+    test_config: FaradayTestConfig,  # noqa F811
+    tmp_default_config,  # noqa F811
+    test_logger_handler,  # noqa F811
+):
+    if test_config.is_ssl:
+        pytest.skip("Covered without SSL")
+    set_server_config(test_config)
+    configuration[Sections.SERVER]["compress_uploads"] = True
+    BulkCreateUploader.compression_supported = True
+    uploader = build_uploader(test_config)
+    uploader.start()
+    await uploader.put(bulk_data())
+    await uploader.join()
+    assert uploader.summary() == {
+        workspace: {"sent": 1, "failed": 0, "spooled": 0} for workspace in test_config.workspaces
+    }
+    assert BulkCreateUploader.compression_supported
+
+    fallback_uploader = build_uploader(test_config, workspaces=["nogzip"])
+    fallback_uploader.start()
+    await fallback_uploader.put(bulk_data())
+    await fallback_uploader.join()
+    await uploader.close()
+    await fallback_uploader.close()
+    assert fallback_uploader.summary() == {"nogzip": {"sent": 1, "failed": 0, "spooled": 0}}
+    assert not BulkCreateUploader.compression_supported
+    BulkCreateUploader.compression_supported = True
+
+
+@pytest.mark.asyncio
+async def test_encoded_payload_splices_envelopes(monkeypatch):
+    payload = {"hosts": [bulk_data()["hosts"][0] for _ in range(500)], "command": {"tool": "ignored"}}
+    encoded = EncodedPayload(payload)
+    encodes = []
+    monkeypatch.setattr(json_utils, "dumps_bytes", lambda obj: encodes.append(obj) or json.dumps(obj).encode())
+    for execution_id in range(4):
+        envelope = {"execution_id": execution_id, "command": {"tool": "test"}}
+        workspace_payload = encoded.with_envelope(envelope)
+        expected = {"hosts": payload["hosts"], **envelope}
+        assert json.loads(await workspace_payload.read()) == expected
+        streamed = b"".join([chunk async for chunk in workspace_payload.chunks()])
+        assert json.loads(streamed) == expected
+        body = b"".join([chunk async for chunk in workspace_payload.gzip_chunks()])
+        assert json.loads(gzip.decompress(body)) == expected
+    # Only the small envelopes are encoded again for every workspace
+    assert all("hosts" not in obj for obj in encodes)
+    # Only the encoded hosts are kept, the body is streamed from them
+    assert not hasattr(encoded, "body") and len(encoded.hosts) == 500
+    assert encoded.size == len(await encoded.read()) > GZIP_CHUNK_SIZE
+    empty = EncodedPayload({}).with_envelope({"execution_id": 1})
+    assert json.loads(await empty.read()) == {"execution_id": 1}
+    assert json.loads(await EncodedPayload({"hosts": []}).read()) == {"hosts": []}
+
+
+@pytest.mark.asyncio
+async def test_uploader_streams_result_files(
+    test_config: FaradayTestConfig,  # noqa F811
+    tmp_default_config,  # noqa F811
+    tmp_path,
+):
+    if test_config.is_ssl:
+        pytest.skip("Covered without SSL")
+    set_server_config(test_config)
+    result_path = tmp_path / "result.json"
+    result_path.write_text(json.dumps(bulk_data()))
+    for compress in (False, True):
+        configuration[Sections.SERVER]["compress_uploads"] = compress
+        uploader = build_uploader(test_config)
+        uploader.start()
+        await uploader.put(ResultFile(result_path))
+        await uploader.join()
+        await uploader.close()
+        assert uploader.summary() == {
+            workspace: {"sent": 1, "failed": 0, "spooled": 0} for workspace in test_config.workspaces
+        }
+
+
+@pytest.mark.asyncio
+async def test_batcher_merges_duplicated_hosts():
+    flushed = []
+
+    async def flush_f(payload):
+        flushed.append(payload)
+
+    def host(ip, hostname, port, vuln_name):
+        service = {"name": "http", "port": port, "protocol": "tcp", "vulnerabilities": [{"name": vuln_name}]}
+        return {"ip": ip, "hostnames": [hostname], "services": [service], "vulnerabilities": [{"name": "open"}]}
+
+    batcher = BulkCreateBatcher(flush_f, max_bytes=1024, timeout=0, merge_hosts=True)
+    await batcher.add({"hosts": [host("10.0.0.1", "a.com", 80, "xss")]}, 100)
+    await batcher.add({"hosts": [host("10.0.0.1", "b.com", 80, "sqli"), host("10.0.0.2", "c.com", 22, "weak")]}, 100)
+    await batcher.add({"hosts": [host("10.0.0.1", "a.com", 443, "xss"), {"description": "no ip"}]}, 100)
+    assert flushed == []
+    await batcher.close()
+    hosts = flushed[0]["hosts"]
+    assert [merged.get("ip") for merged in hosts] == ["10.0.0.1", "10.0.0.2", None]
+    assert hosts[0]["hostnames"] == ["a.com", "b.com"]
+    assert hosts[0]["vulnerabilities"] == [{"name": "open"}]
+    services = hosts[0]["services"]
+    assert [(service["port"], len(service["vulnerabilities"])) for service in services] == [(80, 2), (443, 1)]
+
+
+def test_host_merge_index_by_hostname():
+    index = HostMergeIndex()
+    index.add({"hostnames": ["a.com"], "services": [{"port": 80, "protocol": "tcp", "name": "http"}]})
+    index.add({"ip": "10.0.0.1", "hostnames": ["a.com", "www.a.com"], "services": [{"port": 80, "protocol": "TCP"}]})
+    index.add({"ip": "www.a.com", "vulnerabilities": [{"name": "xss"}]})
+    index.add({"hostnames": ["b.com"]})
+    index.add({"hostnames": ["b.com", "c.com"], "vulnerabilities": [{"name": "sqli"}]})
+    # A hostname in common does not merge hosts with different IPs
+    index.add({"ip": "10.0.0.2", "hostnames": ["a.com"]})
+    index.add({"description": "no ip nor hostnames"})
+    assert index.merged == 3
+    hosts = index.pop_hosts()
+    assert [host.get("ip") for host in hosts] == ["10.0.0.1", None, "10.0.0.2", None]
+    assert hosts[0]["hostnames"] == ["a.com", "www.a.com"]
+    assert hosts[0]["services"] == [{"port": 80, "protocol": "tcp", "name": "http"}]
+    assert hosts[0]["vulnerabilities"] == [{"name": "xss"}]
+    assert hosts[1] == {"hostnames": ["b.com", "c.com"], "vulnerabilities": [{"name": "sqli"}]}
+
+
+@pytest.mark.asyncio
+async def test_uploader_sends_only_new_records(
+    test_config: FaradayTestConfig,  # noqa F811
+    tmp_default_config,  # noqa F811
+    tmp_path,
+):
+    if test_config.is_ssl:
+        pytest.skip("Covered without SSL")
+    set_server_config(test_config)
+    store = FingerprintStore(tmp_path / "delta.sqlite")
+    for run in range(2):
+        delta = DeltaFilter(store, "ex1", test_config.workspaces)
+        uploader = build_uploader(test_config, delta=delta)
+        uploader.start()
+        await uploader.put(bulk_data())
+        await uploader.join()
+        await uploader.send({"hosts": []}, track=False)
+        delta.finish()
+        await uploader.close()
+    # The second run had nothing new to send
+    assert uploader.summary() == {
+        workspace: {"sent": 0, "failed": 0, "spooled": 0} for workspace in test_config.workspaces
+    }
+    assert all(skipped["hosts"] == 1 for skipped in delta.summary().values())
+    store.close()
+
+
+def test_encoded_payload_split():
+    payload = EncodedPayload({"hosts": [{"ip": f"10.0.0.{index}"} for index in range(10)], "extra": 1})
+    assert payload.split() == [payload]
+    chunks = payload.split(max_hosts=4)
+    assert [len(chunk.hosts) for chunk in chunks] == [4, 4, 2]
+    # The other members go only in the first chunk
+    assert [chunk.members for chunk in chunks] == [b'"extra":1', b"", b""]
+    chunks = payload.split(max_bytes=EncodedPayload.ENVELOPE_SIZE + 70)
+    assert all(chunk.size <= 70 for chunk in chunks) and sum(len(chunk.hosts) for chunk in chunks) == 10
+
+
+@pytest.mark.asyncio
+async def test_uploader_splits_once_for_every_workspace(
+    test_config: FaradayTestConfig,  # noqa F811
+    tmp_default_config,  # noqa F811
+    monkeypatch,
+):
+    if test_config.is_ssl:
+        pytest.skip("Covered without SSL")
+    set_server_config(test_config)
+    configuration[Sections.SERVER]["compress_uploads"] = True
+    built = []
+    from_parts = EncodedPayload.from_parts.__func__
+    monkeypatch.setattr(
+        EncodedPayload, "from_parts", classmethod(lambda cls, *args: built.append(args) or from_parts(cls, *args))
+    )
+    compressors = []
+    compressobj = zlib.compressobj
+    monkeypatch.setattr(
+        zlib, "compressobj", lambda *args, **kwargs: compressors.append(1) or compressobj(*args, **kwargs)
+    )
+    uploader = build_uploader(test_config, max_hosts=2)
+    uploader.start()
+    await uploader.put({"hosts": bulk_data()["hosts"] * 6})
+    await uploader.join()
+    await uploader.close()
+    assert uploader.summary() == {
+        workspace: {"sent": 3, "failed": 0, "spooled": 0} for workspace in test_config.workspaces
+    }
+    # The chunks and their gzip bodies are shared by every workspace
+    assert len(built) == 3 and len(compressors) == 3
+
+
+@pytest.mark.asyncio
+async def test_uploader_halves_payloads_too_large(
+    test_config: FaradayTestConfig,  # noqa F811
+    tmp_default_config,  # noqa F811
+):
+    if test_config.is_ssl:
+        pytest.skip("Covered without SSL")
+    set_server_config(test_config)
+    uploader = build_uploader(test_config, workspaces=["toolarge"])
+    uploader.start()
+    await uploader.put({"hosts": bulk_data()["hosts"] * 8})
+    await uploader.join()
+    await uploader.close()
+    assert uploader.summary() == {"toolarge": {"sent": 4, "failed": 0, "spooled": 0}}
+    assert 0 < uploader.max_bytes < len(json.dumps(bulk_data()["hosts"] * 4))
@@ -0,0 +1,41 @@
+import json
+from types import SimpleNamespace
+
+from faraday_agent_dispatcher.dispatcher_io import Dispatcher
+from faraday_agent_dispatcher.validation import ResultValidator
+from tests.data.basic_executor import host_data, vuln_data
+
+
+def test_invalid_records_are_dropped_and_quarantined(tmp_path):
+    quarantine_path = tmp_path / "quarantine" / "ex1.ndjson"
+    validator = ResultValidator("ex1", quarantine_path)
+    host = dict(host_data, vulnerabilities=[vuln_data, {"desc": "no name"}])
+    host["services"] = [
+        {"name": "http", "port": 80, "protocol": "tcp", "vulnerabilities": [vuln_data]},
+        {"name": "bad", "port": "http", "protocol": "tcp"},
+    ]
+    payload = {"hosts": [host, {"description": "no ip"}, "not a host"]}
+    cleaned = validator.clean(payload)
+    assert [valid_host["ip"] for valid_host in cleaned["hosts"]] == [host_data["ip"]]
+    assert cleaned["hosts"][0]["vulnerabilities"] == [vuln_data]
+    assert [service["name"] for service in cleaned["hosts"][0]["services"]] == ["http"]
+    assert validator.summary()["hosts"] == {"checked": 3, "invalid": 2}
+    assert validator.summary()["services"] == {"checked": 2, "invalid": 1}
+    assert validator.summary()["vulnerabilities"] == {"checked": 3, "invalid": 1}
+
+    quarantined = [json.loads(line) for line in quarantine_path.read_text().splitlines()]
+    assert sorted(record["kind"] for record in quarantined) == ["hosts", "hosts", "services", "vulnerabilities"]
+    assert all(record["executor"] == "ex1" and record["errors"] for record in quarantined)
+
+    assert validator.clean({"hosts": [{"ip": ""}]}) is None
+    assert validator.clean({"hosts": []}) == {"hosts": []}
+
+
+def test_each_run_counts_its_own_records():
+    executor = SimpleNamespace(name="ex1", validate_results=True, quarantine_results=False)
+    first = Dispatcher.result_validator(executor)
+    first.clean({"hosts": [{"description": "no ip"}]})
+    second = Dispatcher.result_validator(executor)
+    assert second is not first
+    assert second.summary()["hosts"] == {"checked": 0, "invalid": 0}
+    assert Dispatcher.result_validator(SimpleNamespace(name="ex2", validate_results=False)) is None
@@ -80,6 +80,14 @@ class FaradayTestConfig:
             self.wrap_route("/_api/v3/ws/error429/bulk_create"),
             get_bulk_create(self),
         )
+        app.router.add_post(
+            self.wrap_route("/_api/v3/ws/nogzip/bulk_create"),
+            get_bulk_create(self),
+        )
+        app.router.add_post(
+            self.wrap_route("/_api/v3/ws/toolarge/bulk_create"),
+            get_bulk_create(self),
+        )
         app.router.add_get(self.wrap_route("/websockets"), get_ws_handler(self))
 
         server = TestServer(app)
@@ -172,11 +180,15 @@ def get_bulk_create(test_config: FaradayTestConfig):
             return web.HTTPInternalServerError()
         if "error429" in request.url.path:
             return web.HTTPTooManyRequests()
-        if all(workspace not in request.url.path for workspace in test_config.workspaces):
+        if "nogzip" in request.url.path and "Content-Encoding" in request.headers:
+            return web.HTTPUnsupportedMediaType()
+        if all(workspace not in request.url.path for workspace in test_config.workspaces + ["nogzip", "toolarge"]):
             return web.HTTPNotFound()
         _host_data = host_data.copy()
         _host_data["vulnerabilities"] = [vuln_data.copy()]
         data = json.loads((await request.read()).decode())
+        if "toolarge" in request.url.path and len(data["hosts"]) > 2:
+            return web.HTTPRequestEntityTooLarge(max_size=2, actual_size=len(data["hosts"]))
         if "execution_id" not in data:
             return web.HTTPBadRequest()
         if "ip" not in data["hosts"][0]: